@@ -0,0 +1 @@
+"""Benchmarks of maps-cli against a local stand-in of the providers."""
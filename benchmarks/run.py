@@ -0,0 +1,375 @@
+"""Run the benchmarks of maps-cli against a local stand-in of the providers.
+
+Every CLI command and the :class:`maps.apis.apis.Api` layer are benchmarked without
+network access or API quota, see :mod:`benchmarks.server`::
+
+    $ python -m benchmarks.run --latency 0.02 --error_rate 0.01
+
+Measured are the startup time of the ``maps`` executable, the latency of single
+calls, and the throughput of batch commands and concurrent API calls. Results are
+appended with the current commit to a history file and compared to the last run
+with the same settings, so that regressions show up across commits.
+"""
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+import click
+
+from benchmarks.server import FakeProviderServer
+
+#: Single calls of the CLI commands.
+COMMANDS = {
+    "osm-geocoding": ["osm", "geocoding", "--no-cache", "bonn"],
+    "osm-reverse": ["osm", "geocoding", "--reverse", "--no-cache", "50.7,7.1"],
+    "osm-overpass": ["osm", "overpass", "node(50.745,7.17,50.75,7.18);out;"],
+    "mapbox-geocoding": ["mapbox", "geocoding", "--no-cache", "bonn"],
+    "mapbox-reverse": ["mapbox", "geocoding", "--reverse", "--no-cache", "50.7,7.1"],
+    "mapbox-isochrone": [
+        "mapbox",
+        "isochrone",
+        "--profile=driving",
+        "--coordinates=-118.22258,33.99038",
+        "--contours_minutes=5",
+        "--no-cache",
+    ],
+    "mapbox-matrix": [
+        "mapbox",
+        "matrix",
+        "--profile=driving",
+        "--coordinates=-122.42,37.78;-122.45,37.91;-122.48,37.73",
+        "--annotations=distance,duration",
+    ],
+    "here-geocoding": ["here", "geocoding", "--no-cache", "springfield"],
+    "here-reverse": ["here", "geocoding", "--reverse", "--no-cache", "19.16,72.85"],
+    "here-discover": ["here", "discover", "starbucks", "--coordinates=-89.64,39.8"],
+    "here-route": [
+        "here",
+        "route",
+        "--transport_mode=car",
+        "--origin=52.51375,13.42462",
+        "--destination=52.5126,13.4275",
+    ],
+    "tomtom-geocoding": ["tomtom", "geocoding", "--no-cache", "springfield"],
+    "tomtom-reverse": ["tomtom", "geocoding", "--reverse", "--no-cache", "19.16,72.85"],
+    "ors-geocoding": ["ors", "geocoding", "--no-cache", "springfield"],
+    "ors-reverse": ["ors", "geocoding", "--reverse", "--no-cache", "19.16,72.85"],
+}
+
+#: Batch commands, given ``rows`` queries on stdin.
+BATCHES = {
+    "osm-batch-geocoding": ["osm", "batch-geocoding", "--no-cache"],
+    "mapbox-batch-geocoding": ["mapbox", "batch-geocoding", "--no-cache"],
+    "here-batch-geocoding": ["here", "batch-geocoding", "--no-cache"],
+    "tomtom-batch-geocoding": ["tomtom", "batch-geocoding", "--no-cache"],
+    "ors-batch-geocoding": ["ors", "batch-geocoding", "--no-cache"],
+}
+
+#: Metrics where larger values are better, all others are durations.
+THROUGHPUT = "rows_per_second"
+
+ENVIRONMENT = {
+    "MAPBOX_APIKEY": "benchmark",
+    "HERE_APIKEY": "benchmark",
+    "TOMTOM_APIKEY": "benchmark",
+    "ORS_APIKEY": "benchmark",
+}
+
+PROXY_VARIABLES = ("http_proxy", "https_proxy", "all_proxy")
+
+
+def summarize(durations: List[float], failures: int = 0) -> Dict:
+    """Summarize the durations of repeated calls.
+
+    :param durations: Seconds of every call.
+    :param failures: Number of calls which failed.
+    :return: A dict with the median, 95th percentile and minimum in seconds.
+    """
+    ordered = sorted(durations)
+    return {
+        "median": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "min": ordered[0],
+        "failures": failures,
+    }
+
+
+def time_calls(call: Callable[[], bool], rounds: int) -> Dict:
+    """Time repeated calls.
+
+    :param call: A callable without arguments returning whether it succeeded.
+    :param rounds: Number of calls.
+    :return: A summary, see :func:`summarize`.
+    """
+    durations, failures = [], 0
+    for _ in range(rounds):
+        started = time.perf_counter()
+        failures += not call()
+        durations.append(time.perf_counter() - started)
+    return summarize(durations, failures)
+
+
+def bench_startup(rounds: int) -> Dict:
+    """Time the startup of the ``maps`` executable, up to its help text."""
+    command = [sys.executable, "-c", "from maps.commands import maps; maps()", "--help"]
+    return time_calls(
+        lambda: subprocess.run(command, stdout=subprocess.DEVNULL).returncode == 0,
+        rounds,
+    )
+
+
+def bench_command(args: List[str], rounds: int) -> Dict:
+    """Time single calls of a CLI command, in process."""
+    from click.testing import CliRunner
+
+    from maps.commands import maps
+
+    runner = CliRunner()
+    return time_calls(lambda: runner.invoke(maps, args).exit_code == 0, rounds)
+
+
+def bench_batch(args: List[str], rows: int, concurrency: int) -> Dict:
+    """Measure the throughput of a batch command."""
+    from click.testing import CliRunner
+
+    from maps.commands import maps
+
+    lines = ["id,query"] + [f"{row},place {row}" for row in range(rows)]
+    started = time.perf_counter()
+    result = CliRunner().invoke(
+        maps, args + [f"--concurrency={concurrency}", "-"], input="\n".join(lines)
+    )
+    elapsed = time.perf_counter() - started
+    failures = sum('"error"' in line for line in result.output.splitlines())
+    return {
+        "seconds": elapsed,
+        THROUGHPUT: rows / elapsed,
+        "failures": failures + (result.exit_code != 0) * rows,
+    }
+
+
+def bench_api(rounds: int) -> Dict:
+    """Time single calls of the :class:`maps.apis.apis.Api` layer."""
+    from maps.apis.apis import Api
+
+    api = Api(base_url="https://api.mapbox.com", credentials="benchmark")
+
+    def call():
+        try:
+            api.get(path="/geocoding/v5/mapbox.places/bonn.json")
+        except Exception:
+            return False
+        return True
+
+    return time_calls(call, rounds)
+
+
+def bench_async_api(rows: int, concurrency: int) -> Dict:
+    """Measure the throughput of concurrent calls of the async API layer."""
+    from maps.apis.apis import AsyncApi
+    from maps.engine import run
+
+    async def main():
+        api = AsyncApi(base_url="https://api.mapbox.com", credentials="benchmark")
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call(row):
+            async with semaphore:
+                try:
+                    await api.get(path=f"/geocoding/v5/mapbox.places/{row}.json")
+                except Exception:
+                    return False
+                return True
+
+        return await asyncio.gather(*(call(row) for row in range(rows)))
+
+    started = time.perf_counter()
+    results = run(main())
+    elapsed = time.perf_counter() - started
+    return {
+        "seconds": elapsed,
+        THROUGHPUT: rows / elapsed,
+        "failures": results.count(False),
+    }
+
+
+def current_commit() -> Optional[str]:
+    """Return the commit of the working tree, with a ``+`` if it has changes."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}+" if dirty else commit
+
+
+def load_history(path: str) -> List[Dict]:
+    """Read the previous runs from a history file."""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+def compare(results: Dict, previous: Dict) -> Dict[str, float]:
+    """Compare results to a previous run.
+
+    :param results: The results by benchmark name.
+    :param previous: The results of a previous run.
+    :return: The relative slowdown by benchmark name, e.g. ``0.1`` if 10% slower.
+    """
+    changes = {}
+    for name, result in results.items():
+        before = previous.get(name)
+        if not before:
+            continue
+        if THROUGHPUT in result and before.get(THROUGHPUT):
+            changes[name] = before[THROUGHPUT] / result[THROUGHPUT] - 1
+        elif "median" in result and before.get("median"):
+            changes[name] = result["median"] / before["median"] - 1
+    return changes
+
+
+def format_result(result: Dict) -> str:
+    if THROUGHPUT in result:
+        text = f"{result[THROUGHPUT]:10.1f} rows/s"
+    else:
+        text = f"{result['median'] * 1000:9.2f} ms median, {result['p95'] * 1000:.2f} ms p95"
+    if result["failures"]:
+        text += f", {result['failures']} failed"
+    return text
+
+
+@click.command()
+@click.option(
+    "--rounds", default=20, type=click.IntRange(min=1), help="Calls per benchmark."
+)
+@click.option("--rows", default=500, type=click.IntRange(min=1), help="Rows per batch.")
+@click.option("--concurrency", default=16, type=click.IntRange(min=1))
+@click.option("--latency", default=0.0, type=click.FloatRange(min=0), help="Seconds.")
+@click.option("--jitter", default=0.0, type=click.FloatRange(min=0), help="Seconds.")
+@click.option(
+    "--error_rate",
+    default=0.0,
+    type=click.FloatRange(0, 1),
+    help="Share of requests failing with an HTTP 503.",
+)
+@click.option("--seed", default=0, type=int, help="Seed of the latency and errors.")
+@click.option(
+    "-k",
+    "--select",
+    "select",
+    help="Only run benchmarks whose name contains this text.",
+)
+@click.option(
+    "--history",
+    default=".benchmarks/history.jsonl",
+    show_default=True,
+    type=click.Path(dir_okay=False),
+    help="File the results are appended to and compared with.",
+)
+@click.option(
+    "--max_regression",
+    type=float,
+    help="Exit with status 1 if a benchmark is slower than the last run by more than "
+    "this share, e.g. 0.2 for 20%.",
+)
+def main(
+    rounds,
+    rows,
+    concurrency,
+    latency,
+    jitter,
+    error_rate,
+    seed,
+    select,
+    history,
+    max_regression,
+):
+    """Benchmark maps-cli against a local stand-in of the providers."""
+    for variable in PROXY_VARIABLES:
+        os.environ.pop(variable, None)
+        os.environ.pop(variable.upper(), None)
+    os.environ.update(ENVIRONMENT)
+    settings = {
+        "rounds": rounds,
+        "rows": rows,
+        "concurrency": concurrency,
+        "latency": latency,
+        "jitter": jitter,
+        "error_rate": error_rate,
+        "seed": seed,
+    }
+    benchmarks = {"startup": lambda: bench_startup(min(rounds, 10))}
+    benchmarks["api"] = lambda: bench_api(rounds)
+    benchmarks["async-api"] = lambda: bench_async_api(rows, concurrency)
+    for name, args in COMMANDS.items():
+        benchmarks[name] = lambda args=args: bench_command(args, rounds)
+    for name, args in BATCHES.items():
+        benchmarks[name] = lambda args=args: bench_batch(args, rows, concurrency)
+    if select:
+        benchmarks = {name: run for name, run in benchmarks.items() if select in name}
+
+    results = {}
+    server = FakeProviderServer(latency, jitter, error_rate, seed=seed)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ["MAPS_CACHE_DIR"] = cache_dir
+        os.environ["MAPS_REDIRECT_URL"] = server.start()
+        try:
+            for name, run in benchmarks.items():
+                results[name] = run()
+                click.echo(f"{name:24} {format_result(results[name])}")
+        finally:
+            server.stop()
+    if server.stats["unmatched"]:
+        click.secho(
+            f"{server.stats['unmatched']} requests had no recorded response", fg="red"
+        )
+
+    runs = [run for run in load_history(history) if run.get("settings") == settings]
+    changes = compare(results, runs[-1]["results"]) if runs else {}
+    if changes:
+        click.echo(f"\nCompared to {runs[-1]['commit']} ({runs[-1]['time']}):")
+        for name, change in changes.items():
+            color = (
+                "red"
+                if max_regression is not None and change > max_regression
+                else None
+            )
+            click.secho(f"{name:24} {change:+8.1%}", fg=color)
+
+    os.makedirs(os.path.dirname(history) or ".", exist_ok=True)
+    with open(history, "a", encoding="utf-8") as fh:
+        entry = {
+            "commit": current_commit(),
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "settings": settings,
+            "results": results,
+        }
+        fh.write(json.dumps(entry) + "\n")
+
+    if max_regression is not None and any(c > max_regression for c in changes.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""This module defines a local stand-in server of the providers for benchmarks.
+
+Requests redirected with ``MAPS_REDIRECT_URL`` (see :func:`maps.transport.redirect_url`)
+arrive as ``/<host>/<path>`` and are answered with the recorded response of the first
+entry of :data:`ROUTES` matching host and path, after a configurable latency. A
+share of the requests can fail with an injected HTTP error instead.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+from typing import Dict, Optional
+
+from aiohttp import web
+
+RESPONSES = os.path.join(os.path.dirname(__file__), "responses.json")
+
+#: ``(host, path pattern, response name)`` of the endpoints used by maps-cli.
+ROUTES = (
+    ("nominatim.openstreetmap.org", r"/search", "nominatim_search"),
+    ("nominatim.openstreetmap.org", r"/reverse", "nominatim_reverse"),
+    ("overpass-api.de", r"/api/interpreter", "overpass"),
+    (
+        "api.mapbox.com",
+        r"/geocoding/v5/[^/]+/-?[\d.]+,-?[\d.]+\.json",
+        "mapbox_reverse",
+    ),
+    ("api.mapbox.com", r"/geocoding/", "mapbox_geocode"),
+    ("api.mapbox.com", r"/isochrone/", "mapbox_isochrone"),
+    ("api.mapbox.com", r"/directions-matrix/", "mapbox_matrix"),
+    ("geocoder.ls.hereapi.com", r"/", "here_geocode"),
+    ("reverse.geocoder.ls.hereapi.com", r"/", "here_reverse"),
+    ("discover.search.hereapi.com", r"/", "here_discover"),
+    ("router.hereapi.com", r"/v8/routes", "here_routes"),
+    ("api.tomtom.com", r"/search/2/reverseGeocode/", "tomtom_reverse"),
+    ("api.tomtom.com", r"/search/2/geocode/", "tomtom_geocode"),
+    ("api.openrouteservice.org", r"/geocode/reverse", "ors_reverse"),
+    ("api.openrouteservice.org", r"/geocode/search", "ors_search"),
+)
+
+
+class FakeProviderServer:
+    """An HTTP server replaying recorded provider responses, run in a thread.
+
+    :param latency: Seconds waited before every response.
+    :param jitter: Maximum random seconds added to the latency.
+    :param error_rate: Share of the requests answered with ``error_status``.
+    :param error_status: HTTP status code of injected errors.
+    :param seed: Seed of the random latency and errors, for repeatable runs.
+    :param responses: Path of the JSON file of recorded responses by name.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        seed: Optional[int] = None,
+        responses: str = RESPONSES,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stats: Dict[str, int] = {"requests": 0, "errors": 0, "unmatched": 0}
+        self._random = random.Random(seed)
+        with open(responses, encoding="utf-8") as fh:
+            self._responses = {
+                name: json.dumps(body).encode("utf-8")
+                for name, body in json.load(fh).items()
+            }
+        self._routes = [
+            (host, re.compile(pattern), name) for host, pattern, name in ROUTES
+        ]
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+        self.url: Optional[str] = None
+
+    def match(self, host: str, path: str) -> Optional[str]:
+        """Find the recorded response of a request.
+
+        :param host: The host of the original request.
+        :param path: The path of the original request.
+        :return: The name of the response or ``None``.
+        """
+        for route_host, pattern, name in self._routes:
+            if host == route_host and pattern.match(path):
+                return name
+        return None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.stats["requests"] += 1
+        delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return web.Response(status=self.error_status, text="injected error")
+        host, _, path = request.match_info["tail"].partition("/")
+        name = self.match(host, f"/{path}")
+        if name is None:
+            self.stats["unmatched"] += 1
+            return web.Response(status=404, text=f"no recorded response for {host}")
+        return web.Response(body=self._responses[name], content_type="application/json")
+
+    async def _start(self, host: str, port: int) -> None:
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start serving in a background thread.
+
+        :param host: The interface to listen on.
+        :param port: The port, ``0`` for a free one.
+        :return: The base URL of the server, to be set as ``MAPS_REDIRECT_URL``.
+        """
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self._start(host, port))
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self) -> None:
+        """Stop the server and its thread."""
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    def __enter__(self) -> "FakeProviderServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
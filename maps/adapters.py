@@ -0,0 +1,69 @@
+"""This module defines geopy adapters which use the shared transport of
+:mod:`maps.transport`."""
+from contextlib import asynccontextmanager
+
+from geopy.adapters import AioHTTPAdapter, BaseSyncAdapter, RequestsAdapter
+
+from maps.cassette import Cassette, ReplayResponse
+from maps.retry import asend
+from maps.transport import get_async_session, get_session, redirect_url
+
+
+class PooledRequestsAdapter(RequestsAdapter):
+    """A geopy adapter which sends requests through the shared session.
+
+    Pass it as ``adapter_factory`` to a geopy geocoder.
+    """
+
+    def __init__(self, *, proxies, ssl_context):
+        # Skip RequestsAdapter.__init__, which would create a session of its own.
+        BaseSyncAdapter.__init__(self, proxies=proxies, ssl_context=ssl_context)
+        self.session = get_session()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Keep the shared session open."""
+
+    def __del__(self):
+        """Keep the shared session open."""
+
+
+class PooledAioHTTPAdapter(AioHTTPAdapter):
+    """A geopy adapter which sends requests through the shared aiohttp session of the
+    running event loop.
+
+    Pass it as ``adapter_factory`` to a geopy geocoder to make it return coroutines.
+    """
+
+    def __init__(self, *, proxies, ssl_context):
+        super().__init__(
+            proxies=proxies or get_session().proxies, ssl_context=ssl_context
+        )
+
+    @property
+    def session(self):
+        """The shared aiohttp session of the running event loop."""
+        return get_async_session()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        """Keep the shared session open."""
+
+    @asynccontextmanager
+    async def _request(self, url, *, timeout, headers):
+        cassette = Cassette.from_env()
+        if cassette is not None:
+            key = cassette.key("GET", url)
+            recording = cassette.lookup(key)
+            if recording is not None:
+                yield ReplayResponse(recording, url)
+                return
+        request = super()._request
+        url = redirect_url(url)
+        resp = await asend(
+            lambda: request(url, timeout=timeout, headers=headers), "GET", url
+        )
+        async with resp:
+            if cassette is not None:
+                content_type = resp.headers.get("Content-Type")
+                content = await resp.read()
+                cassette.record(key, resp.status, resp.reason, content_type, content)
+            yield resp
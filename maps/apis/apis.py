@@ -1,19 +1,34 @@
 """This module defines base classes for APIs."""
 
-import urllib.request
-from typing import Dict, Optional
+import json as _json
+from typing import TYPE_CHECKING, Any, Dict, Optional
 
 import requests
 
+from maps.cassette import Cassette, Recording, request_body
 from maps.exceptions import ApiError
+from maps.hedging import HedgePolicy
+from maps.retry import asend
+from maps.transport import get_async_session, get_proxy, get_session, redirect_url
+
+if TYPE_CHECKING:
+    import aiohttp
 
 
 class Api:
     """Baseclass for low level http calls."""
 
-    def __init__(self, base_url: str, credentials: Optional[str]):
+    def __init__(
+        self,
+        base_url: str,
+        credentials: Optional[str],
+        session: Optional[requests.Session] = None,
+        hedge: Optional[HedgePolicy] = None,
+    ):
         self.base_url = base_url
         self.credentials = credentials
+        self.session = session or get_session()
+        self.hedge = hedge
         self.cookies: Dict[str, str] = {}
         self.headers: Dict[str, str] = {}
 
@@ -30,6 +45,10 @@ class Api:
     ) -> requests.models.Response:
         """Make an API call with parameters passed to :mod:`requests`.
 
+        The request is sent through :attr:`session`, which keeps connections alive
+        between calls and retries transient failures, see :mod:`maps.retry`. GET
+        requests are hedged if a :class:`~maps.hedging.HedgePolicy` was given.
+
         :param method: The HTTP method name, e.g. "GET", "PUT", etc.
         :param path: The HTTP path to be appended to the :attr:`server` attribute.
         :param params: A dict holding the HTTP query parameters.
@@ -39,25 +58,30 @@ class Api:
             body with content-type ``application/json``.
         :param data: A str to be passed as request body with content-type
             ``application/x-www-form-urlencoded``.
-        :param proxies: A dict holding the HTTP proxies to be used.
+        :param proxies: A dict holding the HTTP proxies to be used, defaults to the
+            proxies of :attr:`session`.
         :return: The HTTP response returned by the :mod:`requests` package.
         :raises ApiError: If the status code of the HTTP response is not in the
              interval [200, 300).
         """
         url = f"{self.base_url}{path}"
 
-        req_method = getattr(requests, method.lower())
-        env_proxies = urllib.request.getproxies()
-
-        resp = req_method(
-            url,
-            params=params,
-            headers=headers or self.headers,
-            cookies=cookies or self.cookies,
-            proxies=proxies or env_proxies,
-            json=json,
-            data=data,
-        )
+        def send_once() -> requests.Response:
+            return self.session.request(
+                method,
+                url,
+                params=params,
+                headers=headers or self.headers,
+                cookies=cookies or self.cookies,
+                proxies=proxies,
+                json=json,
+                data=data,
+            )
+
+        if self.hedge is not None and method.upper() == "GET":
+            resp = self.hedge.send(send_once)
+        else:
+            resp = send_once()
         if not (200 <= resp.status_code < 300):
             raise ApiError(resp)
         return resp
@@ -69,3 +93,180 @@ class Api:
         :return: The HTTP response.
         """
         return self(method="GET", **kwargs)
+
+
+class AsyncResponse:
+    """A fully read HTTP response returned by :class:`AsyncApi`.
+
+    It provides the attributes of :class:`requests.Response` used by this package,
+    eg. :attr:`status_code`, :attr:`reason`, :attr:`text` and :meth:`json`.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        status_code: int,
+        reason: Optional[str],
+        headers: Dict[str, str],
+        content: bytes,
+        encoding: Optional[str] = None,
+    ):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding or "utf-8"
+
+    @property
+    def text(self) -> str:
+        """The response body decoded as text."""
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self, **kwargs) -> Any:
+        """Decode the response body as JSON.
+
+        :param kwargs: Keyword arguments passed to :func:`json.loads`.
+        :return: The decoded JSON document.
+        """
+        return _json.loads(self.content, **kwargs)
+
+
+def replay_response(recording: Recording, url: str) -> AsyncResponse:
+    """Create an :class:`AsyncResponse` from a response recorded in a cassette.
+
+    :param recording: A recorded response, see :mod:`maps.cassette`.
+    :param url: The URL of the request.
+    :return: The response.
+    """
+    headers = {}
+    if recording.content_type:
+        headers["Content-Type"] = recording.content_type
+    return AsyncResponse(
+        url=url,
+        status_code=recording.status,
+        reason=recording.reason,
+        headers=headers,
+        content=recording.content,
+    )
+
+
+class AsyncApi:
+    """Baseclass for low level http calls on an asyncio event loop.
+
+    It mirrors :class:`Api`, but its methods are coroutines. Requests are sent through
+    the shared :mod:`aiohttp` session of the running loop unless a session is given.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        credentials: Optional[str],
+        session: Optional["aiohttp.ClientSession"] = None,
+        hedge: Optional[HedgePolicy] = None,
+    ):
+        self.base_url = base_url
+        self.credentials = credentials
+        self._session = session
+        self.hedge = hedge
+        self.cookies: Dict[str, str] = {}
+        self.headers: Dict[str, str] = {}
+
+    @property
+    def session(self) -> "aiohttp.ClientSession":
+        """The :mod:`aiohttp` session used to send requests."""
+        return self._session or get_async_session()
+
+    async def __call__(
+        self,
+        method: str,
+        path: Optional[str] = "",
+        params: Optional[Dict] = None,
+        headers: Optional[Dict] = None,
+        cookies: Optional[Dict] = None,
+        json: Optional[Dict] = None,
+        data: Optional[Dict] = None,
+        proxy: Optional[str] = None,
+    ) -> AsyncResponse:
+        """Make an API call with parameters passed to :mod:`aiohttp`.
+
+        Transient failures are retried according to :mod:`maps.retry`. GET requests
+        are hedged if a :class:`~maps.hedging.HedgePolicy` was given.
+
+        :param method: The HTTP method name, e.g. "GET", "PUT", etc.
+        :param path: The HTTP path to be appended to the :attr:`server` attribute.
+        :param params: A dict holding the HTTP query parameters.
+        :param headers: A dict holding the HTTP request headers.
+        :param cookies: A dict holding the HTTP request cookies.
+        :param json: A JSON object (usually a dict) to be passed as request
+            body with content-type ``application/json``.
+        :param data: A str to be passed as request body with content-type
+            ``application/x-www-form-urlencoded``.
+        :param proxy: The HTTP proxy to be used, defaults to the environment's proxy.
+        :return: The fully read HTTP response.
+        :raises ApiError: If the status code of the HTTP response is not in the
+             interval [200, 300).
+        """
+        url = f"{self.base_url}{path}"
+        cassette = Cassette.from_env()
+        if cassette is not None:
+            key = cassette.key(method, url, params, request_body(json, data))
+            recording = cassette.lookup(key)
+            if recording is not None:
+                response = replay_response(recording, url)
+                if not (200 <= response.status_code < 300):
+                    raise ApiError(response)
+                return response
+        url = redirect_url(url)
+
+        async def send_once() -> AsyncResponse:
+            resp = await asend(
+                lambda: self.session.request(
+                    method,
+                    url,
+                    params=params,
+                    headers=headers or self.headers,
+                    cookies=cookies or self.cookies,
+                    proxy=proxy or get_proxy(url),
+                    json=json,
+                    data=data,
+                ),
+                method,
+                url,
+            )
+            async with resp:
+                content = await resp.read()
+            return AsyncResponse(
+                url=str(resp.url),
+                status_code=resp.status,
+                reason=resp.reason,
+                headers=dict(resp.headers),
+                content=content,
+                encoding=resp.charset,
+            )
+
+        if self.hedge is not None and method.upper() == "GET":
+            response = await self.hedge.asend(send_once)
+        else:
+            response = await send_once()
+        if cassette is not None:
+            cassette.record(
+                key,
+                response.status_code,
+                response.reason,
+                requests.structures.CaseInsensitiveDict(response.headers).get(
+                    "Content-Type"
+                ),
+                response.content,
+            )
+        if not (200 <= response.status_code < 300):
+            raise ApiError(response)
+        return response
+
+    async def get(self, **kwargs) -> AsyncResponse:
+        """Send a HTTP GET request.
+
+        :param kwargs: Keyword arguments passed when sending the HTTP request.
+        :return: The HTTP response.
+        """
+        return await self(method="GET", **kwargs)
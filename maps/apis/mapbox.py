@@ -1,17 +1,143 @@
 """This module defines classes for mapbox APIs."""
 
-from typing import List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
 import requests
 
-from maps.apis.apis import Api
+from maps.apis.apis import Api, AsyncApi, AsyncResponse
+from maps.engine import amap_ordered, run
+from maps.hedging import HedgePolicy
+
+if TYPE_CHECKING:
+    import aiohttp
+
+#: Maximum number of coordinates of a single Matrix API request, per profile.
+MATRIX_MAX_COORDINATES = {
+    "driving": 25,
+    "walking": 25,
+    "cycling": 25,
+    "driving-traffic": 10,
+}
+
+
+def _isochrone_request(
+    credentials: Optional[str],
+    profile: str,
+    coordinates: List,
+    contours_minutes: List,
+    contours_colors: Optional[List] = None,
+    polygons: bool = False,
+    denoise: Optional[float] = 1.0,
+) -> Tuple[str, Dict]:
+    latlng = ",".join([str(coord) for coord in coordinates])
+    path = f"/isochrone/v1/mapbox/{profile}/{latlng}"
+    params = {
+        "contours_minutes": ",".join([str(cm) for cm in contours_minutes]),
+        "denoise": str(denoise),
+        "polygons": str(polygons).lower(),
+        "access_token": credentials,
+    }
+    if contours_colors:
+        params["contours_colors"] = ",".join([cc for cc in contours_colors])
+    return path, params
+
+
+def _matrix_request(
+    credentials: Optional[str],
+    profile: str,
+    coordinates: str,
+    annotations: Optional[str] = None,
+    approaches: Optional[str] = None,
+    destinations: Optional[str] = None,
+    sources: Optional[str] = None,
+) -> Tuple[str, Dict]:
+    path = f"/directions-matrix/v1/mapbox/{profile}/{coordinates}"
+    params = {"access_token": credentials}
+    if annotations:
+        params["annotations"] = annotations
+    if approaches:
+        params["approaches"] = approaches
+    if destinations:
+        params["destinations"] = destinations
+    if sources:
+        params["sources"] = sources
+    return path, params
+
+
+def _parse_indices(indices: Optional[str], count: int) -> List[int]:
+    if not indices or indices == "all":
+        return list(range(count))
+    return [int(index) for index in indices.split(";")]
+
+
+def plan_matrix_tiles(
+    sources: List[int], destinations: List[int], max_coordinates: int
+) -> List[Tuple[range, range]]:
+    """Split a matrix into tiles which fit into one Matrix API request each.
+
+    A tile of ``r`` sources and ``c`` destinations needs at most ``r + c``
+    coordinates, so the tile shape with ``r + c <= max_coordinates`` which needs the
+    fewest requests is chosen. If all coordinates fit into one request, the matrix
+    is not split.
+
+    :param sources: Coordinate indices of the sources.
+    :param destinations: Coordinate indices of the destinations.
+    :param max_coordinates: Maximum number of coordinates per request.
+    :return: A list of tiles, each a pair of ranges of positions in ``sources`` and
+        ``destinations``.
+    """
+    rows, cols = len(sources), len(destinations)
+    if len(set(sources) | set(destinations)) <= max_coordinates:
+        return [(range(rows), range(cols))]
+    best: Optional[Tuple] = None
+    for tile_rows in range(1, min(rows, max_coordinates - 1) + 1):
+        tile_cols = min(cols, max_coordinates - tile_rows)
+        requests_needed = -(-rows // tile_rows) * -(-cols // tile_cols)
+        key = (requests_needed, -tile_rows * tile_cols)
+        if best is None or key < best[0]:
+            best = (key, tile_rows, tile_cols)
+    _, tile_rows, tile_cols = best  # type: ignore
+    return [
+        (range(row, min(row + tile_rows, rows)), range(col, min(col + tile_cols, cols)))
+        for row in range(0, rows, tile_rows)
+        for col in range(0, cols, tile_cols)
+    ]
+
+
+def _stitch_matrix(
+    rows: int, cols: int, tiles: List[Tuple[range, range]], results: List[Dict]
+) -> Dict:
+    matrix: Dict = {
+        "code": "Ok",
+        "sources": [None] * rows,
+        "destinations": [None] * cols,
+    }
+    for key in ("durations", "distances"):
+        if any(key in result for result in results):
+            matrix[key] = [[None] * cols for _ in range(rows)]
+    for (tile_rows, tile_cols), result in zip(tiles, results):
+        for i, row in enumerate(tile_rows):
+            matrix["sources"][row] = result["sources"][i]
+            for key in ("durations", "distances"):
+                if key in result:
+                    for j, col in enumerate(tile_cols):
+                        matrix[key][row][col] = result[key][i][j]
+        for j, col in enumerate(tile_cols):
+            matrix["destinations"][col] = result["destinations"][j]
+    return matrix
 
 
 class MapBoxApi(Api):
     """A class for low level mapbox api calls."""
 
-    def __init__(self, base_url: str, credentials: Optional[str]):
-        super().__init__(base_url, credentials)
+    def __init__(
+        self,
+        base_url: str,
+        credentials: Optional[str],
+        session: Optional[requests.Session] = None,
+        hedge: Optional[HedgePolicy] = None,
+    ):
+        super().__init__(base_url, credentials, session, hedge)
 
     def isochrone(
         self,
@@ -45,17 +171,15 @@ class MapBoxApi(Api):
             largest contour in the set of contours for that same time value.
         :return: The HTTP response returned by the :mod:`requests` package.
         """
-        latlng = ",".join([str(coord) for coord in coordinates])
-        path = f"/isochrone/v1/mapbox/{profile}/{latlng}"
-        params = {
-            "contours_minutes": ",".join([str(cm) for cm in contours_minutes]),
-            "denoise": str(denoise),
-            "polygons": str(polygons).lower(),
-            "access_token": self.credentials,
-        }
-        if contours_colors:
-            params["contours_colors"] = ",".join([cc for cc in contours_colors])
-
+        path, params = _isochrone_request(
+            self.credentials,
+            profile,
+            coordinates,
+            contours_minutes,
+            contours_colors=contours_colors,
+            polygons=polygons,
+            denoise=denoise,
+        )
         return self.get(path=path, params=params)
 
     def matrix(
@@ -65,6 +189,7 @@ class MapBoxApi(Api):
         annotations: Optional[str] = None,
         approaches: Optional[str] = None,
         destinations: Optional[str] = None,
+        sources: Optional[str] = None,
     ) -> requests.models.Response:
         """
         The Mapbox Matrix API returns travel times between many points.
@@ -85,15 +210,173 @@ class MapBoxApi(Api):
         :param destinations: Use the coordinates at a given index as destinations. Possible values
             are: a semicolon-separated list of 0-based indices, or all (default).
             The option all allows using all coordinates as destinations.
+        :param sources: Use the coordinates at a given index as sources. Possible values
+            are: a semicolon-separated list of 0-based indices, or all (default).
         :return: The HTTP response returned by the :mod:`requests` package.
         """
-        path = f"/directions-matrix/v1/mapbox/{profile}/{coordinates}"
-        params = {"access_token": self.credentials}
-        if annotations:
-            params["destinations"] = destinations
-        if approaches:
-            params["approaches"] = approaches
-        if destinations:
-            params["destinations"] = destinations
-
+        path, params = _matrix_request(
+            self.credentials,
+            profile,
+            coordinates,
+            annotations=annotations,
+            approaches=approaches,
+            destinations=destinations,
+            sources=sources,
+        )
         return self.get(path=path, params=params)
+
+    def tiled_matrix(
+        self,
+        profile: str,
+        coordinates: str,
+        annotations: Optional[str] = None,
+        approaches: Optional[str] = None,
+        destinations: Optional[str] = None,
+        sources: Optional[str] = None,
+        concurrency: int = 8,
+    ) -> Dict:
+        """
+        Travel times between any number of points, see :meth:`AsyncMapBoxApi.tiled_matrix`.
+
+        :return: The Matrix API response as a dict.
+        """
+        client = AsyncMapBoxApi(self.base_url, self.credentials, hedge=self.hedge)
+        return run(
+            client.tiled_matrix(
+                profile,
+                coordinates,
+                annotations=annotations,
+                approaches=approaches,
+                destinations=destinations,
+                sources=sources,
+                concurrency=concurrency,
+            )
+        )
+
+
+class AsyncMapBoxApi(AsyncApi):
+    """A class for low level mapbox api calls on an asyncio event loop."""
+
+    def __init__(
+        self,
+        base_url: str,
+        credentials: Optional[str],
+        session: Optional["aiohttp.ClientSession"] = None,
+        hedge: Optional[HedgePolicy] = None,
+    ):
+        super().__init__(base_url, credentials, session, hedge)
+
+    async def isochrone(
+        self,
+        profile: str,
+        coordinates: List,
+        contours_minutes: List,
+        contours_colors: Optional[List] = None,
+        polygons: bool = False,
+        denoise: Optional[float] = 1.0,
+    ) -> AsyncResponse:
+        """
+        Mapbox isochrone api to get reachable area on map, see :meth:`MapBoxApi.isochrone`.
+
+        :return: The fully read HTTP response.
+        """
+        path, params = _isochrone_request(
+            self.credentials,
+            profile,
+            coordinates,
+            contours_minutes,
+            contours_colors=contours_colors,
+            polygons=polygons,
+            denoise=denoise,
+        )
+        return await self.get(path=path, params=params)
+
+    async def matrix(
+        self,
+        profile: str,
+        coordinates: str,
+        annotations: Optional[str] = None,
+        approaches: Optional[str] = None,
+        destinations: Optional[str] = None,
+        sources: Optional[str] = None,
+    ) -> AsyncResponse:
+        """
+        The Mapbox Matrix API returns travel times between many points, see
+        :meth:`MapBoxApi.matrix`.
+
+        :return: The fully read HTTP response.
+        """
+        path, params = _matrix_request(
+            self.credentials,
+            profile,
+            coordinates,
+            annotations=annotations,
+            approaches=approaches,
+            destinations=destinations,
+            sources=sources,
+        )
+        return await self.get(path=path, params=params)
+
+    async def tiled_matrix(
+        self,
+        profile: str,
+        coordinates: str,
+        annotations: Optional[str] = None,
+        approaches: Optional[str] = None,
+        destinations: Optional[str] = None,
+        sources: Optional[str] = None,
+        concurrency: int = 8,
+    ) -> Dict:
+        """
+        Travel times between any number of points.
+
+        Matrices with more coordinates than a single request allows (25, or 10 for the
+        ``driving-traffic`` profile) are split into tiles, see :func:`plan_matrix_tiles`.
+        The tiles are requested concurrently and stitched into one dense matrix, with
+        ``None`` where no route was found. Parameters are the same as for
+        :meth:`MapBoxApi.matrix`.
+
+        :param concurrency: Maximum number of tile requests in flight.
+        :return: The Matrix API response as a dict.
+        """
+        points = coordinates.split(";")
+        source_indices = _parse_indices(sources, len(points))
+        destination_indices = _parse_indices(destinations, len(points))
+        tiles = plan_matrix_tiles(
+            source_indices,
+            destination_indices,
+            MATRIX_MAX_COORDINATES.get(profile, 25),
+        )
+        if len(tiles) == 1:
+            resp = await self.matrix(
+                profile,
+                coordinates,
+                annotations=annotations,
+                approaches=approaches,
+                destinations=destinations,
+                sources=sources,
+            )
+            return resp.json()
+        point_approaches = approaches.split(";") if approaches else None
+
+        async def fetch(tile):
+            tile_sources = [source_indices[row] for row in tile[0]]
+            tile_destinations = [destination_indices[col] for col in tile[1]]
+            indices = sorted(set(tile_sources) | set(tile_destinations))
+            position = {index: pos for pos, index in enumerate(indices)}
+            resp = await self.matrix(
+                profile,
+                ";".join(points[index] for index in indices),
+                annotations=annotations,
+                approaches=";".join(point_approaches[index] for index in indices)
+                if point_approaches
+                else None,
+                destinations=";".join(str(position[i]) for i in tile_destinations),
+                sources=";".join(str(position[i]) for i in tile_sources),
+            )
+            return resp.json()
+
+        results = [result async for result in amap_ordered(fetch, tiles, concurrency)]
+        return _stitch_matrix(
+            len(source_indices), len(destination_indices), tiles, results
+        )
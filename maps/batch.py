@@ -0,0 +1,214 @@
+"""This module defines helpers shared by the batch commands."""
+import asyncio
+import csv
+import json
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, Tuple, Union
+
+from maps.cache import reverse_point
+from maps.engine import imap_ordered
+from maps.transport import ensure_pool_size
+
+Query = Union[str, Tuple[float, float]]
+
+
+def _rows(fh: IO[str], input_format: str) -> Iterable:
+    if input_format == "csv":
+        return csv.DictReader(fh)
+    if input_format == "ndjson":
+        return (json.loads(line) for line in fh if line.strip())
+    raise ValueError(f"Unsupported input format: {input_format}")
+
+
+def read_queries(
+    fh: IO[str], input_format: str = "csv", column: str = "query"
+) -> Iterator[Tuple[Any, Query]]:
+    """Read geocoding queries from a CSV or NDJSON stream.
+
+    Every record yields a tuple of ``(id, query)``. The ``id`` is taken from an
+    ``id`` column/key when present, otherwise the 0-based row number is used. The
+    query is taken from ``column``; records without it but with ``lat`` and ``lon``
+    values yield a ``(lat, lon)`` tuple instead, which is handy for reverse geocoding.
+    NDJSON lines may also be plain JSON strings.
+
+    :param fh: A text stream to read from, e.g. a file or ``sys.stdin``.
+    :param input_format: Either ``csv`` (with a header row) or ``ndjson``.
+    :param column: Name of the column/key which holds the query.
+    :return: An iterator of ``(id, query)`` tuples.
+    :raises ValueError: If a record has neither ``column`` nor ``lat``/``lon``.
+    """
+    for num, row in enumerate(_rows(fh, input_format)):
+        if isinstance(row, str):
+            yield num, row
+            continue
+        row_id = row.get("id", num)
+        if row.get(column) not in (None, ""):
+            yield row_id, row[column]
+        elif row.get("lat") not in (None, "") and row.get("lon") not in (None, ""):
+            yield row_id, (float(row["lat"]), float(row["lon"]))
+        else:
+            raise ValueError(
+                f"Record {row_id} has no '{column}' or 'lat'/'lon' values."
+            )
+
+
+def read_records(
+    fh: IO[str], input_format: str = "csv"
+) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+    """Read records from a CSV or NDJSON stream.
+
+    :param fh: A text stream to read from, e.g. a file or ``sys.stdin``.
+    :param input_format: Either ``csv`` (with a header row) or ``ndjson``.
+    :return: An iterator of ``(id, record)`` tuples. The ``id`` is taken from an ``id``
+        column/key when present, otherwise the 0-based row number is used.
+    """
+    for num, row in enumerate(_rows(fh, input_format)):
+        yield row.get("id", num), row
+
+
+def snap_points(points, precision: int) -> Tuple[Any, Any]:
+    """Snap points to a grid and pick one representative per grid cell.
+
+    :param points: A NumPy float array of shape ``(n, 2)``. Rows with ``NaN`` are never
+        merged with other rows.
+    :param precision: Number of decimal places of the grid.
+    :return: A tuple of the sorted indices of the first point of every cell, and the
+        index of the cell (in that order) of every point.
+    """
+    import numpy as np
+
+    cells = np.round(points * 10.0**precision)
+    invalid = np.isnan(cells).any(axis=1)
+    cells[invalid, 0] = np.inf
+    cells[invalid, 1] = np.flatnonzero(invalid)
+    _, first, inverse = np.unique(cells, axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.size)
+    return first[order], rank[inverse.ravel()]
+
+
+def _snap_batch(
+    geocode: Callable[[Query], Dict],
+    queries: Iterable[Tuple[Any, Query]],
+    concurrency: int,
+    precision: int,
+    point: Callable[[Query], Any],
+) -> Iterator[Dict]:
+    import numpy as np
+
+    items = list(queries)
+    points = np.array(
+        [point(query) or (np.nan, np.nan) for _, query in items],
+        dtype=np.float64,
+    ).reshape(-1, 2)
+    first, cells = snap_points(points, precision)
+    representatives = []
+    for index in first.tolist():
+        row_id, query = items[index]
+        if not np.isnan(points[index]).any():
+            lat, lon = np.round(points[index], precision).tolist()
+            query = (lat, lon)
+        representatives.append((row_id, query))
+
+    results: List[Dict] = []
+    row = 0
+    ends = first.tolist()[1:] + [len(items)]
+    for result, end in zip(
+        geocode_batch(geocode, representatives, concurrency=concurrency), ends
+    ):
+        result.pop("id")
+        result.pop("query")
+        results.append(result)
+        for row in range(row, end):
+            row_id, query = items[row]
+            yield dict({"id": row_id, "query": query}, **results[cells[row]])
+        row = end
+
+
+def geocode_batch(
+    geocode: Callable[[Query], Dict],
+    queries: Iterable[Tuple[Any, Query]],
+    concurrency: int = 8,
+    snap: int = 0,
+    point: Callable[[Query], Any] = reverse_point,
+) -> Iterator[Dict]:
+    """Geocode many queries concurrently, yielding one record per query in input order.
+
+    ``geocode`` may be a coroutine function, e.g. using a geopy geocoder with
+    :class:`maps.transport.PooledAioHTTPAdapter`, which runs all requests on one event
+    loop. Blocking callables are run in a pool of ``concurrency`` threads. Failures do
+    not stop the batch; they are reported in the ``error`` key of the record of the
+    query that failed.
+
+    With ``snap``, the ``(lat, lon)`` queries of a reverse geocoding batch are snapped
+    to a grid with :func:`snap_points`, only the center of every grid cell is
+    geocoded, and its result is given to all queries of the cell. The queries are
+    then read up front, but results are still yielded as soon as they are known.
+    Cell centers are passed to ``geocode`` as ``(lat, lon)`` tuples.
+
+    :param geocode: A callable which geocodes a single query and returns a dict.
+    :param queries: An iterable of ``(id, query)`` tuples, see :func:`read_queries`.
+    :param concurrency: Maximum number of requests in flight.
+    :param snap: Number of decimal places of the grid, or ``0`` to geocode every
+        query.
+    :param point: A callable parsing a query to a ``(lat, lon)`` tuple, or ``None``
+        if it is not a point, used with ``snap``.
+    :return: An iterator of dicts with ``id`` and ``query`` keys plus the geocoding result.
+    """
+    if snap:
+        return _snap_batch(geocode, queries, concurrency, snap, point)
+    if asyncio.iscoroutinefunction(geocode):
+
+        async def _run(item):
+            row_id, query = item
+            record = {"id": row_id, "query": query}
+            try:
+                record.update(await geocode(query))
+            except Exception as err:
+                record["error"] = str(err) or type(err).__name__
+            return record
+
+    else:
+
+        def _run(item):
+            row_id, query = item
+            record = {"id": row_id, "query": query}
+            try:
+                record.update(geocode(query))
+            except Exception as err:
+                record["error"] = str(err) or type(err).__name__
+            return record
+
+    ensure_pool_size(concurrency)
+    return imap_ordered(_run, queries, concurrency=concurrency)
+
+
+def batch_fields(forward: bool, raw: bool = False) -> List[str]:
+    """Return the keys of the records of a batch, e.g. for the csv output format.
+
+    :param forward: A boolean flag for forward/reverse geocoding.
+    :param raw: A boolean flag for records with the api response as it is.
+    :return: A list of keys.
+    """
+    if raw:
+        return ["id", "query", "raw", "error"]
+    if forward:
+        return ["id", "query", "lat", "lon", "error"]
+    return ["id", "query", "address", "error"]
+
+
+def location_to_dict(location, forward: bool, raw: bool = False) -> Dict:
+    """Convert a :class:`geopy.location.Location` to a batch result dict.
+
+    :param location: A geopy location or ``None`` if nothing was found.
+    :param forward: A boolean flag for forward/reverse geocoding.
+    :param raw: A boolean flag to return the api response as it is.
+    :return: A dict with ``lat``/``lon`` for forward, ``address`` for reverse geocoding.
+    """
+    if location is None:
+        return {"error": "No result found"}
+    if raw:
+        return {"raw": location.raw}
+    if forward:
+        return {"lat": location.latitude, "lon": location.longitude}
+    return {"address": location.address}
@@ -0,0 +1,566 @@
+"""This module defines a persistent on-disk cache for geocoding results."""
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from maps.normalize import address_normalizer
+
+DEFAULT_TTL = 30 * 24 * 60 * 60
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+#: Mean earth radius in meters.
+EARTH_RADIUS = 6371008.8
+
+Point = Tuple[float, float]
+
+#: Sentinel returned by :meth:`GeocodeCache.get` when nothing usable is cached.
+MISS = object()
+
+
+def default_cache_dir() -> str:
+    """Return the user cache directory of maps-cli.
+
+    ``MAPS_CACHE_DIR`` takes precedence, otherwise the platform's user cache
+    directory is used, e.g. ``~/.cache/maps-cli`` on Linux.
+
+    :return: A directory path.
+    """
+    if os.environ.get("MAPS_CACHE_DIR"):
+        return os.environ["MAPS_CACHE_DIR"]
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+        return os.path.join(base, "maps-cli", "Cache")
+    if sys.platform == "darwin":
+        return os.path.expanduser("~/Library/Caches/maps-cli")
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "maps-cli")
+
+
+def normalize_query(query: Any) -> str:
+    """Normalize a geocoding query so that trivially different queries share a key.
+
+    :param query: An address string, a ``lat,lon`` string or a ``(lat, lon)`` tuple.
+    :return: A normalized string.
+    """
+    if isinstance(query, (tuple, list)):
+        return ",".join(repr(float(coord)) for coord in query)
+    return " ".join(str(query).split()).replace(" ,", ",").replace(", ", ",").lower()
+
+
+def reverse_point(query: Any) -> Optional[Point]:
+    """Parse the coordinates of a reverse geocoding query.
+
+    :param query: A ``lat,lon`` string, a ``(lat, lon)`` tuple or a geopy point.
+    :return: A ``(lat, lon)`` tuple, or ``None`` if the query is not a point.
+    """
+    if isinstance(query, str):
+        query = query.split(",")
+    try:
+        lat, lon = (float(coord) for coord in tuple(query)[:2])
+    except (TypeError, ValueError):
+        return None
+    return lat, lon
+
+
+def distance(a: Point, b: Point) -> float:
+    """Return the great-circle distance between two points.
+
+    :param a: A ``(lat, lon)`` tuple.
+    :param b: A ``(lat, lon)`` tuple.
+    :return: The distance in meters.
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (*a, *b))
+    h = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(h)))
+
+
+def reverse_distance(provider: str) -> float:
+    """Return the distance within which reverse geocoding reuses the cached result
+    of the nearest point.
+
+    ``MAPS_CACHE_REVERSE_DISTANCE_<PROVIDER>`` (e.g. ``_OSM``) takes precedence over
+    ``MAPS_CACHE_REVERSE_DISTANCE``. Both are in meters and default to ``0``, which
+    only reuses results of the exact same coordinates.
+
+    :param provider: Name of the provider, e.g. ``osm``.
+    :return: A distance in meters.
+    """
+    value = os.environ.get(f"MAPS_CACHE_REVERSE_DISTANCE_{provider.upper()}")
+    if value is None:
+        value = os.environ.get("MAPS_CACHE_REVERSE_DISTANCE", 0)
+    return float(value)
+
+
+class GeocodeCache:
+    """A SQLite backed cache with TTL expiry and LRU eviction by size.
+
+    Entries are keyed by provider, direction (``forward`` or ``reverse``) and the
+    normalized query. Values must be JSON serializable. An instance can be shared
+    between threads.
+
+    Reverse entries stored with their coordinates are also kept in an R-tree, so
+    that :meth:`nearest` finds the closest cached point of a provider, and GPS fixes
+    which differ in the last decimals share a result.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: float = DEFAULT_TTL,
+        max_size: int = DEFAULT_MAX_SIZE,
+        filename: str = "geocoding.sqlite",
+    ):
+        if path is None:
+            cache_dir = default_cache_dir()
+            os.makedirs(cache_dir, exist_ok=True)
+            path = os.path.join(cache_dir, filename)
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocode ("
+                "provider TEXT, direction TEXT, query TEXT, value TEXT, size INTEGER, "
+                "created REAL, accessed REAL, PRIMARY KEY (provider, direction, query))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS geocode_accessed ON geocode (accessed)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocode_point ("
+                "id INTEGER PRIMARY KEY, provider TEXT, query TEXT, "
+                "UNIQUE (provider, query))"
+            )
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS geocode_rtree USING rtree("
+                "id, min_lat, max_lat, min_lon, max_lon)"
+            )
+        self._size = self._total_size()
+
+    @classmethod
+    def from_env(cls, filename: str = "geocoding.sqlite") -> "GeocodeCache":
+        """Create a cache configured by the ``MAPS_CACHE_TTL`` (seconds) and
+        ``MAPS_CACHE_MAX_SIZE`` (bytes) environment variables.
+
+        :param filename: Name of the database file in the user cache directory.
+        :return: A :class:`GeocodeCache` in the user cache directory.
+        """
+        return cls(
+            ttl=float(os.environ.get("MAPS_CACHE_TTL", DEFAULT_TTL)),
+            max_size=int(os.environ.get("MAPS_CACHE_MAX_SIZE", DEFAULT_MAX_SIZE)),
+            filename=filename,
+        )
+
+    def _total_size(self) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM geocode"
+            ).fetchone()
+        return row[0]
+
+    def get(self, provider: str, direction: str, query: Any) -> Any:
+        """Get a cached value.
+
+        :param provider: Name of the provider, e.g. ``osm``.
+        :param direction: ``forward`` or ``reverse``.
+        :param query: The geocoding query.
+        :return: The cached value or :data:`MISS` if absent or expired.
+        """
+        key = (provider, direction, normalize_query(query))
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value, created FROM geocode "
+                "WHERE provider = ? AND direction = ? AND query = ?",
+                key,
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                return MISS
+            self._conn.execute(
+                "UPDATE geocode SET accessed = ? "
+                "WHERE provider = ? AND direction = ? AND query = ?",
+                (now,) + key,
+            )
+        return json.loads(row[0])
+
+    def set(
+        self,
+        provider: str,
+        direction: str,
+        query: Any,
+        value: Any,
+        point: Optional[Point] = None,
+    ) -> None:
+        """Store a value, evicting least recently used entries if the cache is full.
+
+        :param provider: Name of the provider, e.g. ``osm``.
+        :param direction: ``forward`` or ``reverse``.
+        :param query: The geocoding query.
+        :param value: A JSON serializable value.
+        :param point: The ``(lat, lon)`` of a reverse query, to find it with
+            :meth:`nearest`.
+        """
+        data = json.dumps(value, separators=(",", ":"))
+        key = (provider, direction, normalize_query(query))
+        now = time.time()
+        with self._lock, self._conn:
+            replaced = self._conn.execute(
+                "SELECT size FROM geocode "
+                "WHERE provider = ? AND direction = ? AND query = ?",
+                key,
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?, ?, ?)",
+                key + (data, len(data), now, now),
+            )
+            if point is not None and direction == "reverse":
+                self._index_point(provider, key[2], point)
+            self._size += len(data) - (replaced[0] if replaced else 0)
+        if self._size > self.max_size:
+            self.evict()
+
+    def _index_point(self, provider: str, query: str, point: Point) -> None:
+        self._conn.execute(
+            "INSERT OR IGNORE INTO geocode_point (provider, query) VALUES (?, ?)",
+            (provider, query),
+        )
+        (point_id,) = self._conn.execute(
+            "SELECT id FROM geocode_point WHERE provider = ? AND query = ?",
+            (provider, query),
+        ).fetchone()
+        lat, lon = point
+        self._conn.execute(
+            "INSERT OR REPLACE INTO geocode_rtree VALUES (?, ?, ?, ?, ?)",
+            (point_id, lat, lat, lon, lon),
+        )
+
+    def _drop_orphan_points(self) -> None:
+        self._conn.execute(
+            "DELETE FROM geocode_point WHERE NOT EXISTS (SELECT 1 FROM geocode "
+            "WHERE geocode.provider = geocode_point.provider "
+            "AND geocode.direction = 'reverse' AND geocode.query = geocode_point.query)"
+        )
+        self._conn.execute(
+            "DELETE FROM geocode_rtree WHERE id NOT IN (SELECT id FROM geocode_point)"
+        )
+
+    def nearest(self, provider: str, point: Point, max_distance: float) -> Any:
+        """Get the cached reverse geocoding result of the point nearest to ``point``.
+
+        :param provider: Name of the provider, e.g. ``osm``.
+        :param point: A ``(lat, lon)`` tuple.
+        :param max_distance: The maximum distance of the cached point in meters.
+        :return: The cached value or :data:`MISS` if there is no unexpired result
+            within ``max_distance``.
+        """
+        lat, lon = point
+        dlat = math.degrees(max_distance / EARTH_RADIUS)
+        dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT geocode_point.query, geocode_rtree.min_lat, "
+                "geocode_rtree.min_lon FROM geocode_rtree "
+                "JOIN geocode_point ON geocode_point.id = geocode_rtree.id "
+                "WHERE geocode_point.provider = ? AND min_lat <= ? AND max_lat >= ? "
+                "AND min_lon <= ? AND max_lon >= ?",
+                (provider, lat + dlat, lat - dlat, lon + dlon, lon - dlon),
+            ).fetchall()
+        candidates = sorted((distance(point, (row[1], row[2])), row[0]) for row in rows)
+        for meters, query in candidates:
+            if meters > max_distance:
+                break
+            value = self.get(provider, "reverse", query)
+            if value is not MISS:
+                return value
+        return MISS
+
+    def evict(self) -> None:
+        """Drop expired entries, then least recently used ones until the cache
+        fits into ``max_size``."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM geocode WHERE created < ?", (time.time() - self.ttl,)
+            )
+            size = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM geocode"
+            ).fetchone()[0]
+            if size > self.max_size:
+                cutoff, excess = None, size - self.max_size
+                rows = self._conn.execute(
+                    "SELECT accessed, size FROM geocode ORDER BY accessed"
+                )
+                for accessed, entry_size in rows:
+                    cutoff, excess = accessed, excess - entry_size
+                    if excess <= 0:
+                        break
+                self._conn.execute("DELETE FROM geocode WHERE accessed <= ?", (cutoff,))
+                size = self._conn.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM geocode"
+                ).fetchone()[0]
+            self._drop_orphan_points()
+            self._size = size
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM geocode")
+            self._conn.execute("DELETE FROM geocode_point")
+            self._conn.execute("DELETE FROM geocode_rtree")
+            self._size = 0
+
+    def get_or_fetch(
+        self,
+        provider: str,
+        direction: str,
+        query: Any,
+        fetch: Callable[[], Any],
+        refresh: bool = False,
+        encode: Callable[[Any], Any] = lambda value: value,
+        decode: Callable[[Any], Any] = lambda value: value,
+        point: Optional[Point] = None,
+        max_distance: float = 0.0,
+    ) -> Any:
+        """Return the cached value for a query, calling ``fetch`` on a miss.
+
+        :param provider: Name of the provider, e.g. ``osm``.
+        :param direction: ``forward`` or ``reverse``.
+        :param query: The geocoding query.
+        :param fetch: A callable without arguments which queries the provider.
+        :param refresh: A boolean flag to ignore the cached value and fetch it again.
+        :param encode: A callable converting the fetched value to a JSON serializable one.
+        :param decode: A callable converting a cached value back.
+        :param point: The ``(lat, lon)`` of a reverse query.
+        :param max_distance: Reuse the result of the nearest cached point of a reverse
+            query within this distance in meters, see :meth:`nearest`.
+        :return: The cached or fetched value.
+        """
+        value = self._lookup(provider, direction, query, refresh, point, max_distance)
+        if value is not MISS:
+            return decode(value)
+        result = fetch()
+        self.set(provider, direction, query, encode(result), point=point)
+        return result
+
+    async def aget_or_fetch(
+        self,
+        provider: str,
+        direction: str,
+        query: Any,
+        fetch: Callable[[], Awaitable],
+        refresh: bool = False,
+        encode: Callable[[Any], Any] = lambda value: value,
+        decode: Callable[[Any], Any] = lambda value: value,
+        point: Optional[Point] = None,
+        max_distance: float = 0.0,
+    ) -> Any:
+        """Async counterpart of :meth:`get_or_fetch`, where ``fetch`` returns an
+        awaitable."""
+        value = self._lookup(provider, direction, query, refresh, point, max_distance)
+        if value is not MISS:
+            return decode(value)
+        result = await fetch()
+        self.set(provider, direction, query, encode(result), point=point)
+        return result
+
+    def _lookup(
+        self,
+        provider: str,
+        direction: str,
+        query: Any,
+        refresh: bool,
+        point: Optional[Point],
+        max_distance: float,
+    ) -> Any:
+        if refresh:
+            return MISS
+        value = self.get(provider, direction, query)
+        if value is MISS and point is not None and max_distance > 0:
+            value = self.nearest(provider, point, max_distance)
+        return value
+
+
+def _encode_location(location) -> Optional[dict]:
+    if location is None:
+        return None
+    return {
+        "address": location.address,
+        "point": list(location.point),
+        "raw": location.raw,
+    }
+
+
+def _decode_location(value: Optional[dict]):
+    from geopy.location import Location
+
+    if value is None:
+        return None
+    return Location(value["address"], value["point"], value["raw"])
+
+
+class CachedGeocoder:
+    """A wrapper which puts a :class:`GeocodeCache` in front of a geopy geocoder.
+
+    Like the geocoder, its methods return coroutines if the geocoder uses an async
+    adapter. Reverse queries reuse the result of the nearest cached point within
+    ``max_distance`` meters.
+    """
+
+    def __init__(
+        self,
+        geolocator,
+        provider: str,
+        cache: GeocodeCache,
+        refresh: bool = False,
+        max_distance: float = 0.0,
+    ):
+        from geopy.adapters import BaseAsyncAdapter
+
+        self.geolocator = geolocator
+        self.provider = provider
+        self.cache = cache
+        self.refresh = refresh
+        self.max_distance = max_distance
+        if isinstance(getattr(geolocator, "adapter", None), BaseAsyncAdapter):
+            self._get_or_fetch = cache.aget_or_fetch
+        else:
+            self._get_or_fetch = cache.get_or_fetch
+
+    def geocode(self, query, **kwargs):
+        """Forward geocode ``query``, see :meth:`geopy.geocoders.Geocoder.geocode`."""
+        return self._get_or_fetch(
+            self.provider,
+            "forward",
+            query,
+            lambda: self.geolocator.geocode(query, **kwargs),
+            refresh=self.refresh,
+            encode=_encode_location,
+            decode=_decode_location,
+        )
+
+    def reverse(self, query, **kwargs):
+        """Reverse geocode ``query``, see :meth:`geopy.geocoders.Geocoder.reverse`."""
+        return self._get_or_fetch(
+            self.provider,
+            "reverse",
+            query,
+            lambda: self.geolocator.reverse(query, **kwargs),
+            refresh=self.refresh,
+            encode=_encode_location,
+            decode=_decode_location,
+            point=reverse_point(query),
+            max_distance=self.max_distance,
+        )
+
+
+class CachedOrsClient:
+    """A wrapper which puts a :class:`GeocodeCache` in front of the pelias endpoints
+    of an :class:`openrouteservice.Client`."""
+
+    def __init__(
+        self,
+        client,
+        cache: GeocodeCache,
+        refresh: bool = False,
+        max_distance: float = 0.0,
+    ):
+        self.client = client
+        self.cache = cache
+        self.refresh = refresh
+        self.max_distance = max_distance
+
+    def pelias_search(self, text, **kwargs):
+        """Forward geocode ``text``, see :meth:`openrouteservice.Client.pelias_search`."""
+        return self.cache.get_or_fetch(
+            "ors",
+            "forward",
+            text,
+            lambda: self.client.pelias_search(text=text, **kwargs),
+            refresh=self.refresh,
+        )
+
+    def pelias_reverse(self, point, **kwargs):
+        """Reverse geocode ``point``, see :meth:`openrouteservice.Client.pelias_reverse`."""
+        lon_lat = reverse_point(point)
+        return self.cache.get_or_fetch(
+            "ors",
+            "reverse",
+            point,
+            lambda: self.client.pelias_reverse(point=point, **kwargs),
+            refresh=self.refresh,
+            point=lon_lat and lon_lat[::-1],
+            max_distance=self.max_distance,
+        )
+
+
+class NormalizingGeocoder:
+    """A wrapper which passes the forward queries of a geopy geocoder, or the texts
+    searched with an :class:`openrouteservice.Client`, through ``normalize``, e.g. an
+    :class:`maps.normalize.AddressNormalizer`."""
+
+    def __init__(self, geolocator, normalize: Callable[[Any], Any]):
+        self.geolocator = geolocator
+        self.normalize = normalize
+
+    def geocode(self, query, **kwargs):
+        """Forward geocode the normalized ``query``."""
+        return self.geolocator.geocode(self.normalize(query), **kwargs)
+
+    def reverse(self, query, **kwargs):
+        """Reverse geocode ``query``."""
+        return self.geolocator.reverse(query, **kwargs)
+
+    def pelias_search(self, text, **kwargs):
+        """Forward geocode the normalized ``text``."""
+        return self.geolocator.pelias_search(text=self.normalize(text), **kwargs)
+
+    def pelias_reverse(self, point, **kwargs):
+        """Reverse geocode ``point``."""
+        return self.geolocator.pelias_reverse(point=point, **kwargs)
+
+
+def cached_geolocator(
+    geolocator, provider: str, no_cache: bool = False, refresh: bool = False
+):
+    """Put the user's geocoding cache in front of a geolocator unless disabled.
+
+    :param geolocator: A geopy geocoder or an :class:`openrouteservice.Client`.
+    :param provider: Name of the provider, e.g. ``osm``.
+    :param no_cache: A boolean flag to bypass the cache altogether.
+    :param refresh: A boolean flag to ignore cached values and store fresh ones.
+    :return: The geolocator, behind the cache unless ``no_cache`` is set. Reverse queries
+        reuse nearby cached results within :func:`reverse_distance`. Addresses are
+        normalized for the locale of ``MAPS_ADDRESS_LOCALE`` if it is set, with or
+        without the cache, see :func:`maps.normalize.address_normalizer`.
+    """
+    if not no_cache:
+        max_distance = reverse_distance(provider)
+        if provider == "ors":
+            geolocator = CachedOrsClient(
+                geolocator,
+                GeocodeCache.from_env(),
+                refresh=refresh,
+                max_distance=max_distance,
+            )
+        else:
+            geolocator = CachedGeocoder(
+                geolocator,
+                provider,
+                GeocodeCache.from_env(),
+                refresh=refresh,
+                max_distance=max_distance,
+            )
+    normalize = address_normalizer()
+    if normalize is not None:
+        geolocator = NormalizingGeocoder(geolocator, normalize)
+    return geolocator
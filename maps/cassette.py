@@ -0,0 +1,294 @@
+"""This module defines the recording and replay of provider responses.
+
+If ``MAPS_CASSETTE`` is set to a file, the shared transport of :mod:`maps.transport`
+records the responses of all requests to it, or answers requests with recorded
+responses without network access, depending on ``MAPS_CASSETTE_MODE``:
+
+* ``replay`` (default): answer from the cassette, a request without a recorded
+  response fails with :class:`~maps.exceptions.CassetteMissError`.
+* ``record``: send every request and record its response.
+* ``update``: answer from the cassette and record the responses of other requests.
+
+The cassette is a SQLite database with zlib compressed bodies. It is loaded into
+memory when opened, so replayed requests are dict lookups and are neither rate
+limited nor retried. Responses with a status which is retried, e.g. ``503``, are not
+recorded.
+
+Requests are matched on the fields listed in ``MAPS_CASSETTE_MATCH``, by default
+``method,host,path,query,body``. The query is normalized: parameters are sorted and
+credentials, :data:`IGNORED_PARAMS` plus those listed in ``MAPS_CASSETTE_IGNORE``,
+are left out, so that a cassette recorded with one API key replays with any other.
+Only the ``Content-Type`` header of responses is kept.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+from urllib.parse import parse_qsl, unquote, urlencode, urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from maps.exceptions import CassetteMissError
+
+MODES = ("replay", "record", "update")
+
+MATCH_FIELDS = ("method", "host", "path", "query", "body")
+
+#: Query parameters holding credentials, compared case-insensitively.
+IGNORED_PARAMS = ("access_token", "apikey", "api_key", "key")
+
+#: A recorded response.
+Recording = namedtuple("Recording", "status,reason,content_type,content")
+
+_cassettes: Dict[Tuple, "Cassette"] = {}
+_lock = threading.Lock()
+
+
+def _split(value: str) -> Tuple[str, ...]:
+    return tuple(item.strip() for item in value.split(",") if item.strip())
+
+
+def request_body(json_body: Any = None, data: Any = None) -> Optional[bytes]:
+    """Encode a request body the way :mod:`requests` sends it.
+
+    :param json_body: A JSON document.
+    :param data: A str, bytes or dict sent as form data.
+    :return: The body, or ``None`` if there is none.
+    """
+    if json_body is not None:
+        return json.dumps(json_body).encode("utf-8")
+    if isinstance(data, dict):
+        data = urlencode(data)
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return data
+
+
+class Cassette:
+    """A store of recorded responses. An instance can be shared between threads.
+
+    :param path: The database file.
+    :param mode: One of :data:`MODES`.
+    :param match: The fields requests are matched on, see :data:`MATCH_FIELDS`.
+    :param ignore: Query parameters left out when matching.
+    :raises ValueError: If the mode or a match field is unknown.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        mode: str = "replay",
+        match: Iterable[str] = MATCH_FIELDS,
+        ignore: Iterable[str] = IGNORED_PARAMS,
+    ):
+        match = tuple(match)
+        if mode not in MODES:
+            raise ValueError(f"Unknown cassette mode {mode}, choose from {MODES}.")
+        unknown = set(match) - set(MATCH_FIELDS)
+        if unknown:
+            raise ValueError(
+                f"Unknown match fields {', '.join(sorted(unknown))}, "
+                f"choose from {', '.join(MATCH_FIELDS)}."
+            )
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.mode = mode
+        self.match = match
+        self.ignore = frozenset(param.lower() for param in ignore)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS interaction ("
+                "key TEXT PRIMARY KEY, status INTEGER, reason TEXT, "
+                "content_type TEXT, content BLOB, recorded REAL)"
+            )
+            rows = self._conn.execute(
+                "SELECT key, status, reason, content_type, content FROM interaction"
+            )
+            self._recordings = {row[0]: row[1:] for row in rows}
+
+    @classmethod
+    def from_env(cls) -> Optional["Cassette"]:
+        """Open the cassette configured by ``MAPS_CASSETTE``, ``MAPS_CASSETTE_MODE``,
+        ``MAPS_CASSETTE_MATCH`` and ``MAPS_CASSETTE_IGNORE``.
+
+        Cassettes are opened once per configuration and shared.
+
+        :return: A :class:`Cassette`, or ``None`` if ``MAPS_CASSETTE`` is not set.
+        """
+        path = os.environ.get("MAPS_CASSETTE")
+        if not path:
+            return None
+        config = (
+            path,
+            os.environ.get("MAPS_CASSETTE_MODE") or "replay",
+            _split(os.environ.get("MAPS_CASSETTE_MATCH") or ",".join(MATCH_FIELDS)),
+            IGNORED_PARAMS + _split(os.environ.get("MAPS_CASSETTE_IGNORE", "")),
+        )
+        with _lock:
+            cassette = _cassettes.get(config)
+            if cassette is None:
+                cassette = _cassettes[config] = cls(*config)
+            return cassette
+
+    def __len__(self) -> int:
+        return len(self._recordings)
+
+    def close(self) -> None:
+        """Close the database connection."""
+        self._conn.close()
+
+    def key(
+        self,
+        method: str,
+        url: str,
+        params: Optional[Dict] = None,
+        body: Optional[Union[bytes, str]] = None,
+    ) -> str:
+        """Build the key a request is matched on.
+
+        :param method: The HTTP method.
+        :param url: The URL, possibly with a query.
+        :param params: Query parameters sent in addition to those of the URL.
+        :param body: The request body.
+        :return: The matched fields of the request, separated by spaces.
+        """
+        parts = urlsplit(url)
+        fields = {"method": method.upper(), "host": parts.netloc.lower()}
+        fields["path"] = unquote(parts.path) or "/"
+        if "query" in self.match:
+            pairs = parse_qsl(parts.query, keep_blank_values=True)
+            for name, value in (params or {}).items():
+                values = value if isinstance(value, (list, tuple)) else [value]
+                pairs.extend((name, str(item)) for item in values if item is not None)
+            pairs = [pair for pair in pairs if pair[0].lower() not in self.ignore]
+            fields["query"] = urlencode(sorted(pairs)) or "-"
+        if "body" in self.match:
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            fields["body"] = hashlib.sha1(body).hexdigest() if body else "-"
+        return " ".join(fields[name] for name in self.match)
+
+    def lookup(self, key: str) -> Optional[Recording]:
+        """Find the recorded response of a request.
+
+        :param key: The key of the request, see :meth:`key`.
+        :return: The recording, or ``None`` if the request is to be sent.
+        :raises CassetteMissError: If nothing is recorded for the request in
+            ``replay`` mode.
+        """
+        if self.mode == "record":
+            return None
+        row = self._recordings.get(key)
+        if row is None:
+            if self.mode == "replay":
+                raise CassetteMissError(
+                    f"No recorded response for {key} in {self.path}"
+                )
+            return None
+        status, reason, content_type, content = row
+        return Recording(status, reason, content_type, zlib.decompress(content))
+
+    def record(
+        self,
+        key: str,
+        status: int,
+        reason: Optional[str],
+        content_type: Optional[str],
+        content: bytes,
+    ) -> None:
+        """Record the response of a request, replacing an earlier one.
+
+        Nothing is recorded in ``replay`` mode or for retried statuses.
+
+        :param key: The key of the request, see :meth:`key`.
+        :param status: The HTTP status code.
+        :param reason: The HTTP reason phrase.
+        :param content_type: The ``Content-Type`` header.
+        :param content: The response body.
+        """
+        from maps.retry import RETRY_STATUSES
+
+        if self.mode == "replay" or status in RETRY_STATUSES:
+            return
+        row = (status, reason, content_type, zlib.compress(content))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO interaction "
+                "(key, status, reason, content_type, content, recorded) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, *row, time.time()),
+            )
+            self._recordings[key] = row
+
+
+def build_response(
+    recording: Recording, request: requests.PreparedRequest
+) -> requests.Response:
+    """Create a :class:`requests.Response` from a recording.
+
+    :param recording: A recorded response.
+    :param request: The request it answers.
+    :return: A response whose body is already read.
+    """
+    resp = requests.Response()
+    resp.status_code = recording.status
+    resp.reason = recording.reason
+    resp.headers = CaseInsensitiveDict()
+    if recording.content_type:
+        resp.headers["Content-Type"] = recording.content_type
+    resp.encoding = get_encoding_from_headers(resp.headers)
+    resp._content = recording.content
+    resp._content_consumed = True
+    resp.url = request.url
+    resp.request = request
+    return resp
+
+
+class ReplayResponse:
+    """A recorded response standing in for an :class:`aiohttp.ClientResponse`.
+
+    It provides the attributes used by this package and geopy's aiohttp adapter.
+    """
+
+    def __init__(self, recording: Recording, url: str):
+        self.status = recording.status
+        self.reason = recording.reason
+        self.headers = CaseInsensitiveDict()
+        if recording.content_type:
+            self.headers["Content-Type"] = recording.content_type
+        self.charset = get_encoding_from_headers(self.headers)
+        self.url = url
+        self._content = recording.content
+
+    async def __aenter__(self) -> "ReplayResponse":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        pass
+
+    def release(self) -> None:
+        """Do nothing, there is no connection to release."""
+
+    async def read(self) -> bytes:
+        """Return the response body."""
+        return self._content
+
+    async def text(self, encoding: Optional[str] = None) -> str:
+        """Return the response body decoded as text."""
+        return self._content.decode(encoding or self.charset or "utf-8", "replace")
+
+    async def json(self, **kwargs) -> Any:
+        """Decode the response body as JSON."""
+        return json.loads(self._content)
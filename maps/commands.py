@@ -1,30 +1,51 @@
-"""Main commands module. This module acts as entry point for all the commands."""
+"""Main commands module. This module acts as entry point for all the commands.
+
+Provider commands are imported only when they are invoked, so that the CLI starts
+fast; see :class:`maps.utils.LazyGroup`.
+"""
 import click
 
-from maps.here import here
-from maps.mapbox import mapbox
-from maps.ors import ors
-from maps.osm import osm
-from maps.tomtom import tomtom
-from maps.utils import yield_subcommands
+from maps.output import FORMATS
+from maps.utils import LazyGroup, yield_subcommands
 
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
 
-
-@click.group(context_settings=CONTEXT_SETTINGS)
-def maps():
+PROVIDERS = {
+    "osm": "maps.osm:osm",
+    "here": "maps.here:here",
+    "mapbox": "maps.mapbox:mapbox",
+    "tomtom": "maps.tomtom:tomtom",
+    "ors": "maps.ors:ors",
+}
+
+#: Commands which work across providers.
+COMMANDS = {
+    "geocoding": "maps.geocoding:geocoding",
+    "batch-geocoding": "maps.geocoding:batch_geocoding",
+}
+
+
+@click.group(
+    cls=LazyGroup,
+    context_settings=CONTEXT_SETTINGS,
+    lazy_subcommands=dict(PROVIDERS, **COMMANDS),
+    entry_point_group="maps.providers",
+)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(FORMATS),
+    help="Output format, defaults to json, or ndjson for batch commands.",
+)
+@click.pass_context
+def maps(ctx, output_format):
     """Map services of various providers."""
+    ctx.meta["maps.output_format"] = output_format
 
 
 @maps.command()
 def show():
     """show list of all service providers."""
     for sub in yield_subcommands(maps):
-        click.secho(sub, fg="green")
-
-
-maps.add_command(osm)
-maps.add_command(here)
-maps.add_command(mapbox)
-maps.add_command(tomtom)
-maps.add_command(ors)
+        if sub not in COMMANDS:
+            click.secho(sub, fg="green")
@@ -0,0 +1,188 @@
+"""This module defines the asyncio engine used for batch and fan-out work.
+
+Commands stay synchronous; they hand coroutines or iterables to this module, which
+runs them on an event loop. Blocking callables, e.g. provider SDKs without an async
+API, are run in a bounded thread pool so they can be mixed with coroutines.
+"""
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Iterator, Optional
+
+from maps.transport import close_async_session
+
+
+async def amap_ordered(
+    func: Callable,
+    iterable: Iterable,
+    concurrency: int = 8,
+    window: Optional[int] = None,
+) -> AsyncIterator:
+    """Apply ``func`` to each item of ``iterable`` concurrently on the running loop.
+
+    ``func`` may be a coroutine function or a blocking callable, which is then run
+    in a pool of ``concurrency`` threads. At most ``concurrency`` calls are in
+    flight and results are yielded in input order as soon as they are ready.
+    Input is consumed lazily, so at most ``window`` results are buffered while
+    waiting for a slow call to finish.
+
+    :param func: A coroutine function or callable taking a single item.
+    :param iterable: Items to process.
+    :param concurrency: Maximum number of calls in flight.
+    :param window: Maximum number of pending results, defaults to ``4 * concurrency``.
+    :return: An async iterator of results in input order.
+    """
+    window = max(window or 4 * concurrency, concurrency)
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    executor = None
+    if not asyncio.iscoroutinefunction(func):
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def _call(item):
+        async with semaphore:
+            if executor is None:
+                return await func(item)
+            return await loop.run_in_executor(executor, func, item)
+
+    pending: deque = deque()
+    try:
+        for item in iterable:
+            pending.append(asyncio.ensure_future(_call(item)))
+            # Let finished calls complete, e.g. while the input is read slowly.
+            await asyncio.sleep(0)
+            while True:
+                while pending and pending[0].done():
+                    yield pending.popleft().result()
+                running = [task for task in pending if not task.done()]
+                if len(pending) < window and len(running) < concurrency:
+                    break
+                await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+async def amap_unordered(
+    func: Callable, iterable: Iterable, concurrency: int = 8
+) -> AsyncIterator:
+    """Apply ``func`` to each item of ``iterable`` concurrently on the running loop,
+    yielding results as soon as they complete.
+
+    Unlike :func:`amap_ordered`, a slow call does not hold back later results, so
+    results are not buffered at all. Input is consumed lazily.
+
+    :param func: A coroutine function or callable taking a single item.
+    :param iterable: Items to process.
+    :param concurrency: Maximum number of calls in flight.
+    :return: An async iterator of results in completion order.
+    """
+    loop = asyncio.get_running_loop()
+    executor = None
+    if not asyncio.iscoroutinefunction(func):
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def _call(item):
+        if executor is None:
+            return asyncio.ensure_future(func(item))
+        return loop.run_in_executor(executor, func, item)
+
+    pending: set = set()
+    try:
+        for item in iterable:
+            pending.add(_call(item))
+            if len(pending) >= concurrency:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    yield task.result()
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+def iterate(aiterable: AsyncIterator) -> Iterator:
+    """Consume an async iterator from synchronous code.
+
+    A private event loop is driven until the next item is available, so results can
+    be written out while later calls are still in flight.
+
+    :param aiterable: An async iterator, e.g. from :func:`amap_ordered`.
+    :return: An iterator over the same items.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(aiterable.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(_shutdown(aiterable))
+        loop.close()
+
+
+async def _shutdown(aiterable) -> None:
+    aclose = getattr(aiterable, "aclose", None)
+    if aclose is not None:
+        await aclose()
+    await close_async_session()
+
+
+def imap_ordered(
+    func: Callable,
+    iterable: Iterable,
+    concurrency: int = 8,
+    window: Optional[int] = None,
+) -> Iterator:
+    """Synchronous counterpart of :func:`amap_ordered`.
+
+    :param func: A coroutine function or callable taking a single item.
+    :param iterable: Items to process.
+    :param concurrency: Maximum number of calls in flight.
+    :param window: Maximum number of pending results, defaults to ``4 * concurrency``.
+    :return: An iterator of results in input order.
+    """
+    return iterate(amap_ordered(func, iterable, concurrency=concurrency, window=window))
+
+
+def imap_unordered(
+    func: Callable, iterable: Iterable, concurrency: int = 8
+) -> Iterator:
+    """Synchronous counterpart of :func:`amap_unordered`.
+
+    :param func: A coroutine function or callable taking a single item.
+    :param iterable: Items to process.
+    :param concurrency: Maximum number of calls in flight.
+    :return: An iterator of results in completion order.
+    """
+    return iterate(amap_unordered(func, iterable, concurrency=concurrency))
+
+
+def run(awaitable: Awaitable) -> Any:
+    """Run a coroutine to completion from synchronous code.
+
+    :param awaitable: A coroutine, e.g. ``AsyncMapBoxApi(...).matrix(...)``.
+    :return: The result of the coroutine.
+    """
+
+    async def _main() -> Any:
+        try:
+            return await awaitable
+        finally:
+            await close_async_session()
+
+    return asyncio.run(_main())
@@ -24,3 +24,23 @@ class ApiError(Exception):
         """
         resp = self.args[0]
         return f"{resp.status_code}, {resp.reason}, {resp.text}"
+
+
+class OverpassError(Exception):
+    """Exception raised when the Overpass API reports a runtime error, e.g. a timeout,
+    in the remark of an otherwise successful response."""
+
+
+class RateLimitTimeoutError(Exception):
+    """Exception raised when a request would wait for the rate limit of a provider
+    past the deadline set with :func:`maps.ratelimit.deadline`."""
+
+
+class ProvidersUnavailableError(Exception):
+    """Exception raised when every provider of a fallback chain failed or has an open
+    circuit breaker."""
+
+
+class CassetteMissError(Exception):
+    """Exception raised when a request has no recorded response in the cassette
+    replayed with ``MAPS_CASSETTE``."""
@@ -0,0 +1,329 @@
+"""This module defines geocoding over an ordered chain of providers.
+
+Every provider of a :class:`FallbackGeocoder` is guarded by a :class:`CircuitBreaker`.
+A query goes to the first provider whose breaker is closed; when that provider fails
+or is too slow, the query moves on to the next one. A breaker opens after repeated
+failures or slow calls, which keeps an unhealthy provider out of the chain until it
+has had time to recover.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from maps import __version__, ratelimit, retry
+from maps.cache import CachedOrsClient, NormalizingGeocoder, cached_geolocator
+from maps.exceptions import ApiKeyNotFoundError, ProvidersUnavailableError
+
+#: Providers in the default fallback order.
+PROVIDERS = ("here", "mapbox", "tomtom", "ors", "osm")
+
+#: Environment variables holding the API keys of the providers.
+APIKEY_VARIABLES = {
+    "here": "HERE_APIKEY",
+    "mapbox": "MAPBOX_APIKEY",
+    "tomtom": "TOMTOM_APIKEY",
+    "ors": "ORS_APIKEY",
+}
+
+
+class CircuitBreaker:
+    """A circuit breaker counting consecutive failures of a provider.
+
+    Calls slower than ``latency_threshold`` count as failures. After
+    ``failure_threshold`` consecutive failures the breaker opens and rejects calls for
+    ``reset_timeout`` seconds. Then it lets a single trial call through (half-open),
+    which closes it on success or opens it again on failure. An instance can be
+    shared between threads.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 3,
+        latency_threshold: float = 5.0,
+        reset_timeout: float = 30.0,
+    ):
+        self.failure_threshold = failure_threshold
+        self.latency_threshold = latency_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """The state of the breaker, one of ``closed``, ``open`` or ``half-open``."""
+        if self._opened is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self) -> bool:
+        """Check whether a call may be made, reserving the trial call when half-open.
+
+        :return: ``True`` if the call may be made.
+        """
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record(self, latency: Optional[float]) -> None:
+        """Record the outcome of a call.
+
+        :param latency: The duration of a successful call in seconds, or ``None`` if
+            the call failed.
+        """
+        with self._lock:
+            self._trial = False
+            if latency is not None and latency <= self.latency_threshold:
+                self.failures = 0
+                self._opened = None
+                return
+            self.failures += 1
+            if self._opened is not None or self.failures >= self.failure_threshold:
+                self._opened = time.monotonic()
+
+
+class _TimedOrsClient:
+    """An openrouteservice client whose requests time out after ``timeout`` seconds
+    and are not retried past that."""
+
+    def __init__(self, client, timeout: float):
+        self.client = client
+        self.timeout = timeout
+
+    def request(
+        self,
+        url,
+        get_params=None,
+        first_request_time=None,
+        retry_counter=0,
+        requests_kwargs=None,
+        post_json=None,
+        dry_run=None,
+    ):
+        """Send a request, see :meth:`openrouteservice.Client.request`."""
+        if first_request_time is None:
+            # The client retries until its retry timeout has passed since this time.
+            first_request_time = (
+                datetime.now()
+                - self.client._retry_timeout
+                + timedelta(seconds=self.timeout)
+            )
+        return self.client.request(
+            url,
+            get_params,
+            first_request_time,
+            retry_counter,
+            dict(requests_kwargs or {}, timeout=self.timeout),
+            post_json,
+            dry_run,
+        )
+
+    def pelias_search(self, text, **kwargs):
+        """Forward geocode ``text``, see :meth:`openrouteservice.Client.pelias_search`."""
+        from openrouteservice import geocode
+
+        return geocode.pelias_search(self, text, **kwargs)
+
+    def pelias_reverse(self, point, **kwargs):
+        """Reverse geocode ``point``, see :meth:`openrouteservice.Client.pelias_reverse`."""
+        from openrouteservice import geocode
+
+        return geocode.pelias_reverse(self, point, **kwargs)
+
+
+def _timed_client(client, timeout: Optional[float]):
+    # Rebuild the wrappers of the client around a timed client for this call.
+    if timeout is None:
+        return client
+    if isinstance(client, NormalizingGeocoder):
+        return NormalizingGeocoder(
+            _timed_client(client.geolocator, timeout), client.normalize
+        )
+    if isinstance(client, CachedOrsClient):
+        return CachedOrsClient(
+            _timed_client(client.client, timeout),
+            client.cache,
+            refresh=client.refresh,
+            max_distance=client.max_distance,
+        )
+    return _TimedOrsClient(client, timeout)
+
+
+class OrsGeocoder:
+    """A geopy like geocoder for the pelias endpoints of an openrouteservice client."""
+
+    def __init__(self, client):
+        self.client = client
+
+    @staticmethod
+    def _location(response: Dict):
+        from geopy.location import Location
+
+        if not response["features"]:
+            return None
+        feature = response["features"][0]
+        lon, lat = feature["geometry"]["coordinates"][:2]
+        return Location(feature["properties"]["label"], (lat, lon), feature)
+
+    def geocode(self, query: str, timeout: Optional[float] = None, **kwargs):
+        """Forward geocode ``query``.
+
+        :param query: An address.
+        :param timeout: Seconds to wait for the response.
+        :return: A :class:`geopy.location.Location` or ``None``.
+        """
+        client = _timed_client(self.client, timeout)
+        return self._location(client.pelias_search(text=query))
+
+    def reverse(self, query, timeout: Optional[float] = None, **kwargs):
+        """Reverse geocode ``query``.
+
+        :param query: A ``lat,lon`` string or a ``(lat, lon)`` tuple.
+        :param timeout: Seconds to wait for the response.
+        :return: A :class:`geopy.location.Location` or ``None``.
+        """
+        if isinstance(query, str):
+            query = query.split(",")
+        lat, lon = query
+        client = _timed_client(self.client, timeout)
+        return self._location(client.pelias_reverse(point=[lon, lat], validate=False))
+
+
+def provider_geolocator(
+    provider: str, no_cache: bool = False, refresh: bool = False
+) -> Any:
+    """Create the geolocator of a provider with its API key from the environment.
+
+    :param provider: One of :data:`PROVIDERS`.
+    :param no_cache: A boolean flag to bypass the geocoding cache.
+    :param refresh: A boolean flag to ignore cached results and store fresh ones.
+    :return: A geopy geocoder, possibly wrapped by the geocoding cache.
+    :raises ApiKeyNotFoundError: If the API key of the provider is not set.
+    """
+    from geopy.geocoders import Here, MapBox, Nominatim, TomTom
+
+    from maps.adapters import PooledRequestsAdapter
+    from maps.transport import ors_client
+
+    apikey = None
+    if provider in APIKEY_VARIABLES:
+        apikey = os.environ.get(APIKEY_VARIABLES[provider])
+        if apikey is None:
+            raise ApiKeyNotFoundError(
+                f"Please set the API key of {provider} as environment variable in "
+                f"{APIKEY_VARIABLES[provider]} "
+            )
+    if provider == "ors":
+        return OrsGeocoder(
+            cached_geolocator(
+                ors_client(apikey), "ors", no_cache=no_cache, refresh=refresh
+            )
+        )
+    if provider == "osm":
+        geolocator = Nominatim(
+            user_agent=f"maps-cli/{__version__}", adapter_factory=PooledRequestsAdapter
+        )
+    elif provider == "here":
+        geolocator = Here(apikey=apikey, adapter_factory=PooledRequestsAdapter)
+    elif provider == "mapbox":
+        geolocator = MapBox(api_key=apikey, adapter_factory=PooledRequestsAdapter)
+    elif provider == "tomtom":
+        geolocator = TomTom(api_key=apikey, adapter_factory=PooledRequestsAdapter)
+    else:
+        raise ValueError(f"Unknown provider: {provider}")
+    return cached_geolocator(geolocator, provider, no_cache=no_cache, refresh=refresh)
+
+
+def configured_providers() -> List[str]:
+    """Return the providers of :data:`PROVIDERS` whose API keys are set.
+
+    :return: A list of provider names in the default fallback order.
+    """
+    return [
+        provider
+        for provider in PROVIDERS
+        if provider not in APIKEY_VARIABLES
+        or os.environ.get(APIKEY_VARIABLES[provider])
+    ]
+
+
+class FallbackGeocoder:
+    """Geocode with the first healthy provider of an ordered chain.
+
+    Each call is given ``latency_threshold`` seconds as timeout and is neither retried
+    nor made to wait for the rate limit beyond that, so the latency of a query is
+    bounded by the providers it has to skip. An instance can be shared between
+    threads.
+    """
+
+    def __init__(
+        self,
+        geolocators: Sequence[Tuple[str, Any]],
+        failure_threshold: int = 3,
+        latency_threshold: float = 5.0,
+        reset_timeout: float = 30.0,
+    ):
+        self.geolocators = list(geolocators)
+        self.latency_threshold = latency_threshold
+        self.leg_policy = retry.RetryPolicy(max_attempts=1)
+        self.breakers = {
+            name: CircuitBreaker(failure_threshold, latency_threshold, reset_timeout)
+            for name, _ in self.geolocators
+        }
+
+    def _call(self, method: str, query: Any) -> Tuple[str, Any]:
+        errors = []
+        for name, geolocator in self.geolocators:
+            breaker = self.breakers[name]
+            if not breaker.allow():
+                errors.append(f"{name}: circuit open")
+                continue
+            started = time.monotonic()
+            try:
+                # Retries and waits for the rate limit would let a leg outlast the
+                # latency threshold, a failing provider is left to the breaker.
+                with retry.use_policy(self.leg_policy), ratelimit.deadline(
+                    self.latency_threshold
+                ):
+                    location = getattr(geolocator, method)(
+                        query, timeout=self.latency_threshold
+                    )
+            except Exception as err:
+                breaker.record(None)
+                errors.append(f"{name}: {err or type(err).__name__}")
+                continue
+            breaker.record(time.monotonic() - started)
+            return name, location
+        raise ProvidersUnavailableError("; ".join(errors))
+
+    def geocode(self, query: str) -> Tuple[str, Any]:
+        """Forward geocode ``query``.
+
+        :param query: An address.
+        :return: A tuple of the provider used and a geopy location or ``None``.
+        :raises ProvidersUnavailableError: If all providers failed or are open.
+        """
+        return self._call("geocode", query)
+
+    def reverse(self, query: Any) -> Tuple[str, Any]:
+        """Reverse geocode ``query``.
+
+        :param query: A ``lat,lon`` string or a ``(lat, lon)`` tuple.
+        :return: A tuple of the provider used and a geopy location or ``None``.
+        :raises ProvidersUnavailableError: If all providers failed or are open.
+        """
+        return self._call("reverse", query)
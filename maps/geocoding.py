@@ -0,0 +1,230 @@
+"""This module defines the geocoding commands over a fallback chain of providers."""
+import click
+
+from maps.batch import batch_fields, geocode_batch, location_to_dict, read_queries
+from maps.output import get_writer
+
+
+def _fallback_options(func):
+    options = [
+        click.option(
+            "--providers",
+            help="Comma-separated providers in fallback order, e.g. here,mapbox,osm. "
+            "Defaults to all providers whose API key is set, followed by osm.",
+            type=str,
+        ),
+        click.option(
+            "--failure_threshold",
+            default=3,
+            show_default=True,
+            type=click.IntRange(min=1),
+            help="Consecutive failures or slow calls after which a provider is skipped.",
+        ),
+        click.option(
+            "--latency_threshold",
+            default=5.0,
+            show_default=True,
+            type=click.FloatRange(min=0),
+            help="Seconds after which a call times out or counts as slow.",
+        ),
+        click.option(
+            "--reset_timeout",
+            default=30.0,
+            show_default=True,
+            type=click.FloatRange(min=0),
+            help="Seconds a skipped provider waits before it is tried again.",
+        ),
+        click.option(
+            "--no-cache",
+            "no_cache",
+            is_flag=True,
+            help="Do not use the geocoding cache.",
+        ),
+        click.option(
+            "--refresh",
+            is_flag=True,
+            help="Ignore cached results and store fresh ones.",
+        ),
+        click.option("--raw", is_flag=True),
+        click.option(
+            "--forward/--reverse",
+            default=True,
+            show_default=True,
+            help="Perform a forward or reverse geocode",
+        ),
+    ]
+    for option in options:
+        func = option(func)
+    return func
+
+
+def _fallback_geocoder(
+    providers, failure_threshold, latency_threshold, reset_timeout, no_cache, refresh
+):
+    from maps.fallback import (
+        PROVIDERS,
+        FallbackGeocoder,
+        configured_providers,
+        provider_geolocator,
+    )
+
+    names = providers.split(",") if providers else configured_providers()
+    for name in names:
+        if name not in PROVIDERS:
+            raise click.BadParameter(
+                f"Unknown provider {name}, choose from {', '.join(PROVIDERS)}.",
+                param_hint="--providers",
+            )
+    return FallbackGeocoder(
+        [(name, provider_geolocator(name, no_cache, refresh)) for name in names],
+        failure_threshold=failure_threshold,
+        latency_threshold=latency_threshold,
+        reset_timeout=reset_timeout,
+    )
+
+
+@click.command(short_help="geocode with the first healthy of several providers.")
+@click.argument("query", required=True)
+@_fallback_options
+def geocoding(
+    query,
+    forward,
+    raw,
+    providers,
+    failure_threshold,
+    latency_threshold,
+    reset_timeout,
+    no_cache,
+    refresh,
+):
+    """
+    Forward or reverse geocode with an ordered list of providers. A provider which
+    fails or is slow is skipped in favour of the next one.
+    \f
+
+    :param query: A string to represent address query for geocoding.
+    :param forward: A boolean flag for forward/reverse geocoding.
+    :param raw: A boolean flag to show api response as it is.
+    :param providers: Comma-separated providers in fallback order.
+    :param failure_threshold: Consecutive failures after which a provider is skipped.
+    :param latency_threshold: Seconds after which a call times out or counts as slow.
+    :param reset_timeout: Seconds a skipped provider waits before it is tried again.
+    :param no_cache: A boolean flag to bypass the geocoding cache.
+    :param refresh: A boolean flag to ignore cached results and store fresh ones.
+    :return: None.
+    """
+    from maps.exceptions import ProvidersUnavailableError
+
+    geolocator = _fallback_geocoder(
+        providers,
+        failure_threshold,
+        latency_threshold,
+        reset_timeout,
+        no_cache,
+        refresh,
+    )
+    try:
+        if forward:
+            provider, location = geolocator.geocode(query)
+        else:
+            provider, location = geolocator.reverse(query)
+    except ProvidersUnavailableError as err:
+        raise click.ClickException(f"All providers failed: {err}")
+    with get_writer() as writer:
+        writer.write(
+            dict({"provider": provider}, **location_to_dict(location, forward, raw))
+        )
+
+
+@click.command(
+    short_help="geocode addresses or coordinates from a file with several providers."
+)
+@click.argument("input", type=click.File("r"), default="-")
+@click.option(
+    "--input_format",
+    type=click.Choice(["csv", "ndjson"]),
+    default="csv",
+    show_default=True,
+    help="Format of the input records.",
+)
+@click.option(
+    "--column",
+    default="query",
+    show_default=True,
+    help="Name of the column holding the query.",
+)
+@click.option(
+    "--concurrency",
+    default=4,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of requests in flight.",
+)
+@_fallback_options
+@click.option(
+    "--snap",
+    default=0,
+    type=click.IntRange(min=0, max=10),
+    help="Reverse geocode one point per grid cell of this many decimal places, e.g. "
+    "4 for about 11 meters, and give its result to every point of the cell. "
+    "0 geocodes every point.",
+)
+def batch_geocoding(
+    input,
+    forward,
+    input_format,
+    column,
+    concurrency,
+    raw,
+    providers,
+    failure_threshold,
+    latency_threshold,
+    reset_timeout,
+    no_cache,
+    refresh,
+    snap,
+):
+    """
+    Geocode many queries read from a file or stdin with an ordered list of providers.
+    Results are written in input order, as one JSON object per line by default.
+    \f
+
+    :param input: A CSV or NDJSON file with one query per record, ``-`` for stdin.
+    :param forward: A boolean flag for forward/reverse geocoding.
+    :param input_format: Format of the input records, ``csv`` or ``ndjson``.
+    :param column: Name of the column holding the query.
+    :param concurrency: Maximum number of requests in flight.
+    :param raw: A boolean flag to show api response as it is.
+    :param providers: Comma-separated providers in fallback order.
+    :param failure_threshold: Consecutive failures after which a provider is skipped.
+    :param latency_threshold: Seconds after which a call times out or counts as slow.
+    :param reset_timeout: Seconds a skipped provider waits before it is tried again.
+    :param no_cache: A boolean flag to bypass the geocoding cache.
+    :param refresh: A boolean flag to ignore cached results and store fresh ones.
+    :param snap: Decimal places of the grid reverse geocoded points are snapped to.
+    :return: None.
+    """
+    geolocator = _fallback_geocoder(
+        providers,
+        failure_threshold,
+        latency_threshold,
+        reset_timeout,
+        no_cache,
+        refresh,
+    )
+
+    def geocode(query):
+        if forward:
+            provider, location = geolocator.geocode(query)
+        else:
+            provider, location = geolocator.reverse(query)
+        return dict({"provider": provider}, **location_to_dict(location, forward, raw))
+
+    fields = batch_fields(forward, raw)
+    fields.insert(2, "provider")
+    queries = read_queries(input, input_format=input_format, column=column)
+    with get_writer("ndjson", many=True, fields=fields) as writer:
+        for record in geocode_batch(
+            geocode, queries, concurrency=concurrency, snap=0 if forward else snap
+        ):
+            writer.write(record)
@@ -0,0 +1,376 @@
+"""This module defines an offline forward geocoder built from local address extracts.
+
+Addresses of OpenStreetMap PBF extracts and OpenAddresses CSV files are imported in
+a SQLite database with a full-text search (FTS5) index, so that forward geocoding
+is a local query ranked with BM25 instead of a network round trip. OSM extracts are
+read with the optional ``osmium`` package.
+
+Building is incremental: every imported file is recorded with its size and
+modification time, unchanged files are skipped and the places of a changed file are
+replaced. :class:`LocalGeocoder` answers from the index and falls back to a remote
+geocoder on a miss. Queries naming only a street or a city miss, as the index holds
+houses and named places rather than streets or cities.
+"""
+import csv
+import gzip
+import os
+import re
+import sqlite3
+import threading
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from maps.cache import default_cache_dir
+from maps.normalize import fold
+
+#: Tags of OSM objects which make up an address.
+OSM_ADDRESS_TAGS = ("addr:housenumber", "addr:street", "addr:city", "addr:postcode")
+
+OSM_EXTENSIONS = (".pbf", ".osm", ".osm.bz2", ".osm.gz")
+
+CSV_EXTENSIONS = (".csv", ".csv.gz")
+
+#: Number of best ranked matches checked with :func:`is_specific`.
+MAX_CANDIDATES = 20
+
+Place = Tuple[str, str, float, float]
+
+
+def default_index_path() -> str:
+    """Return the path of the address index.
+
+    ``MAPS_GEOINDEX`` takes precedence, otherwise ``addresses.sqlite`` in the user
+    cache directory is used.
+
+    :return: A file path.
+    """
+    if os.environ.get("MAPS_GEOINDEX"):
+        return os.environ["MAPS_GEOINDEX"]
+    return os.path.join(default_cache_dir(), "addresses.sqlite")
+
+
+def format_address(
+    number: str = "",
+    street: str = "",
+    unit: str = "",
+    city: str = "",
+    postcode: str = "",
+    region: str = "",
+) -> str:
+    """Join address parts, skipping empty ones.
+
+    :return: An address like ``10 Downing Street, London SW1A 2AA``.
+    """
+    line = " ".join(part for part in (number, street, unit) if part)
+    place = " ".join(part for part in (city, postcode) if part)
+    return ", ".join(part for part in (line, place, region) if part)
+
+
+def _open_text(path: str) -> IO[str]:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", newline="", encoding="utf-8")
+    return open(path, newline="", encoding="utf-8")
+
+
+def read_openaddresses(path: str) -> Iterator[Place]:
+    """Read an OpenAddresses CSV file, optionally gzipped.
+
+    :param path: The file path.
+    :return: An iterator of ``(ref, address, latitude, longitude)`` tuples. The ref is
+        the ``HASH`` or ``ID`` column, or the row number.
+    """
+    with _open_text(path) as fh:
+        for num, row in enumerate(csv.DictReader(fh)):
+            row = {key.upper(): (value or "").strip() for key, value in row.items()}
+            address = format_address(
+                row.get("NUMBER", ""),
+                row.get("STREET", ""),
+                row.get("UNIT", ""),
+                row.get("CITY", ""),
+                row.get("POSTCODE", ""),
+                row.get("REGION", ""),
+            )
+            if not address or not row.get("LAT") or not row.get("LON"):
+                continue
+            ref = row.get("HASH") or row.get("ID") or str(num)
+            yield ref, address, float(row["LAT"]), float(row["LON"])
+
+
+def _osm_address(tags) -> str:
+    number, street, city, postcode = (tags.get(tag, "") for tag in OSM_ADDRESS_TAGS)
+    address = format_address(number, street, city=city, postcode=postcode)
+    if number or street:
+        return address
+    if "name" in tags and "place" in tags:
+        return ", ".join(part for part in (tags["name"], address) if part)
+    return ""
+
+
+def read_osm(path: str) -> Iterator[Place]:
+    """Read the addresses and named places of an OSM extract.
+
+    Ways are located at the mean of their node locations.
+
+    :param path: A ``.pbf`` or ``.osm`` file.
+    :return: An iterator of ``(ref, address, latitude, longitude)`` tuples. The ref is
+        the OSM type and id, e.g. ``n123``.
+    :raises ImportError: If ``osmium`` is not installed.
+    """
+    import osmium
+
+    processor = osmium.FileProcessor(path).with_locations()
+    for obj in processor:
+        if not (obj.is_node() or obj.is_way()):
+            continue
+        address = _osm_address(obj.tags)
+        if not address:
+            continue
+        if obj.is_node():
+            if not obj.location.valid():
+                continue
+            lat, lon = obj.location.lat, obj.location.lon
+        else:
+            points = [node.location for node in obj.nodes if node.location.valid()]
+            if not points:
+                continue
+            lat = sum(point.lat for point in points) / len(points)
+            lon = sum(point.lon for point in points) / len(points)
+        yield f"{obj.type_str()}{obj.id}", address, lat, lon
+
+
+def read_places(path: str) -> Iterator[Place]:
+    """Read the places of an extract, choosing the reader by file extension.
+
+    :param path: An OSM (``.pbf``, ``.osm``) or OpenAddresses (``.csv``) file.
+    :return: An iterator of ``(ref, address, latitude, longitude)`` tuples.
+    :raises ValueError: If the extension is not supported.
+    """
+    name = path.lower()
+    if name.endswith(OSM_EXTENSIONS):
+        return read_osm(path)
+    if name.endswith(CSV_EXTENSIONS):
+        return read_openaddresses(path)
+    raise ValueError(
+        f"Unsupported extract {path}, use one of "
+        f"{', '.join(OSM_EXTENSIONS + CSV_EXTENSIONS)}."
+    )
+
+
+def match_expression(query: str) -> Optional[str]:
+    """Convert a free-form address to an FTS5 query matching all of its words.
+
+    :param query: An address.
+    :return: The query, or ``None`` if the address has no words.
+    """
+    words = re.findall(r"\w+", query.lower())
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words)
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"\w+", fold(text).casefold())
+
+
+def is_specific(query: str, address: str) -> bool:
+    """Tell whether a query names an address, rather than only its street or city.
+
+    The first part of the address, e.g. ``1 Kaiserplatz`` of
+    ``1 Kaiserplatz, Bonn 53113`` or the name of a place, must be fully contained in
+    the query, including the house number.
+
+    :param query: An address query.
+    :param address: An indexed address matching the query.
+    :return: ``True`` if the address answers the query.
+    """
+    return set(_words(address.split(",", 1)[0])) <= set(_words(query))
+
+
+class AddressIndex:
+    """A SQLite full-text index of addresses. An instance can be shared between
+    threads.
+
+    :param path: The database file, see :func:`default_index_path`.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        if path is None:
+            path = default_index_path()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS place ("
+                "id INTEGER PRIMARY KEY, source TEXT, ref TEXT, address TEXT, "
+                "lat REAL, lon REAL);"
+                "CREATE INDEX IF NOT EXISTS place_source ON place (source);"
+                "CREATE VIRTUAL TABLE IF NOT EXISTS place_fts USING fts5("
+                "address, content='place', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2');"
+                "CREATE TRIGGER IF NOT EXISTS place_insert AFTER INSERT ON place BEGIN "
+                "INSERT INTO place_fts (rowid, address) VALUES (new.id, new.address); "
+                "END;"
+                "CREATE TRIGGER IF NOT EXISTS place_delete AFTER DELETE ON place BEGIN "
+                "INSERT INTO place_fts (place_fts, rowid, address) "
+                "VALUES ('delete', old.id, old.address); END;"
+                "CREATE TABLE IF NOT EXISTS source ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime REAL, places INTEGER);"
+            )
+
+    def __enter__(self) -> "AddressIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the database connection."""
+        self._conn.close()
+
+    def add(self, path: str, places: Optional[Iterable[Place]] = None) -> int:
+        """Import the places of a file, replacing places previously imported from it.
+
+        :param path: The file path, which identifies the places in the index.
+        :param places: The places to import, by default read with
+            :func:`read_places`.
+        :return: The number of places imported.
+        """
+        source = os.path.abspath(path)
+        stat = os.stat(path)
+        if places is None:
+            places = read_places(path)
+        rows = ((source, *place) for place in places)
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM place WHERE source = ?", (source,))
+            count = self._conn.executemany(
+                "INSERT INTO place (source, ref, address, lat, lon) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            ).rowcount
+            self._conn.execute(
+                "INSERT OR REPLACE INTO source (path, size, mtime, places) "
+                "VALUES (?, ?, ?, ?)",
+                (source, stat.st_size, stat.st_mtime, count),
+            )
+        return count
+
+    def is_current(self, path: str) -> bool:
+        """Tell whether a file was imported and has not changed since.
+
+        :param path: The file path.
+        :return: ``True`` if the size and modification time are unchanged.
+        """
+        stat = os.stat(path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime FROM source WHERE path = ?",
+                (os.path.abspath(path),),
+            ).fetchone()
+        return row == (stat.st_size, stat.st_mtime)
+
+    def build(self, paths: Iterable[str], force: bool = False) -> Iterator[Dict]:
+        """Import files which are new or changed since they were last imported.
+
+        :param paths: The files, see :func:`read_places`.
+        :param force: A boolean flag to import unchanged files again.
+        :return: An iterator of ``{"file", "places", "updated"}`` dicts, one per file
+            once it is processed. ``places`` is ``None`` for skipped files.
+        """
+        for path in paths:
+            if not force and self.is_current(path):
+                yield {"file": path, "places": None, "updated": False}
+            else:
+                yield {"file": path, "places": self.add(path), "updated": True}
+
+    def lookup(self, query: str) -> Optional[Dict]:
+        """Find the best match of an address.
+
+        All words of the query must appear in the address, matches are ranked with
+        BM25 so that the most specific address wins. A match must also be specific
+        enough, see :func:`is_specific`, so that e.g. a query for a city does not
+        return one of its houses.
+
+        :param query: An address.
+        :return: A dict with the ``address``, ``lat``, ``lon``, ``ref`` and ``source``
+            of the match, or ``None``.
+        """
+        expression = match_expression(query)
+        if expression is None:
+            return None
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT place.address, place.lat, place.lon, place.ref, place.source "
+                "FROM place_fts JOIN place ON place.id = place_fts.rowid "
+                "WHERE place_fts MATCH ? ORDER BY bm25(place_fts) LIMIT ?",
+                (expression, MAX_CANDIDATES),
+            ).fetchall()
+        for row in rows:
+            if is_specific(query, row[0]):
+                return dict(zip(("address", "lat", "lon", "ref", "source"), row))
+        return None
+
+
+def _is_async(geolocator) -> bool:
+    from geopy.adapters import BaseAsyncAdapter
+
+    while not hasattr(geolocator, "adapter") and hasattr(geolocator, "geolocator"):
+        geolocator = geolocator.geolocator
+    return isinstance(getattr(geolocator, "adapter", None), BaseAsyncAdapter)
+
+
+class LocalGeocoder:
+    """A wrapper which answers forward geocoding queries from an
+    :class:`AddressIndex` and passes misses and reverse queries to a geopy geocoder.
+
+    Like the geocoder, its methods return coroutines if the geocoder uses an async
+    adapter.
+    """
+
+    def __init__(self, index: AddressIndex, geolocator):
+        self.index = index
+        self.geolocator = geolocator
+        self._async = _is_async(geolocator)
+
+    def _location(self, query: str):
+        from geopy.location import Location
+
+        match = self.index.lookup(query)
+        if match is None:
+            return None
+        raw = dict(match, display_name=match["address"])
+        return Location(match["address"], (match["lat"], match["lon"]), raw)
+
+    def geocode(self, query, **kwargs):
+        """Forward geocode ``query``, see :meth:`geopy.geocoders.Geocoder.geocode`."""
+        location = self._location(query)
+        if location is None:
+            return self.geolocator.geocode(query, **kwargs)
+        if self._async:
+            return _resolved(location)
+        return location
+
+    def reverse(self, query, **kwargs):
+        """Reverse geocode ``query``, see :meth:`geopy.geocoders.Geocoder.reverse`."""
+        return self.geolocator.reverse(query, **kwargs)
+
+
+async def _resolved(value):
+    return value
+
+
+def local_geolocator(geolocator, path: Optional[str] = None):
+    """Put the offline address index in front of a geolocator if the index exists.
+
+    :param geolocator: A geopy geocoder, possibly wrapped in a cache.
+    :param path: The index file, see :func:`default_index_path`.
+    :return: A :class:`LocalGeocoder`, or the geolocator if there is no index.
+    """
+    if path is None:
+        path = default_index_path()
+    if not os.path.exists(path):
+        return geolocator
+    return LocalGeocoder(AddressIndex(path), geolocator)
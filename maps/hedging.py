@@ -0,0 +1,172 @@
+"""This module defines request hedging to cut the tail latency of idempotent requests.
+
+When a request has not been answered within a percentile of the recent latencies, a
+duplicate is sent and whichever response arrives first is used. A budget keeps the
+number of hedged requests below a fraction of all requests, apart from a minimum
+number of hedges which lets a few requests be hedged as well.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait
+from typing import Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(thread_name_prefix="maps-hedge")
+        return _executor
+
+
+class HedgePolicy:
+    """Decide when to hedge a request and keep track of recent latencies.
+
+    :param percentile: The percentile of recent latencies after which a request is
+        hedged, e.g. ``95``.
+    :param budget: Maximum fraction of requests which may be hedged, e.g. ``0.05``.
+    :param min_hedges: Number of hedges allowed regardless of the fraction, so that
+        a few requests can be hedged as well. Not used with a budget of ``0``.
+    :param min_samples: Number of latencies needed before requests are hedged.
+    :param window: Number of recent latencies kept.
+
+    An instance can be shared between threads and by several clients of the same
+    service.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95,
+        budget: float = 0.05,
+        min_hedges: int = 1,
+        min_samples: int = 5,
+        window: int = 200,
+    ):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_hedges = min_hedges
+        self.min_samples = min_samples
+        self.latencies: deque = deque(maxlen=window)
+        self.requests = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float) -> None:
+        """Record the latency of a completed request.
+
+        :param latency: The latency in seconds.
+        """
+        with self._lock:
+            self.latencies.append(latency)
+
+    def delay(self) -> Optional[float]:
+        """Return the time after which an unanswered request is hedged.
+
+        :return: The delay in seconds, or ``None`` if too few latencies are known.
+        """
+        with self._lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return ordered[index]
+
+    def start(self) -> None:
+        """Count a new request towards the budget."""
+        with self._lock:
+            self.requests += 1
+
+    def acquire(self) -> bool:
+        """Take a hedge from the budget.
+
+        :return: ``True`` if the request may be hedged.
+        """
+        with self._lock:
+            allowed = self.budget * self.requests
+            if self.budget > 0:
+                allowed = max(self.min_hedges, allowed)
+            if self.hedges + 1 > allowed:
+                return False
+            self.hedges += 1
+            return True
+
+    def _timed(self, send_once: Callable[[], T]) -> T:
+        started = time.monotonic()
+        result = send_once()
+        self.record(time.monotonic() - started)
+        return result
+
+    def send(self, send_once: Callable[[], T]) -> T:
+        """Send an idempotent request, hedging it if it is slow.
+
+        :param send_once: A callable without arguments which sends the request once.
+        :return: The first successful result.
+        """
+        self.start()
+        delay = self.delay()
+        if delay is None:
+            return self._timed(send_once)
+        executor = _get_executor()
+        first = executor.submit(self._timed, send_once)
+        try:
+            return first.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
+        if not self.acquire():
+            return first.result()
+        second = executor.submit(self._timed, send_once)
+        done, _ = wait([first, second], return_when=FIRST_COMPLETED)
+        winner = done.pop()
+        loser = second if winner is first else first
+        if winner.exception() is not None:
+            return loser.result()
+        loser.add_done_callback(_close_response)
+        return winner.result()
+
+    async def _atimed(self, send_once: Callable[[], Awaitable[T]]) -> T:
+        started = time.monotonic()
+        result = await send_once()
+        self.record(time.monotonic() - started)
+        return result
+
+    async def asend(self, send_once: Callable[[], Awaitable[T]]) -> T:
+        """Async counterpart of :meth:`send`.
+
+        :param send_once: A callable without arguments which returns an awaitable
+            sending the request once.
+        :return: The first successful result.
+        """
+        self.start()
+        delay = self.delay()
+        first = asyncio.ensure_future(self._atimed(send_once))
+        if delay is None:
+            return await first
+        done, _ = await asyncio.wait([first], timeout=delay)
+        if done or not self.acquire():
+            return await first
+        second = asyncio.ensure_future(self._atimed(send_once))
+        done, _ = await asyncio.wait(
+            [first, second], return_when=asyncio.FIRST_COMPLETED
+        )
+        winner = done.pop()
+        loser = second if winner is first else first
+        if winner.exception() is not None:
+            return await loser
+        loser.cancel()
+        return winner.result()
+
+
+def _close_response(future) -> None:
+    if future.exception() is None:
+        close = getattr(future.result(), "close", None)
+        if close is not None:
+            close()
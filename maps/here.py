@@ -1,15 +1,91 @@
 """This module defines all the HERE commands."""
 import os
+from typing import List, Optional, Tuple
 
 import click
 import simplejson as json
-from geojsonio import display as geo_display
-from geopy.geocoders import Here
-from here_location_services import LS
-from here_location_services.config.routing_config import ROUTING_RETURN
 
+from maps.batch import batch_fields, geocode_batch, location_to_dict, read_queries
+from maps.cache import cached_geolocator
 from maps.exceptions import ApiKeyNotFoundError
-from maps.utils import get_feature_from_lat_lon, yield_subcommands
+from maps.output import get_writer
+from maps.transport import ensure_pool_size, ls_client
+from maps.utils import geo_display, get_feature_from_lat_lon, yield_subcommands
+
+TRANSPORT_MODES = ("car", "truck", "pedestrian", "bicycle", "scooter")
+
+#: Attributes returned in routes unless selected with --return.
+DEFAULT_RETURN = "polyline,elevation,instructions,actions"
+
+#: Return attributes which can only be requested along with another one.
+RETURN_REQUIRES = {
+    "actions": "polyline",
+    "instructions": "actions",
+    "turnByTurnActions": "polyline",
+}
+
+
+def parse_waypoint(value: str) -> List[float]:
+    """Parse a ``lat,lng`` string.
+
+    :param value: A location, e.g. ``52.5,13.4``.
+    :return: A ``[lat, lng]`` list.
+    :raises ValueError: If the value is not a pair of numbers.
+    """
+    lat, lng = value.split(",")
+    return [float(lat), float(lng)]
+
+
+def parse_via(value: Optional[str]) -> Optional[List[Tuple[float, float]]]:
+    """Parse via waypoints.
+
+    :param value: Locations separated by semicolons, e.g. ``52.5,13.4;52.6,13.5``.
+    :return: A list of ``(lat, lng)`` tuples, or ``None`` if there are none.
+    :raises ValueError: If a location is not a pair of numbers.
+    """
+    if not value:
+        return None
+    return [tuple(parse_waypoint(location)) for location in value.split(";")]
+
+
+def parse_return(value: str) -> List[str]:
+    """Parse the attributes to return in routes.
+
+    :param value: Comma-separated ``ROUTING_RETURN`` attributes, e.g. ``summary``.
+    :return: A list of attributes.
+    :raises click.BadParameter: If an attribute is unknown or misses an attribute it
+        requires.
+    """
+    from here_location_services.config.routing_config import return_attributes
+
+    attributes = [attr.strip() for attr in value.split(",") if attr.strip()]
+    unknown = [attr for attr in attributes if attr not in return_attributes]
+    if unknown:
+        raise click.BadParameter(
+            f"Unknown attributes {', '.join(unknown)}, choose from "
+            f"{', '.join(return_attributes)}.",
+            param_hint="--return",
+        )
+    for attr, required in RETURN_REQUIRES.items():
+        if attr in attributes and required not in attributes:
+            raise click.BadParameter(
+                f"{attr} requires {required}.", param_hint="--return"
+            )
+    return [return_attributes[attr] for attr in attributes]
+
+
+def find_route(ls, transport_mode: str, **kwargs):
+    """Calculate a route with the method of an LS client for ``transport_mode``.
+
+    :param ls: A :class:`here_location_services.LS` client.
+    :param transport_mode: One of :data:`TRANSPORT_MODES`.
+    :param kwargs: Keyword arguments passed to the routing method, e.g. ``origin``.
+    :return: A :class:`here_location_services.responses.RoutingResponse`.
+    :raises ValueError: If the transport mode is unknown.
+    """
+    if transport_mode not in TRANSPORT_MODES:
+        raise ValueError(f"Unknown transport mode: {transport_mode}")
+    return getattr(ls, f"{transport_mode}_route")(**kwargs)
 
 
 @click.group()
@@ -35,10 +111,16 @@ def show():
     show_default=True,
     help="Perform a forward or reverse geocode",
 )
+@click.option(
+    "--no-cache", "no_cache", is_flag=True, help="Do not use the geocoding cache."
+)
+@click.option(
+    "--refresh", is_flag=True, help="Ignore cached results and store fresh ones."
+)
 @click.option("--raw", is_flag=True)
 @click.option("--display", help="Display result in browser", is_flag=True)
 @click.pass_context
-def geocoding(ctx, query, apikey, forward, raw, display):
+def geocoding(ctx, query, apikey, forward, raw, display, no_cache, refresh):
     """
     HERE's geocoding service.
     \f
@@ -49,6 +131,8 @@ def geocoding(ctx, query, apikey, forward, raw, display):
     :param forward: A boolean flag for forward/reverse geocoding.
     :param raw: A boolean flag to show api response as it is.
     :param display: A boolean flag to show result in web browser.
+    :param no_cache: A boolean flag to bypass the geocoding cache.
+    :param refresh: A boolean flag to ignore cached results and store fresh ones.
     :return: None.
     """
     apikey = apikey or os.environ.get("HERE_APIKEY")
@@ -58,23 +142,153 @@ def geocoding(ctx, query, apikey, forward, raw, display):
             "variable in HERE_APIKEY "
         )
     ctx.obj["apikey"] = apikey
-    geolocator = Here(apikey=ctx.obj["apikey"])
+    from geopy.geocoders import Here
+
+    from maps.adapters import PooledRequestsAdapter
+
+    geolocator = cached_geolocator(
+        Here(apikey=ctx.obj["apikey"], adapter_factory=PooledRequestsAdapter),
+        "here",
+        no_cache=no_cache,
+        refresh=refresh,
+    )
     if forward:
         location = geolocator.geocode(query)
         if raw:
-            click.secho(json.dumps(location.raw, indent=2), fg="green")
+            with get_writer() as writer:
+                writer.write(location.raw)
         elif display:
             feature = get_feature_from_lat_lon(location.latitude, location.longitude)
             geo_display(feature)
         else:
-            result = {"lat": location.latitude, "lon": location.longitude}
-            click.secho(json.dumps(result, indent=2), fg="green")
+            with get_writer() as writer:
+                writer.write({"lat": location.latitude, "lon": location.longitude})
     else:
         location = geolocator.reverse(query)
-        if raw:
-            click.secho(json.dumps(location.raw, indent=2), fg="green")
+        with get_writer() as writer:
+            if raw:
+                writer.write(location.raw)
+            elif writer.output_format == "json":
+                writer.write(location.address)
+            else:
+                writer.write(
+                    {
+                        "address": location.address,
+                        "lat": location.latitude,
+                        "lon": location.longitude,
+                    }
+                )
+
+
+@here.command(
+    short_help="forward or reverse geocode addresses or coordinates from a file."
+)
+@click.argument("input", type=click.File("r"), default="-")
+@click.option("--apikey", help="Your HERE API key", type=str)
+@click.option(
+    "--forward/--reverse",
+    default=True,
+    show_default=True,
+    help="Perform a forward or reverse geocode",
+)
+@click.option(
+    "--input_format",
+    type=click.Choice(["csv", "ndjson"]),
+    default="csv",
+    show_default=True,
+    help="Format of the input records.",
+)
+@click.option(
+    "--column",
+    default="query",
+    show_default=True,
+    help="Name of the column holding the query.",
+)
+@click.option(
+    "--concurrency",
+    default=8,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of requests in flight.",
+)
+@click.option(
+    "--no-cache", "no_cache", is_flag=True, help="Do not use the geocoding cache."
+)
+@click.option(
+    "--refresh", is_flag=True, help="Ignore cached results and store fresh ones."
+)
+@click.option("--raw", is_flag=True)
+@click.option(
+    "--snap",
+    default=0,
+    type=click.IntRange(min=0, max=10),
+    help="Reverse geocode one point per grid cell of this many decimal places, e.g. "
+    "4 for about 11 meters, and give its result to every point of the cell. "
+    "0 geocodes every point.",
+)
+@click.pass_context
+def batch_geocoding(
+    ctx,
+    input,
+    apikey,
+    forward,
+    input_format,
+    column,
+    concurrency,
+    raw,
+    no_cache,
+    refresh,
+    snap,
+):
+    """
+    HERE's geocoding service for many queries read from a file or stdin.
+    Results are written in input order, as one JSON object per line by default.
+    \f
+
+    :param ctx: A context dictionary.
+    :param input: A CSV or NDJSON file with one query per record, ``-`` for stdin.
+    :param apikey: An API key for authentication.
+    :param forward: A boolean flag for forward/reverse geocoding.
+    :param input_format: Format of the input records, ``csv`` or ``ndjson``.
+    :param column: Name of the column holding the query.
+    :param concurrency: Maximum number of requests in flight.
+    :param raw: A boolean flag to show api response as it is.
+    :param no_cache: A boolean flag to bypass the geocoding cache.
+    :param refresh: A boolean flag to ignore cached results and store fresh ones.
+    :param snap: Decimal places of the grid reverse geocoded points are snapped to.
+    :return: None.
+    """
+    apikey = apikey or os.environ.get("HERE_APIKEY")
+    if apikey is None:
+        raise ApiKeyNotFoundError(
+            "Please pass HERE API KEY as --apikey or set it as environment "
+            "variable in HERE_APIKEY "
+        )
+    ctx.obj["apikey"] = apikey
+    from geopy.geocoders import Here
+
+    from maps.adapters import PooledAioHTTPAdapter
+
+    geolocator = cached_geolocator(
+        Here(apikey=ctx.obj["apikey"], adapter_factory=PooledAioHTTPAdapter),
+        "here",
+        no_cache=no_cache,
+        refresh=refresh,
+    )
+
+    async def geocode(query):
+        if forward:
+            location = await geolocator.geocode(query)
         else:
-            click.secho(location.address, fg="green")
+            location = await geolocator.reverse(query)
+        return location_to_dict(location, forward, raw)
+
+    queries = read_queries(input, input_format=input_format, column=column)
+    with get_writer("ndjson", many=True, fields=batch_fields(forward, raw)) as writer:
+        for record in geocode_batch(
+            geocode, queries, concurrency=concurrency, snap=0 if forward else snap
+        ):
+            writer.write(record)
 
 
 @here.command(short_help="Search places using free-form text query.")
@@ -153,7 +367,7 @@ def discover(
             "variable in HERE_APIKEY "
         )
     ctx.obj["apikey"] = apikey
-    ls = LS(api_key=apikey)
+    ls = ls_client(apikey)
     result = ls.discover(
         query=query,
         center=coordinates.split(",")[::-1] if coordinates else coordinates,
@@ -164,17 +378,19 @@ def discover(
         lang=lang,
     )
     if raw:
-        click.secho(json.dumps(result.response, indent=2), fg="green")
+        with get_writer() as writer:
+            writer.write(result.response)
     elif display:
         geo_display(json.dumps(result.to_geojson(), indent=2))
     else:
-        click.secho(json.dumps(result.items, indent=2), fg="green")
+        with get_writer() as writer:
+            writer.write(result.items)
 
 
 @here.command(short_help="find route between two or more locations.")
 @click.option(
     "--transport_mode",
-    type=click.Choice(["car", "truck", "pedestrian", "bicycle", "scooter"]),
+    type=click.Choice(TRANSPORT_MODES),
     required=True,
 )
 @click.option(
@@ -211,6 +427,30 @@ def discover(
     " The value should comply with the IETF BCP 47.",
     default="en-US",
 )
+@click.option(
+    "--return",
+    "return_results",
+    default=DEFAULT_RETURN,
+    show_default=True,
+    help="Comma-separated attributes to return in routes, e.g. summary for durations "
+    "and lengths only. One or more of polyline, actions, instructions, summary, "
+    "travelSummary, mlDuration, turnByTurnActions, elevation, routeHandle, passthrough "
+    "and incidents.",
+)
+@click.option(
+    "--simplify",
+    type=click.Choice(["dp", "vw"]),
+    default="dp",
+    show_default=True,
+    help="Line simplification algorithm, Douglas-Peucker (dp) or Visvalingam-Whyatt (vw).",
+)
+@click.option(
+    "--tolerance",
+    type=click.FloatRange(min=0),
+    default=0,
+    show_default=True,
+    help="Simplification tolerance in degrees, 0 to keep all points of the route.",
+)
 @click.option("--apikey", help="Your HERE API key", type=str)
 @click.option("--raw", is_flag=True)
 @click.option("--display", help="Display result in browser", is_flag=True)
@@ -224,13 +464,19 @@ def route(
     routing_mode,
     alternatives,
     lang,
+    return_results,
+    simplify,
+    tolerance,
     apikey,
     raw,
     display,
 ):
     """
     find route between two or more locations.
+    Route polylines are simplified with --tolerance. With --display or the geojsonseq
+    format, route sections are decoded to lines with the elevation as third coordinate.
     """
+    return_results = parse_return(return_results)
     apikey = apikey or os.environ.get("HERE_APIKEY")
     if apikey is None:
         raise ApiKeyNotFoundError(
@@ -238,85 +484,151 @@ def route(
             "variable in HERE_APIKEY "
         )
     ctx.obj["apikey"] = apikey
-    ls = LS(api_key=apikey)
-    if transport_mode == "car":
-        result = ls.car_route(
-            origin=origin.split(","),
-            destination=destination.split(","),
-            via=via if via else None,
-            routing_mode=routing_mode,
-            alternatives=alternatives,
-            lang=lang,
-            return_results=[
-                ROUTING_RETURN.polyline,
-                ROUTING_RETURN.elevation,
-                ROUTING_RETURN.instructions,
-                ROUTING_RETURN.actions,
-            ],
-        )
-    elif transport_mode == "truck":
-        result = ls.truck_route(
-            origin=origin.split(","),
-            destination=destination.split(","),
-            via=via if via else None,
-            routing_mode=routing_mode,
-            alternatives=alternatives,
-            lang=lang,
-            return_results=[
-                ROUTING_RETURN.polyline,
-                ROUTING_RETURN.elevation,
-                ROUTING_RETURN.instructions,
-                ROUTING_RETURN.actions,
-            ],
-        )
-    elif transport_mode == "pedestrian":
-        result = ls.pedestrian_route(
-            origin=origin.split(","),
-            destination=destination.split(","),
-            via=via if via else None,
-            routing_mode=routing_mode,
-            alternatives=alternatives,
-            lang=lang,
-            return_results=[
-                ROUTING_RETURN.polyline,
-                ROUTING_RETURN.elevation,
-                ROUTING_RETURN.instructions,
-                ROUTING_RETURN.actions,
-            ],
-        )
-    elif transport_mode == "bicycle":
-        result = ls.bicycle_route(
-            origin=origin.split(","),
-            destination=destination.split(","),
-            via=via if via else None,
-            routing_mode=routing_mode,
-            alternatives=alternatives,
-            lang=lang,
-            return_results=[
-                ROUTING_RETURN.polyline,
-                ROUTING_RETURN.elevation,
-                ROUTING_RETURN.instructions,
-                ROUTING_RETURN.actions,
-            ],
-        )
-    elif transport_mode == "scooter":
-        result = ls.scooter_route(
-            origin=origin.split(","),
-            destination=destination.split(","),
-            via=via if via else None,
-            routing_mode=routing_mode,
-            alternatives=alternatives,
-            lang=lang,
-            return_results=[
-                ROUTING_RETURN.polyline,
-                ROUTING_RETURN.elevation,
-                ROUTING_RETURN.instructions,
-                ROUTING_RETURN.actions,
-            ],
-        )
+    ls = ls_client(apikey)
+    result = find_route(
+        ls,
+        transport_mode,
+        origin=parse_waypoint(origin),
+        destination=parse_waypoint(destination),
+        via=parse_via(via),
+        routing_mode=routing_mode,
+        alternatives=alternatives,
+        lang=lang,
+        return_results=return_results,
+    )
+    from maps.polyline import route_features, simplify_routes
+
     if raw:
-        click.secho(json.dumps(result.response, indent=2), fg="green")
+        with get_writer() as writer:
+            writer.write(result.response)
     elif display:
-        geo_display(json.dumps(result.to_geojson(), indent=2))
+        feature_collection = route_features(result.routes, simplify, tolerance)
+        geo_display(json.dumps(feature_collection, indent=2))
     else:
-        click.secho(json.dumps(result.routes, indent=2), fg="green")
+        with get_writer() as writer:
+            if writer.output_format == "geojsonseq":
+                writer.write(route_features(result.routes, simplify, tolerance))
+            else:
+                writer.write(simplify_routes(result.routes, simplify, tolerance))
+
+
+@here.command(
+    short_help="find routes between many origins and destinations from a file."
+)
+@click.argument("input", type=click.File("r"), default="-")
+@click.option(
+    "--transport_mode",
+    type=click.Choice(TRANSPORT_MODES),
+    default="car",
+    show_default=True,
+    help="Transport mode of the records without a transport_mode value.",
+)
+@click.option(
+    "--routing_mode",
+    help="Specifies which optimization is applied during route calculation.",
+    type=click.Choice(["fast", "short"]),
+    default="fast",
+    show_default=True,
+)
+@click.option(
+    "--lang",
+    help="Specifies the preferred language of the response."
+    " The value should comply with the IETF BCP 47.",
+    default="en-US",
+)
+@click.option(
+    "--return",
+    "return_results",
+    default=DEFAULT_RETURN,
+    show_default=True,
+    help="Comma-separated attributes to return in routes, e.g. summary for durations "
+    "and lengths only. One or more of polyline, actions, instructions, summary, "
+    "travelSummary, mlDuration, turnByTurnActions, elevation, routeHandle, passthrough "
+    "and incidents.",
+)
+@click.option(
+    "--input_format",
+    type=click.Choice(["csv", "ndjson"]),
+    default="csv",
+    show_default=True,
+    help="Format of the input records.",
+)
+@click.option(
+    "--concurrency",
+    default=8,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of requests in flight.",
+)
+@click.option("--apikey", help="Your HERE API key", type=str)
+@click.pass_context
+def batch_route(
+    ctx,
+    input,
+    transport_mode,
+    routing_mode,
+    lang,
+    return_results,
+    input_format,
+    concurrency,
+    apikey,
+):
+    """
+    find routes for many origin/destination pairs read from a file or stdin.
+    Every record has an origin and a destination (lat,lng), and optionally a
+    transport_mode and via waypoints separated by semicolons. Routes are written as
+    soon as they are found, with the id of their record, as one JSON object per line
+    by default.
+    \f
+
+    :param ctx: A context dictionary.
+    :param input: A CSV or NDJSON file with one origin/destination pair per record,
+        ``-`` for stdin.
+    :param transport_mode: The transport mode of records without one.
+    :param routing_mode: Specifies which optimization is applied during route calculation.
+    :param lang: Specifies the preferred language of the response.
+    :param return_results: Comma-separated attributes to return in routes.
+    :param input_format: Format of the input records, ``csv`` or ``ndjson``.
+    :param concurrency: Maximum number of requests in flight.
+    :param apikey: An API key for authentication.
+    :return: None.
+    """
+    apikey = apikey or os.environ.get("HERE_APIKEY")
+    if apikey is None:
+        raise ApiKeyNotFoundError(
+            "Please pass HERE API KEY as --apikey or set it as environment "
+            "variable in HERE_APIKEY "
+        )
+    ctx.obj["apikey"] = apikey
+    from maps.batch import read_records
+    from maps.engine import imap_unordered
+
+    return_results = parse_return(return_results)
+    ls = ls_client(apikey)
+
+    def route_record(item):
+        row_id, row = item
+        record = {"id": row_id}
+        try:
+            if not row.get("origin") or not row.get("destination"):
+                raise ValueError("Record has no origin or destination.")
+            result = find_route(
+                ls,
+                row.get("transport_mode") or transport_mode,
+                origin=parse_waypoint(row["origin"]),
+                destination=parse_waypoint(row["destination"]),
+                via=parse_via(row.get("via")),
+                routing_mode=routing_mode,
+                lang=lang,
+                return_results=return_results,
+            )
+            record["routes"] = result.routes
+        except Exception as err:
+            record["error"] = str(err) or type(err).__name__
+        return record
+
+    ensure_pool_size(concurrency)
+    records = read_records(input, input_format=input_format)
+    with get_writer("ndjson", many=True, fields=["id", "routes", "error"]) as writer:
+        for record in imap_unordered(route_record, records, concurrency=concurrency):
+            writer.write(record)
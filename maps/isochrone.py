@@ -0,0 +1,258 @@
+"""This module defines cached isochrones of the Mapbox Isochrone API.
+
+Contours are cached one by one, keyed by profile, ``polygons`` flag, ``denoise`` and
+the center snapped to ``precision`` decimal places. A request is answered from the
+contours already cached, so a cached set of contours serves any subset of its
+minutes and only missing contours are fetched. The API accepts at most
+:data:`MAX_CONTOURS` contours per request, so longer lists are split into several
+requests and merged.
+
+Isochrones of many centers are computed concurrently with :func:`isochrone_batch`,
+and the coverage of all centers per contour is merged with :class:`ContourUnion`,
+which requires the optional ``shapely`` package.
+"""
+from collections import defaultdict
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from maps.batch import read_queries
+from maps.cache import MISS, GeocodeCache
+from maps.engine import imap_ordered
+from maps.transport import ensure_pool_size
+
+#: Maximum number of contours of a single Isochrone API request.
+MAX_CONTOURS = 4
+
+#: Decimal places of the snapped center, about 11 meters.
+DEFAULT_PRECISION = 4
+
+
+def snap_center(coordinates: Sequence, precision: int = DEFAULT_PRECISION) -> Tuple:
+    """Snap a center to a grid, so that nearby centers share cached contours.
+
+    :param coordinates: A ``(longitude, latitude)`` pair of numbers or strings.
+    :param precision: Number of decimal places kept.
+    :return: The snapped ``(longitude, latitude)`` pair.
+    """
+    lon, lat = coordinates
+    return round(float(lon), precision), round(float(lat), precision)
+
+
+def isochrone_key(
+    profile: str, center: Tuple, polygons: bool, denoise: Optional[float]
+) -> str:
+    """Return the cache key of the contours of an isochrone request.
+
+    :param profile: A Mapbox Directions routing profile ID.
+    :param center: A snapped ``(longitude, latitude)`` pair.
+    :param polygons: Whether the contours are polygons.
+    :param denoise: The ``denoise`` parameter of the request.
+    :return: A key shared by all contours of the request.
+    """
+    denoise = None if denoise is None else float(denoise)
+    return f"{profile}:{center[0]!r},{center[1]!r}:{polygons}:{denoise!r}"
+
+
+def color_contours(features: Iterable[Dict], colors: Dict[int, str]) -> None:
+    """Set the colors of contours in place.
+
+    :param features: Contour features of the Isochrone API.
+    :param colors: A dict mapping contour minutes to hex colors without leading ``#``.
+    """
+    for feature in features:
+        properties = feature["properties"]
+        color = colors.get(properties.get("contour"))
+        if color is None:
+            continue
+        properties["color"] = f"#{color}"
+        if "fill" in properties:
+            properties["fill"] = properties["fillColor"] = f"#{color}"
+
+
+def cached_isochrone(
+    client,
+    profile: str,
+    coordinates: Sequence,
+    contours_minutes: Sequence,
+    contours_colors: Optional[Sequence[str]] = None,
+    polygons: bool = False,
+    denoise: Optional[float] = 1.0,
+    cache: Optional[GeocodeCache] = None,
+    precision: int = DEFAULT_PRECISION,
+    refresh: bool = False,
+) -> Dict:
+    """Compute an isochrone, reusing cached contours.
+
+    Parameters are the same as for :meth:`maps.apis.mapbox.MapBoxApi.isochrone`,
+    except that any number of contours may be given.
+
+    :param client: A :class:`maps.apis.mapbox.MapBoxApi`.
+    :param cache: The cache of contours, or ``None`` to fetch all contours.
+    :param precision: Number of decimal places the center is snapped to, so that
+        nearby centers share cached contours. Not used without a cache.
+    :param refresh: A boolean flag to ignore cached contours and store fresh ones.
+    :return: A feature collection with one feature per contour, the largest first.
+    :raises ValueError: If the numbers of colors and contours differ.
+    """
+    minutes = [int(minute) for minute in contours_minutes]
+    if contours_colors and len(contours_colors) != len(minutes):
+        raise ValueError("There must be as many contours_colors as contours_minutes.")
+    if cache is None:
+        center = tuple(float(coord) for coord in coordinates)
+    else:
+        center = snap_center(coordinates, precision)
+        key = isochrone_key(profile, center, polygons, denoise)
+
+    contours: Dict[int, Dict] = {}
+    missing: List[int] = []
+    for minute in sorted(set(minutes)):
+        value = MISS
+        if cache is not None and not refresh:
+            value = cache.get("mapbox", "isochrone", f"{key}:{minute}")
+        if value is MISS:
+            missing.append(minute)
+        else:
+            contours[minute] = value
+
+    for start in range(0, len(missing), MAX_CONTOURS):
+        chunk = missing[start : start + MAX_CONTOURS]
+        resp = client.isochrone(
+            profile=profile,
+            coordinates=list(center),
+            contours_minutes=chunk,
+            polygons=polygons,
+            denoise=denoise,
+        )
+        for feature in resp.json()["features"]:
+            minute = feature["properties"]["contour"]
+            contours[minute] = feature
+            if cache is not None:
+                cache.set("mapbox", "isochrone", f"{key}:{minute}", feature)
+
+    features = [contours[minute] for minute in sorted(contours, reverse=True)]
+    if contours_colors:
+        color_contours(features, dict(zip(minutes, contours_colors)))
+    return {"features": features, "type": "FeatureCollection"}
+
+
+def read_centers(
+    fh: IO[str], input_format: str = "csv", column: str = "coordinates"
+) -> Iterator[Tuple[Any, Tuple[float, float]]]:
+    """Read isochrone centers from a CSV or NDJSON stream.
+
+    A center is either a ``{longitude},{latitude}`` string in ``column`` or given by
+    ``lat`` and ``lon`` values, see :func:`maps.batch.read_queries`.
+
+    :param fh: A text stream to read from, e.g. a file or ``sys.stdin``.
+    :param input_format: Either ``csv`` (with a header row) or ``ndjson``.
+    :param column: Name of the column/key which holds the coordinates.
+    :return: An iterator of ``(id, (longitude, latitude))`` tuples.
+    :raises ValueError: If a record has no valid coordinates.
+    """
+    for row_id, query in read_queries(fh, input_format=input_format, column=column):
+        if isinstance(query, str):
+            lon, lat = query.split(",")
+            yield row_id, (float(lon), float(lat))
+        else:
+            lat, lon = query
+            yield row_id, (lon, lat)
+
+
+def isochrone_batch(
+    client,
+    centers: Iterable[Tuple[Any, Tuple[float, float]]],
+    profile: str,
+    contours_minutes: Sequence,
+    polygons: bool = False,
+    denoise: Optional[float] = 1.0,
+    cache: Optional[GeocodeCache] = None,
+    precision: int = DEFAULT_PRECISION,
+    refresh: bool = False,
+    concurrency: int = 8,
+) -> Iterator[Dict]:
+    """Compute the isochrones of many centers concurrently, in input order.
+
+    Every contour feature gets the ``id`` of its center as property. Failures do not
+    stop the batch; a center which failed yields a feature without geometry with the
+    ``id`` and ``error`` properties. The other parameters are the same as for
+    :func:`cached_isochrone`.
+
+    :param client: A :class:`maps.apis.mapbox.MapBoxApi`, shared by all requests.
+    :param centers: An iterable of ``(id, (longitude, latitude))`` tuples, see
+        :func:`read_centers`.
+    :param concurrency: Maximum number of requests in flight.
+    :return: An iterator of feature collections, or features for failed centers.
+    """
+
+    def _run(item):
+        row_id, center = item
+        try:
+            feature_collection = cached_isochrone(
+                client,
+                profile,
+                center,
+                contours_minutes,
+                polygons=polygons,
+                denoise=denoise,
+                cache=cache,
+                precision=precision,
+                refresh=refresh,
+            )
+        except Exception as err:
+            return {
+                "type": "Feature",
+                "geometry": None,
+                "properties": {"id": row_id, "error": str(err) or type(err).__name__},
+            }
+        for feature in feature_collection["features"]:
+            feature["properties"]["id"] = row_id
+        return feature_collection
+
+    ensure_pool_size(concurrency)
+    return imap_ordered(_run, centers, concurrency=concurrency)
+
+
+class ContourUnion:
+    """The union of the isochrone polygons of many centers, per contour.
+
+    Polygons are collected as they arrive and merged at the end with
+    :func:`shapely.ops.unary_union`, which unions them pairwise in a tree instead of
+    growing one polygon by merging one center at a time.
+
+    :raises ImportError: If ``shapely`` is not installed.
+    """
+
+    def __init__(self):
+        import shapely.geometry  # noqa: F401
+
+        self._geometries: Dict[int, List] = defaultdict(list)
+
+    def add(self, feature_collection: Dict) -> None:
+        """Add the contours of a center.
+
+        :param feature_collection: A feature collection of polygon contours.
+        """
+        from shapely.geometry import shape
+
+        for feature in feature_collection.get("features", []):
+            if feature.get("geometry") is not None:
+                self._geometries[feature["properties"]["contour"]].append(
+                    shape(feature["geometry"])
+                )
+
+    def features(self) -> List[Dict]:
+        """Merge the polygons of every contour.
+
+        :return: One feature per contour with the ``contour`` and ``count`` (number of
+            polygons merged) properties, the largest contour first.
+        """
+        from shapely.geometry import mapping
+        from shapely.ops import unary_union
+
+        return [
+            {
+                "type": "Feature",
+                "geometry": mapping(unary_union(geometries)),
+                "properties": {"contour": minute, "count": len(geometries)},
+            }
+            for minute, geometries in sorted(self._geometries.items(), reverse=True)
+        ]
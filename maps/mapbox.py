@@ -3,12 +3,21 @@ import os
 
 import click
 import simplejson as json
-from geojsonio import display as geo_display
-from geopy.geocoders import MapBox
 
 from maps.apis.mapbox import MapBoxApi
+from maps.batch import batch_fields, geocode_batch, location_to_dict, read_queries
+from maps.cache import GeocodeCache, cached_geolocator
 from maps.exceptions import ApiKeyNotFoundError
-from maps.utils import get_feature_from_lat_lon, yield_subcommands
+from maps.hedging import HedgePolicy
+from maps.isochrone import (
+    DEFAULT_PRECISION,
+    ContourUnion,
+    cached_isochrone,
+    isochrone_batch,
+    read_centers,
+)
+from maps.output import get_writer
+from maps.utils import geo_display, get_feature_from_lat_lon, yield_subcommands
 
 
 @click.group()
@@ -34,10 +43,16 @@ def show():
     show_default=True,
     help="Perform a forward or reverse geocode",
 )
+@click.option(
+    "--no-cache", "no_cache", is_flag=True, help="Do not use the geocoding cache."
+)
+@click.option(
+    "--refresh", is_flag=True, help="Ignore cached results and store fresh ones."
+)
 @click.option("--raw", help="Show response body as it is from API", is_flag=True)
 @click.option("--display", help="Display result in browser", is_flag=True)
 @click.pass_context
-def geocoding(ctx, query, apikey, forward, raw, display):
+def geocoding(ctx, query, apikey, forward, raw, display, no_cache, refresh):
     """
     MapBox's geocoding service.
     \f
@@ -48,6 +63,8 @@ def geocoding(ctx, query, apikey, forward, raw, display):
     :param forward: A boolean flag for forward/reverse geocoding.
     :param raw: A boolean flag to show api response as it is.
     :param display: A boolean flag to show result in web browser.
+    :param no_cache: A boolean flag to bypass the geocoding cache.
+    :param refresh: A boolean flag to ignore cached results and store fresh ones.
     :return: None.
     """
     apikey = apikey or os.environ.get("MAPBOX_APIKEY")
@@ -57,23 +74,153 @@ def geocoding(ctx, query, apikey, forward, raw, display):
             "variable in MAPBOX_APIKEY "
         )
     ctx.obj["apikey"] = apikey
-    geolocator = MapBox(api_key=ctx.obj["apikey"])
+    from geopy.geocoders import MapBox
+
+    from maps.adapters import PooledRequestsAdapter
+
+    geolocator = cached_geolocator(
+        MapBox(api_key=ctx.obj["apikey"], adapter_factory=PooledRequestsAdapter),
+        "mapbox",
+        no_cache=no_cache,
+        refresh=refresh,
+    )
     if forward:
         location = geolocator.geocode(query)
         if raw:
-            click.secho(json.dumps(location.raw, indent=2), fg="green")
+            with get_writer() as writer:
+                writer.write(location.raw)
         elif display:
             feature = get_feature_from_lat_lon(location.latitude, location.longitude)
             geo_display(feature)
         else:
-            result = {"lat": location.latitude, "lon": location.longitude}
-            click.secho(json.dumps(result, indent=2), fg="green")
+            with get_writer() as writer:
+                writer.write({"lat": location.latitude, "lon": location.longitude})
     else:
         location = geolocator.reverse(query)
-        if raw:
-            click.secho(json.dumps(location.raw, indent=2), fg="green")
+        with get_writer() as writer:
+            if raw:
+                writer.write(location.raw)
+            elif writer.output_format == "json":
+                writer.write(location.address)
+            else:
+                writer.write(
+                    {
+                        "address": location.address,
+                        "lat": location.latitude,
+                        "lon": location.longitude,
+                    }
+                )
+
+
+@mapbox.command(
+    short_help="forward or reverse geocode addresses or coordinates from a file."
+)
+@click.argument("input", type=click.File("r"), default="-")
+@click.option("--apikey", help="Your MapBox API key", type=str)
+@click.option(
+    "--forward/--reverse",
+    default=True,
+    show_default=True,
+    help="Perform a forward or reverse geocode",
+)
+@click.option(
+    "--input_format",
+    type=click.Choice(["csv", "ndjson"]),
+    default="csv",
+    show_default=True,
+    help="Format of the input records.",
+)
+@click.option(
+    "--column",
+    default="query",
+    show_default=True,
+    help="Name of the column holding the query.",
+)
+@click.option(
+    "--concurrency",
+    default=8,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of requests in flight.",
+)
+@click.option(
+    "--no-cache", "no_cache", is_flag=True, help="Do not use the geocoding cache."
+)
+@click.option(
+    "--refresh", is_flag=True, help="Ignore cached results and store fresh ones."
+)
+@click.option("--raw", is_flag=True)
+@click.option(
+    "--snap",
+    default=0,
+    type=click.IntRange(min=0, max=10),
+    help="Reverse geocode one point per grid cell of this many decimal places, e.g. "
+    "4 for about 11 meters, and give its result to every point of the cell. "
+    "0 geocodes every point.",
+)
+@click.pass_context
+def batch_geocoding(
+    ctx,
+    input,
+    apikey,
+    forward,
+    input_format,
+    column,
+    concurrency,
+    raw,
+    no_cache,
+    refresh,
+    snap,
+):
+    """
+    MapBox's geocoding service for many queries read from a file or stdin.
+    Results are written in input order, as one JSON object per line by default.
+    \f
+
+    :param ctx: A context dictionary.
+    :param input: A CSV or NDJSON file with one query per record, ``-`` for stdin.
+    :param apikey: An API key for authentication.
+    :param forward: A boolean flag for forward/reverse geocoding.
+    :param input_format: Format of the input records, ``csv`` or ``ndjson``.
+    :param column: Name of the column holding the query.
+    :param concurrency: Maximum number of requests in flight.
+    :param raw: A boolean flag to show api response as it is.
+    :param no_cache: A boolean flag to bypass the geocoding cache.
+    :param refresh: A boolean flag to ignore cached results and store fresh ones.
+    :param snap: Decimal places of the grid reverse geocoded points are snapped to.
+    :return: None.
+    """
+    apikey = apikey or os.environ.get("MAPBOX_APIKEY")
+    if apikey is None:
+        raise ApiKeyNotFoundError(
+            "Please pass MAPBOX API KEY as --apikey or set it as environment "
+            "variable in MAPBOX_APIKEY "
+        )
+    ctx.obj["apikey"] = apikey
+    from geopy.geocoders import MapBox
+
+    from maps.adapters import PooledAioHTTPAdapter
+
+    geolocator = cached_geolocator(
+        MapBox(api_key=ctx.obj["apikey"], adapter_factory=PooledAioHTTPAdapter),
+        "mapbox",
+        no_cache=no_cache,
+        refresh=refresh,
+    )
+
+    async def geocode(query):
+        if forward:
+            location = await geolocator.geocode(query)
         else:
-            click.secho(location.address, fg="green")
+            location = await geolocator.reverse(query)
+        return location_to_dict(location, forward, raw)
+
+    queries = read_queries(input, input_format=input_format, column=column)
+    with get_writer("ndjson", many=True, fields=batch_fields(forward, raw)) as writer:
+        for record in geocode_batch(
+            geocode, queries, concurrency=concurrency, snap=0 if forward else snap
+        ):
+            writer.write(record)
 
 
 @mapbox.command(short_help="isochrone to get reachable areas on map.")
@@ -104,6 +251,32 @@ def geocoding(ctx, query, apikey, forward, raw, display):
     help="Specify whether to return the contours as GeoJSON polygons (True) or linestrings "
     "(False).",
 )
+@click.option(
+    "--precision",
+    default=DEFAULT_PRECISION,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Decimal places to which the center is snapped, so that nearby centers share "
+    "cached contours.",
+)
+@click.option(
+    "--no-cache",
+    "no_cache",
+    is_flag=True,
+    help="Do not use the isochrone cache.",
+)
+@click.option(
+    "--refresh",
+    is_flag=True,
+    help="Ignore cached contours and store fresh ones.",
+)
+@click.option(
+    "--hedge",
+    type=click.FloatRange(min=0, max=100),
+    help="Send a duplicate of a request which is slower than this percentile of the "
+    "recent latencies, e.g. 95. Requests are hedged once 5 latencies are known, at "
+    "most 1 or 5% of the requests.",
+)
 @click.option("--apikey", help="Your MapBox API key", type=str)
 @click.option("--display", help="Display result in browser", is_flag=True)
 @click.pass_context
@@ -114,6 +287,10 @@ def isochrone(
     contours_minutes,
     contours_colors,
     polygons,
+    precision,
+    no_cache,
+    refresh,
+    hedge,
     apikey,
     display,
 ):
@@ -123,7 +300,8 @@ def isochrone(
 
     The Mapbox Isochrone API computes areas that are reachable within a specified amount of time
     from a location, and returns the reachable regions as contours of polygons or lines that
-    you can display on a map.
+    you can display on a map. Contours are cached, and more than four contours are fetched
+    with several requests.
     \f
 
     :param ctx: A context dictionary.
@@ -133,9 +311,8 @@ def isochrone(
         Directions API documentation.
     :param coordinates: A {longitude,latitude} coordinate pair around which to center the isochrone
         lines.
-    :param contours_minutes: The times in minutes to use for each isochrone contour. You can
-        specify up to four contours. Times must be in increasing order. The maximum time that can
-        be specified is 60 minutes.
+    :param contours_minutes: The times in minutes to use for each isochrone contour. The maximum
+        time that can be specified is 60 minutes.
     :param contours_colors: The colors to use for each isochrone contour, specified as hex values
         without a leading # (for example, ff0000 for red). If this parameter is used, there must
         be the same number of colors as there are entries in contours_minutes.
@@ -144,6 +321,10 @@ def isochrone(
     :param polygons: Specify whether to return the contours as GeoJSON polygons (true) or
         linestrings (false, default). When polygons=true, any contour that forms a ring is
         returned as a polygon.
+    :param precision: Decimal places to which the center is snapped.
+    :param no_cache: A boolean flag to bypass the isochrone cache.
+    :param refresh: A boolean flag to ignore cached contours and store fresh ones.
+    :param hedge: The latency percentile after which a request is hedged.
     :param apikey: An API key for authentication.
     :param display: A boolean flag to show result in web browser.
     :return: None.
@@ -155,24 +336,178 @@ def isochrone(
             "variable in MAPBOX_APIKEY "
         )
     ctx.obj["apikey"] = apikey
-    client = MapBoxApi(base_url="https://api.mapbox.com", credentials=apikey)
-    resp = client.isochrone(
-        profile=profile,
-        coordinates=coordinates.split(","),
-        contours_minutes=contours_minutes.split(","),
-        contours_colors=contours_colors.split(",")
-        if contours_colors
-        else contours_colors,
-        polygons=polygons,
+    client = MapBoxApi(
+        base_url="https://api.mapbox.com",
+        credentials=apikey,
+        hedge=HedgePolicy(percentile=hedge) if hedge is not None else None,
     )
+    try:
+        feature_collection = cached_isochrone(
+            client,
+            profile=profile,
+            coordinates=coordinates.split(","),
+            contours_minutes=contours_minutes.split(","),
+            contours_colors=contours_colors.split(",") if contours_colors else None,
+            polygons=polygons,
+            cache=None if no_cache else GeocodeCache.from_env("isochrone.sqlite"),
+            precision=precision,
+            refresh=refresh,
+        )
+    except ValueError as err:
+        raise click.UsageError(str(err))
     if display:
         lon, lat = [float(c) for c in coordinates.split(",")]
         center = get_feature_from_lat_lon(lat, lon)
-        feature_collection = resp.json()
         feature_collection["features"].append(center)
         geo_display(json.dumps(feature_collection, indent=2))
     else:
-        click.secho(json.dumps(resp.json(), indent=2), fg="green")
+        with get_writer() as writer:
+            writer.write(feature_collection)
+
+
+@mapbox.command(short_help="isochrones of many centers read from a file.")
+@click.argument("input", type=click.File("r"), default="-")
+@click.option(
+    "--profile", type=click.Choice(["driving", "walking", "cycling"]), required=True
+)
+@click.option(
+    "--contours_minutes",
+    required=True,
+    help="The times in minutes to use for each isochrone contour",
+    type=str,
+)
+@click.option(
+    "--polygons",
+    is_flag=True,
+    help="Specify whether to return the contours as GeoJSON polygons (True) or linestrings "
+    "(False).",
+)
+@click.option(
+    "--union",
+    is_flag=True,
+    help="Also output the union of the polygons of all centers per contour. Requires "
+    "--polygons and the shapely package.",
+)
+@click.option(
+    "--input_format",
+    type=click.Choice(["csv", "ndjson"]),
+    default="csv",
+    show_default=True,
+    help="Format of the input records.",
+)
+@click.option(
+    "--column",
+    default="coordinates",
+    show_default=True,
+    help="Name of the column holding the {longitude,latitude} coordinates.",
+)
+@click.option(
+    "--concurrency",
+    default=8,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of requests in flight.",
+)
+@click.option(
+    "--precision",
+    default=DEFAULT_PRECISION,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Decimal places to which the centers are snapped.",
+)
+@click.option(
+    "--no-cache", "no_cache", is_flag=True, help="Do not use the isochrone cache."
+)
+@click.option(
+    "--refresh", is_flag=True, help="Ignore cached contours and store fresh ones."
+)
+@click.option(
+    "--hedge",
+    type=click.FloatRange(min=0, max=100),
+    help="Send a duplicate of a request which is slower than this percentile of the "
+    "recent latencies, e.g. 95. Requests are hedged once 5 latencies are known, at "
+    "most 1 or 5% of the requests.",
+)
+@click.option("--apikey", help="Your MapBox API key", type=str)
+@click.pass_context
+def batch_isochrone(
+    ctx,
+    input,
+    profile,
+    contours_minutes,
+    polygons,
+    union,
+    input_format,
+    column,
+    concurrency,
+    precision,
+    no_cache,
+    refresh,
+    hedge,
+    apikey,
+):
+    """
+    Isochrones of many centers read from a file or stdin, computed concurrently.
+    The contours of every center are written in input order with the id of their
+    center, as a GeoJSON text sequence by default.
+    \f
+
+    :param ctx: A context dictionary.
+    :param input: A CSV or NDJSON file with one center per record, ``-`` for stdin.
+    :param profile: A Mapbox Directions routing profile ID.
+    :param contours_minutes: The times in minutes to use for each isochrone contour.
+    :param polygons: Specify whether to return the contours as GeoJSON polygons (true) or
+        linestrings (false, default).
+    :param union: A boolean flag to also write the union of all centers per contour.
+    :param input_format: Format of the input records, ``csv`` or ``ndjson``.
+    :param column: Name of the column holding the coordinates.
+    :param concurrency: Maximum number of requests in flight.
+    :param precision: Decimal places to which the centers are snapped.
+    :param no_cache: A boolean flag to bypass the isochrone cache.
+    :param refresh: A boolean flag to ignore cached contours and store fresh ones.
+    :param hedge: The latency percentile after which a request is hedged.
+    :param apikey: An API key for authentication.
+    :return: None.
+    """
+    apikey = apikey or os.environ.get("MAPBOX_APIKEY")
+    if apikey is None:
+        raise ApiKeyNotFoundError(
+            "Please pass MAPBOX API KEY as --apikey or set it as environment "
+            "variable in MAPBOX_APIKEY "
+        )
+    ctx.obj["apikey"] = apikey
+    contour_union = None
+    if union:
+        if not polygons:
+            raise click.UsageError("--union requires --polygons.")
+        try:
+            contour_union = ContourUnion()
+        except ImportError:
+            raise click.UsageError("--union requires the shapely package.")
+    client = MapBoxApi(
+        base_url="https://api.mapbox.com",
+        credentials=apikey,
+        hedge=HedgePolicy(percentile=hedge) if hedge is not None else None,
+    )
+    results = isochrone_batch(
+        client,
+        read_centers(input, input_format=input_format, column=column),
+        profile,
+        contours_minutes.split(","),
+        polygons=polygons,
+        cache=None if no_cache else GeocodeCache.from_env("isochrone.sqlite"),
+        precision=precision,
+        refresh=refresh,
+        concurrency=concurrency,
+    )
+    with get_writer("geojsonseq", many=True) as writer:
+        for result in results:
+            writer.write(result)
+            if contour_union is not None:
+                contour_union.add(result)
+        if contour_union is not None:
+            for feature in contour_union.features():
+                writer.write(feature)
 
 
 @mapbox.command(
@@ -212,12 +547,51 @@ def isochrone(
     "The option all allows using all coordinates as destinations.",
     type=str,
 )
+@click.option(
+    "--sources",
+    help="Use the coordinates at a given index as sources. Possible values are: a "
+    "semicolon-separated list of 0-based indices, or all (default).",
+    type=str,
+)
+@click.option(
+    "--concurrency",
+    default=8,
+    type=click.IntRange(min=1),
+    help="Maximum number of requests in flight when the matrix is split into tiles.",
+)
+@click.option(
+    "--hedge",
+    type=click.FloatRange(min=0, max=100),
+    help="Send a duplicate of a tile request which is slower than this percentile of "
+    "the recent latencies, e.g. 95. Tiles are hedged once 5 latencies are known, "
+    "at most 1 or 5% of the requests.",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write the matrices to a .npy, .npz, .arrow (Arrow IPC) or .csv (one row per "
+    "origin and destination) file instead of printing the response.",
+)
 @click.option("--apikey", help="Your MapBox API key", type=str)
 @click.pass_context
-def matrix(ctx, profile, coordinates, annotations, approaches, destinations, apikey):
+def matrix(
+    ctx,
+    profile,
+    coordinates,
+    annotations,
+    approaches,
+    destinations,
+    sources,
+    concurrency,
+    hedge,
+    output,
+    apikey,
+):
     """
     The Mapbox Matrix API returns travel times between many points.
     for more information `see <https://docs.mapbox.com/api/navigation/matrix/>_`.
+    Matrices with more than 25 coordinates (10 for driving-traffic) are split into
+    several requests and merged.
     \f
 
     :param ctx: A context dictionary.
@@ -237,6 +611,11 @@ def matrix(ctx, profile, coordinates, annotations, approaches, destinations, api
     :param destinations: Use the coordinates at a given index as destinations. Possible values are:
         a semicolon-separated list of 0-based indices, or all (default). The option all allows
         using all coordinates as destinations.
+    :param sources: Use the coordinates at a given index as sources. Possible values are:
+        a semicolon-separated list of 0-based indices, or all (default).
+    :param concurrency: Maximum number of requests in flight.
+    :param hedge: The latency percentile after which a tile request is hedged.
+    :param output: A file to write the matrices to, see :func:`maps.matrix.write_matrix`.
     :param apikey: An API key for authentication.
     :return: None.
     """
@@ -247,12 +626,29 @@ def matrix(ctx, profile, coordinates, annotations, approaches, destinations, api
             "variable in MAPBOX_APIKEY "
         )
     ctx.obj["apikey"] = apikey
-    client = MapBoxApi(base_url="https://api.mapbox.com", credentials=apikey)
-    resp = client.matrix(
+    client = MapBoxApi(
+        base_url="https://api.mapbox.com",
+        credentials=apikey,
+        hedge=HedgePolicy(percentile=hedge) if hedge is not None else None,
+    )
+    resp = client.tiled_matrix(
         profile=profile,
         coordinates=coordinates,
         annotations=annotations if annotations else None,
         approaches=approaches if approaches else None,
         destinations=destinations if destinations else None,
+        sources=sources if sources else None,
+        concurrency=concurrency,
     )
-    click.secho(json.dumps(resp.json(), indent=2), fg="green")
+    if output:
+        from maps.matrix import write_matrix
+
+        try:
+            write_matrix(resp, output)
+        except ValueError as err:
+            raise click.BadParameter(str(err), param_hint="--output")
+        except ImportError:
+            raise click.UsageError("Arrow output requires the pyarrow package.")
+        return
+    with get_writer() as writer:
+        writer.write(resp)
@@ -0,0 +1,130 @@
+"""This module defines binary and columnar output of travel time matrices.
+
+A Matrix API response is converted to NumPy arrays, with ``NaN`` where no route was
+found, and written by :func:`write_matrix` in the format given by the file
+extension:
+
+* ``.npy``: the single matrix of the response.
+* ``.npz``: one array per matrix plus ``sources`` and ``destinations`` locations,
+  uncompressed so that it loads quickly.
+* ``.arrow``, ``.feather`` or ``.ipc``: an Apache Arrow IPC file in long format with
+  one row per origin and destination, with nulls where no route was found. It
+  requires the optional ``pyarrow`` package.
+* ``.csv``: the same long format as CSV, with empty values for nulls.
+"""
+import csv
+import os
+from typing import Dict, Iterator, List
+
+import numpy as np
+
+#: Matrices of a Matrix API response and their columns in long format.
+ANNOTATIONS = {"durations": "duration", "distances": "distance"}
+
+ARROW_EXTENSIONS = (".arrow", ".feather", ".ipc")
+
+EXTENSIONS = (".npy", ".npz", ".csv") + ARROW_EXTENSIONS
+
+
+def matrix_arrays(result: Dict) -> Dict[str, np.ndarray]:
+    """Convert the matrices of a Matrix API response to arrays.
+
+    :param result: A Matrix API response.
+    :return: A dict mapping ``durations`` and/or ``distances`` to float arrays of
+        shape ``(sources, destinations)``, with ``NaN`` where no route was found.
+    """
+    return {
+        name: np.array(result[name], dtype=np.float64, ndmin=2)
+        for name in ANNOTATIONS
+        if result.get(name) is not None
+    }
+
+
+def matrix_locations(result: Dict, key: str) -> np.ndarray:
+    """Return the snapped locations of the sources or destinations of a response.
+
+    :param result: A Matrix API response.
+    :param key: ``sources`` or ``destinations``.
+    :return: A float array of shape ``(n, 2)`` with ``longitude, latitude`` columns,
+        ``NaN`` for unknown locations.
+    """
+    return np.array(
+        [
+            (waypoint or {}).get("location") or [np.nan, np.nan]
+            for waypoint in result.get(key) or []
+        ],
+        dtype=np.float64,
+    ).reshape(-1, 2)
+
+
+def long_format(arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Flatten matrices to columns with one row per origin and destination.
+
+    :param arrays: Matrices as returned by :func:`matrix_arrays`.
+    :return: A dict of equally long columns: ``origin`` and ``destination`` indices,
+        followed by ``duration`` and/or ``distance``.
+    """
+    shape = next(iter(arrays.values())).shape
+    origins, destinations = np.indices(shape)
+    columns = {"origin": origins.ravel(), "destination": destinations.ravel()}
+    for name, array in arrays.items():
+        columns[ANNOTATIONS[name]] = array.ravel()
+    return columns
+
+
+def _csv_rows(columns: Dict[str, np.ndarray]) -> Iterator[List]:
+    values = [column.tolist() for column in columns.values()]
+    for row in zip(*values):
+        yield ["" if value != value else value for value in row]
+
+
+def write_matrix(result: Dict, path: str) -> None:
+    """Write the matrices of a Matrix API response to a file.
+
+    :param result: A Matrix API response.
+    :param path: The output file, its extension is one of :data:`EXTENSIONS`.
+    :raises ValueError: If the extension is not supported, the response has no
+        matrix, or ``.npy`` is used for a response with several matrices.
+    :raises ImportError: If ``pyarrow`` is needed but not installed.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in EXTENSIONS:
+        raise ValueError(
+            f"Unsupported output file {path}, use one of {', '.join(EXTENSIONS)}."
+        )
+    arrays = matrix_arrays(result)
+    if not arrays:
+        raise ValueError("The response has no durations or distances.")
+
+    if extension == ".npy":
+        if len(arrays) > 1:
+            raise ValueError(".npy holds a single matrix, use .npz for several.")
+        np.save(path, next(iter(arrays.values())))
+    elif extension == ".npz":
+        np.savez(
+            path,
+            sources=matrix_locations(result, "sources"),
+            destinations=matrix_locations(result, "destinations"),
+            **arrays,
+        )
+    elif extension == ".csv":
+        columns = long_format(arrays)
+        with open(path, "w", newline="") as fh:
+            writer = csv.writer(fh)
+            writer.writerow(list(columns))
+            writer.writerows(_csv_rows(columns))
+    else:
+        import pyarrow as pa
+
+        columns = long_format(arrays)
+        table = pa.table(
+            {
+                name: pa.array(column, mask=np.isnan(column))
+                if column.dtype.kind == "f"
+                else pa.array(column.astype(np.int32))
+                for name, column in columns.items()
+            }
+        )
+        with pa.OSFile(path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
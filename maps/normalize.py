@@ -0,0 +1,171 @@
+"""This module defines the normalization of addresses for forward geocoding.
+
+Trivially different spellings of an address, e.g. ``12 Main St.`` and
+``12 main street``, are normalized to the same query before the geocoding cache is
+looked up and the request is sent, so that they share a cache entry. Normalization
+folds accents, case, punctuation and whitespace, and expands the street type
+abbreviations of a locale, see :data:`LOCALES`.
+
+Results are memoized, so repeated addresses of large batches are normalized once.
+"""
+import os
+import unicodedata
+from collections import namedtuple
+from functools import lru_cache
+from typing import Any, Optional
+
+#: Street type rules of a locale.
+#:
+#: * ``abbreviations``: abbreviations expanded wherever they appear.
+#: * ``positional``: ambiguous abbreviations (e.g. ``st`` for street or saint)
+#:   expanded only where a street type is expected: at the end of a comma-separated
+#:   part after a name, or at its start or after a house number if ``type_first``.
+#: * ``type_first``: whether the street type precedes the street name.
+#: * ``suffixes``: abbreviated endings of compound words, e.g. ``hauptstr``.
+LocaleRules = namedtuple("LocaleRules", "abbreviations,positional,type_first,suffixes")
+
+LOCALES = {
+    "en": LocaleRules(
+        {
+            "aly": "alley",
+            "av": "avenue",
+            "ave": "avenue",
+            "blvd": "boulevard",
+            "cir": "circle",
+            "expy": "expressway",
+            "fwy": "freeway",
+            "hwy": "highway",
+            "ln": "lane",
+            "pkwy": "parkway",
+            "rd": "road",
+            "sq": "square",
+            "ter": "terrace",
+        },
+        {"ct": "court", "dr": "drive", "pl": "place", "st": "street"},
+        False,
+        {},
+    ),
+    "de": LocaleRules(
+        {"str": "strasse"},
+        {"pl": "platz"},
+        False,
+        {"str": "strasse"},
+    ),
+    "fr": LocaleRules(
+        {
+            "av": "avenue",
+            "ave": "avenue",
+            "bd": "boulevard",
+            "bld": "boulevard",
+            "boul": "boulevard",
+            "imp": "impasse",
+            "rte": "route",
+            "sq": "square",
+        },
+        {"all": "allee", "ch": "chemin", "pl": "place", "r": "rue"},
+        True,
+        {},
+    ),
+    "es": LocaleRules(
+        {"avda": "avenida", "pza": "plaza", "ctra": "carretera", "pje": "pasaje"},
+        {"av": "avenida", "c": "calle", "pl": "plaza"},
+        True,
+        {},
+    ),
+}
+
+# Dots and apostrophes are dropped ("St." and "O'Brien" stay one word), other
+# punctuation except the comma separating address parts becomes a space.
+PUNCTUATION = str.maketrans(
+    dict(
+        {char: " " for char in '!"#$%&()*+-/:;<=>?@[\\]^_`{|}~–—'},
+        **{char: "" for char in ".'‘’"},
+    )
+)
+
+
+def fold(text: str) -> str:
+    """Remove the accents of a text, e.g. ``Köln`` becomes ``Koln``.
+
+    :param text: A text.
+    :return: The text without combining marks.
+    """
+    if text.isascii():
+        return text
+    return "".join(
+        char
+        for char in unicodedata.normalize("NFKD", text)
+        if not unicodedata.combining(char)
+    )
+
+
+class AddressNormalizer:
+    """A callable normalizing addresses, e.g. ``12 Main St.,Springfield`` becomes
+    ``12 main street, springfield``. Other queries, e.g. ``(lat, lon)`` tuples, are
+    returned unchanged.
+
+    :param locale: One of :data:`LOCALES`.
+    :param fold_accents: A boolean flag to remove accents, see :func:`fold`.
+    :param cache_size: Number of memoized addresses.
+    :raises ValueError: If the locale is unknown.
+    """
+
+    def __init__(
+        self, locale: str = "en", fold_accents: bool = True, cache_size: int = 65536
+    ):
+        if locale not in LOCALES:
+            raise ValueError(
+                f"Unknown locale {locale}, choose from {', '.join(LOCALES)}."
+            )
+        self.locale = locale
+        self.rules = LOCALES[locale]
+        self.fold_accents = fold_accents
+        self._normalize = lru_cache(maxsize=cache_size)(self._normalize_address)
+
+    def __call__(self, query: Any) -> Any:
+        if not isinstance(query, str):
+            return query
+        return self._normalize(query)
+
+    def _normalize_address(self, address: str) -> str:
+        if self.fold_accents:
+            address = fold(address)
+        address = address.casefold().translate(PUNCTUATION)
+        parts = (part.split() for part in address.split(","))
+        return ", ".join(" ".join(self._expand(words)) for words in parts if words)
+
+    def _expand(self, words):
+        abbreviations, positional, type_first, suffixes = self.rules
+        last = len(words) - 1
+        for index, word in enumerate(words):
+            expansion = abbreviations.get(word)
+            if expansion is None and word in positional:
+                if type_first:
+                    expected = (index == 0 and last > 0) or (
+                        index > 0 and words[index - 1][0].isdigit()
+                    )
+                else:
+                    expected = index == last > 0 and not words[index - 1][0].isdigit()
+                if expected:
+                    expansion = positional[word]
+            if expansion is None:
+                for suffix, full in suffixes.items():
+                    if word.endswith(suffix) and len(word) > len(suffix):
+                        expansion = word[: -len(suffix)] + full
+                        break
+            yield expansion or word
+
+
+def address_normalizer(locale: Optional[str] = None) -> Optional[AddressNormalizer]:
+    """Create the address normalizer of a locale.
+
+    :param locale: One of :data:`LOCALES` or ``off``. Defaults to the
+        ``MAPS_ADDRESS_LOCALE`` environment variable, which is unset by default.
+    :return: An :class:`AddressNormalizer`, or ``None`` if no locale is configured.
+    :raises ValueError: If the locale is unknown.
+    """
+    if locale is None:
+        locale = os.environ.get("MAPS_ADDRESS_LOCALE")
+    if not locale or locale == "off":
+        return None
+    return AddressNormalizer(locale)
@@ -2,12 +2,26 @@
 import os
 
 import click
-import openrouteservice as opnrs
 import simplejson as json
-from geojsonio import display as geo_display
 
+from maps.batch import batch_fields, geocode_batch, read_queries
+from maps.cache import cached_geolocator, reverse_point
 from maps.exceptions import ApiKeyNotFoundError
-from maps.utils import yield_subcommands
+from maps.output import get_writer
+from maps.transport import ors_client
+from maps.utils import geo_display, yield_subcommands
+
+
+def lonlat_point(query):
+    """Parse an ORS reverse geocoding query, given as ``lon,lat``.
+
+    :param query: A ``lon,lat`` string or a ``(lat, lon)`` tuple.
+    :return: A ``(lat, lon)`` tuple, or ``None`` if the query is not a point.
+    """
+    point = reverse_point(query)
+    if point is None or isinstance(query, tuple):
+        return point
+    return point[::-1]
 
 
 @click.group()
@@ -33,10 +47,16 @@ def show():
     show_default=True,
     help="Perform a forward or reverse geocode",
 )
+@click.option(
+    "--no-cache", "no_cache", is_flag=True, help="Do not use the geocoding cache."
+)
+@click.option(
+    "--refresh", is_flag=True, help="Ignore cached results and store fresh ones."
+)
 @click.option("--raw", is_flag=True)
 @click.option("--display", help="Display result in browser", is_flag=True)
 @click.pass_context
-def geocoding(ctx, query, apikey, forward, raw, display):
+def geocoding(ctx, query, apikey, forward, raw, display, no_cache, refresh):
     """
     Open Route Service geocoding service.
     \f
@@ -47,6 +67,8 @@ def geocoding(ctx, query, apikey, forward, raw, display):
     :param forward: A boolean flag for forward/reverse geocoding.
     :param raw: A boolean flag to show api response as it is.
     :param display: A boolean flag to show result in web browser.
+    :param no_cache: A boolean flag to bypass the geocoding cache.
+    :param refresh: A boolean flag to ignore cached results and store fresh ones.
     :return: None.
     """
     apikey = apikey or os.environ.get("ORS_APIKEY")
@@ -56,25 +78,155 @@ def geocoding(ctx, query, apikey, forward, raw, display):
             "variable in ORS_APIKEY "
         )
     ctx.obj["apikey"] = apikey
-    geolocator = opnrs.Client(key=ctx.obj["apikey"])
+    geolocator = cached_geolocator(
+        ors_client(ctx.obj["apikey"]), "ors", no_cache=no_cache, refresh=refresh
+    )
     if forward:
         geocode = geolocator.pelias_search(text=query)
         if raw:
-            click.secho(json.dumps(geocode, indent=2), fg="green")
+            with get_writer() as writer:
+                writer.write(geocode)
         elif display:
             geocode.pop("geocoding")
             geo_display(json.dumps(geocode))
         else:
-            for feature in geocode["features"]:
-                coords = feature["geometry"]["coordinates"]
-                result = {"lat": coords[1], "lon": coords[0]}
-                click.secho(json.dumps(result, indent=2), fg="green")
+            with get_writer() as writer:
+                for feature in geocode["features"]:
+                    coords = feature["geometry"]["coordinates"]
+                    writer.write({"lat": coords[1], "lon": coords[0]})
     else:
         coordinate = query.split(",")
         reverse = geolocator.pelias_reverse(point=coordinate, validate=False)
-        if raw:
+        with get_writer() as writer:
             for result in reverse["features"]:
-                click.secho(json.dumps(result, indent=2), fg="green")
+                if raw:
+                    writer.write(result)
+                elif writer.output_format == "json":
+                    writer.write(result["properties"]["label"])
+                else:
+                    coords = result["geometry"]["coordinates"]
+                    writer.write(
+                        {
+                            "address": result["properties"]["label"],
+                            "lat": coords[1],
+                            "lon": coords[0],
+                        }
+                    )
+
+
+@ors.command(
+    short_help="forward or reverse geocode addresses or coordinates from a file."
+)
+@click.argument("input", type=click.File("r"), default="-")
+@click.option("--apikey", help="Your ORS API key", type=str)
+@click.option(
+    "--forward/--reverse",
+    default=True,
+    show_default=True,
+    help="Perform a forward or reverse geocode",
+)
+@click.option(
+    "--input_format",
+    type=click.Choice(["csv", "ndjson"]),
+    default="csv",
+    show_default=True,
+    help="Format of the input records.",
+)
+@click.option(
+    "--column",
+    default="query",
+    show_default=True,
+    help="Name of the column holding the query.",
+)
+@click.option(
+    "--concurrency",
+    default=8,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of requests in flight.",
+)
+@click.option(
+    "--no-cache", "no_cache", is_flag=True, help="Do not use the geocoding cache."
+)
+@click.option(
+    "--refresh", is_flag=True, help="Ignore cached results and store fresh ones."
+)
+@click.option("--raw", is_flag=True)
+@click.option(
+    "--snap",
+    default=0,
+    type=click.IntRange(min=0, max=10),
+    help="Reverse geocode one point per grid cell of this many decimal places, e.g. "
+    "4 for about 11 meters, and give its result to every point of the cell. "
+    "0 geocodes every point.",
+)
+@click.pass_context
+def batch_geocoding(
+    ctx,
+    input,
+    apikey,
+    forward,
+    input_format,
+    column,
+    concurrency,
+    raw,
+    no_cache,
+    refresh,
+    snap,
+):
+    """
+    Open Route Service geocoding service for many queries read from a file or stdin.
+    Results are written in input order, as one JSON object per line by default.
+    Reverse queries are ``lon,lat`` strings or ``lat``/``lon`` columns.
+    \f
+
+    :param ctx: A context dictionary.
+    :param input: A CSV or NDJSON file with one query per record, ``-`` for stdin.
+    :param apikey: An API key for authentication.
+    :param forward: A boolean flag for forward/reverse geocoding.
+    :param input_format: Format of the input records, ``csv`` or ``ndjson``.
+    :param column: Name of the column holding the query.
+    :param concurrency: Maximum number of requests in flight.
+    :param raw: A boolean flag to show api response as it is.
+    :param no_cache: A boolean flag to bypass the geocoding cache.
+    :param refresh: A boolean flag to ignore cached results and store fresh ones.
+    :param snap: Decimal places of the grid reverse geocoded points are snapped to.
+    :return: None.
+    """
+    apikey = apikey or os.environ.get("ORS_APIKEY")
+    if apikey is None:
+        raise ApiKeyNotFoundError(
+            "Please pass Open Route Service API KEY as --apikey or set it as environment "
+            "variable in ORS_APIKEY "
+        )
+    ctx.obj["apikey"] = apikey
+    geolocator = cached_geolocator(
+        ors_client(ctx.obj["apikey"]), "ors", no_cache=no_cache, refresh=refresh
+    )
+
+    def geocode(query):
+        if forward:
+            response = geolocator.pelias_search(text=query)
         else:
-            for result in reverse["features"]:
-                click.secho(result["properties"]["label"], fg="green")
+            point = query[::-1] if isinstance(query, tuple) else query.split(",")
+            response = geolocator.pelias_reverse(point=point, validate=False)
+        if raw:
+            return {"raw": response}
+        if not response["features"]:
+            return {"error": "No result found"}
+        feature = response["features"][0]
+        if forward:
+            coords = feature["geometry"]["coordinates"]
+            return {"lat": coords[1], "lon": coords[0]}
+        return {"address": feature["properties"]["label"]}
+
+    queries = read_queries(input, input_format=input_format, column=column)
+    with get_writer("ndjson", many=True, fields=batch_fields(forward, raw)) as writer:
+        for record in geocode_batch(
+            geocode,
+            queries,
+            concurrency=concurrency,
+            snap=0 if forward else snap,
+            point=lonlat_point,
+        ):
+            writer.write(record)
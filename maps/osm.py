@@ -1,13 +1,13 @@
 """This module defines all the OSM commands."""
 
 import click
-import overpy
-import simplejson as json
-from geojsonio import display as geo_display
-from geopy.geocoders import Nominatim
 
 from maps import __version__
-from maps.utils import get_feature_from_lat_lon, yield_subcommands
+from maps.batch import batch_fields, geocode_batch, location_to_dict, read_queries
+from maps.cache import cached_geolocator
+from maps.geoindex import AddressIndex, local_geolocator
+from maps.output import get_writer
+from maps.utils import geo_display, get_feature_from_lat_lon, yield_subcommands
 
 
 @click.group()
@@ -30,9 +30,22 @@ def show():
     show_default=True,
     help="Perform a forward or reverse geocode",
 )
+@click.option(
+    "--no-cache", "no_cache", is_flag=True, help="Do not use the geocoding cache."
+)
+@click.option(
+    "--refresh", is_flag=True, help="Ignore cached results and store fresh ones."
+)
+@click.option(
+    "--index",
+    type=click.Path(dir_okay=False),
+    help="Offline address index queried before Nominatim for forward geocoding, "
+    "see build-index. Defaults to MAPS_GEOINDEX or addresses.sqlite in the cache "
+    "directory, and is skipped if it does not exist.",
+)
 @click.option("--raw", is_flag=True)
 @click.option("--display", help="Display result in browser", is_flag=True)
-def geocoding(query, forward, raw, display):
+def geocoding(query, forward, raw, display, no_cache, refresh, index):
     """
     OSM's Nominatim geocoding service.
     \f
@@ -40,56 +53,272 @@ def geocoding(query, forward, raw, display):
     :param query: A string to represent address query for geocoding.
     :param forward: A boolean flag for forward/reverse geocoding.
     :param raw: A boolean flag to show api response as it is.
+    :param no_cache: A boolean flag to bypass the geocoding cache.
+    :param refresh: A boolean flag to ignore cached results and store fresh ones.
+    :param index: Path of the offline address index.
     :return: None.
     """
-    geolocator = Nominatim(user_agent=f"maps-cli/{__version__}")
+    from geopy.geocoders import Nominatim
+
+    from maps.adapters import PooledRequestsAdapter
+
+    geolocator = cached_geolocator(
+        Nominatim(
+            user_agent=f"maps-cli/{__version__}",
+            adapter_factory=PooledRequestsAdapter,
+        ),
+        "osm",
+        no_cache=no_cache,
+        refresh=refresh,
+    )
+    geolocator = local_geolocator(geolocator, index)
     if forward:
         location = geolocator.geocode(query)
         if raw:
-            click.secho(json.dumps(location.raw, indent=2), fg="green")
+            with get_writer() as writer:
+                writer.write(location.raw)
         elif display:
             feature = get_feature_from_lat_lon(location.latitude, location.longitude)
             geo_display(feature)
         else:
-            result = {"lat": location.latitude, "lon": location.longitude}
-            click.secho(json.dumps(result, indent=2), fg="green")
+            with get_writer() as writer:
+                writer.write({"lat": location.latitude, "lon": location.longitude})
     else:
         location = geolocator.reverse(query)
-        if raw:
-            click.secho(json.dumps(location.raw, indent=2), fg="green")
+        with get_writer() as writer:
+            if raw:
+                writer.write(location.raw)
+            elif writer.output_format == "json":
+                writer.write(location.address)
+            else:
+                writer.write(
+                    {
+                        "address": location.address,
+                        "lat": location.latitude,
+                        "lon": location.longitude,
+                    }
+                )
+
+
+@osm.command(
+    short_help="forward or reverse geocode addresses or coordinates from a file."
+)
+@click.argument("input", type=click.File("r"), default="-")
+@click.option(
+    "--forward/--reverse",
+    default=True,
+    show_default=True,
+    help="Perform a forward or reverse geocode",
+)
+@click.option(
+    "--input_format",
+    type=click.Choice(["csv", "ndjson"]),
+    default="csv",
+    show_default=True,
+    help="Format of the input records.",
+)
+@click.option(
+    "--column",
+    default="query",
+    show_default=True,
+    help="Name of the column holding the query.",
+)
+@click.option(
+    "--concurrency",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of requests in flight. Nominatim allows 1 request per second.",
+)
+@click.option(
+    "--no-cache", "no_cache", is_flag=True, help="Do not use the geocoding cache."
+)
+@click.option(
+    "--refresh", is_flag=True, help="Ignore cached results and store fresh ones."
+)
+@click.option(
+    "--index",
+    type=click.Path(dir_okay=False),
+    help="Offline address index queried before Nominatim for forward geocoding, "
+    "see build-index. Defaults to MAPS_GEOINDEX or addresses.sqlite in the cache "
+    "directory, and is skipped if it does not exist.",
+)
+@click.option("--raw", is_flag=True)
+@click.option(
+    "--snap",
+    default=0,
+    type=click.IntRange(min=0, max=10),
+    help="Reverse geocode one point per grid cell of this many decimal places, e.g. "
+    "4 for about 11 meters, and give its result to every point of the cell. "
+    "0 geocodes every point.",
+)
+def batch_geocoding(
+    input,
+    forward,
+    input_format,
+    column,
+    concurrency,
+    raw,
+    no_cache,
+    refresh,
+    index,
+    snap,
+):
+    """
+    OSM's Nominatim geocoding service for many queries read from a file or stdin.
+    Results are written in input order, as one JSON object per line by default.
+    \f
+
+    :param input: A CSV or NDJSON file with one query per record, ``-`` for stdin.
+    :param forward: A boolean flag for forward/reverse geocoding.
+    :param input_format: Format of the input records, ``csv`` or ``ndjson``.
+    :param column: Name of the column holding the query.
+    :param concurrency: Maximum number of requests in flight.
+    :param raw: A boolean flag to show api response as it is.
+    :param no_cache: A boolean flag to bypass the geocoding cache.
+    :param refresh: A boolean flag to ignore cached results and store fresh ones.
+    :param index: Path of the offline address index.
+    :param snap: Decimal places of the grid reverse geocoded points are snapped to.
+    :return: None.
+    """
+    from geopy.geocoders import Nominatim
+
+    from maps.adapters import PooledAioHTTPAdapter
+
+    geolocator = cached_geolocator(
+        Nominatim(
+            user_agent=f"maps-cli/{__version__}",
+            adapter_factory=PooledAioHTTPAdapter,
+        ),
+        "osm",
+        no_cache=no_cache,
+        refresh=refresh,
+    )
+    geolocator = local_geolocator(geolocator, index)
+
+    async def geocode(query):
+        if forward:
+            location = await geolocator.geocode(query)
         else:
-            click.secho(location.address, fg="green")
+            location = await geolocator.reverse(query)
+        return location_to_dict(location, forward, raw)
+
+    queries = read_queries(input, input_format=input_format, column=column)
+    with get_writer("ndjson", many=True, fields=batch_fields(forward, raw)) as writer:
+        for record in geocode_batch(
+            geocode, queries, concurrency=concurrency, snap=0 if forward else snap
+        ):
+            writer.write(record)
+
+
+@osm.command(short_help="build an offline geocoding index from address extracts.")
+@click.argument(
+    "files", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False)
+)
+@click.option(
+    "--index",
+    type=click.Path(dir_okay=False),
+    help="The index file. Defaults to MAPS_GEOINDEX or addresses.sqlite in the cache "
+    "directory.",
+)
+@click.option("--force", is_flag=True, help="Import unchanged files again.")
+def build_index(files, index, force):
+    """
+    Build or update the offline address index queried by the geocoding commands
+    from OSM extracts (.pbf, .osm) or OpenAddresses CSV files. Files which did not
+    change since they were imported are skipped.
+    \f
+
+    :param files: OSM or OpenAddresses files.
+    :param index: Path of the index file.
+    :param force: A boolean flag to import unchanged files again.
+    :return: None.
+    """
+    fields = ("file", "places", "updated")
+    with AddressIndex(index) as address_index, get_writer(
+        "ndjson", many=True, fields=fields
+    ) as writer:
+        try:
+            for status in address_index.build(files, force=force):
+                writer.write(status)
+        except ValueError as err:
+            raise click.BadParameter(str(err), param_hint="FILES")
+        except ImportError:
+            raise click.UsageError(
+                "Reading OSM extracts requires the osmium package, "
+                "install maps-cli[osm]."
+            )
 
 
 @osm.command(short_help="OSM's Overpass API")
 @click.argument("query", required=True)
-def overpass(query):
+@click.option(
+    "--bbox",
+    help="Split the query into tiles of this south,west,north,east bounding box. "
+    "The query must contain {{bbox}}, which is replaced with the bounding box of each tile.",
+    type=str,
+)
+@click.option(
+    "--grid",
+    default=2,
+    type=click.IntRange(min=1),
+    help="Split the bounding box into a grid of N x N tiles.",
+)
+@click.option(
+    "--max_depth",
+    default=2,
+    type=click.IntRange(min=0),
+    help="Maximum number of times a tile which timed out is split again.",
+)
+@click.option(
+    "--concurrency",
+    default=2,
+    type=click.IntRange(min=1),
+    help="Maximum number of tiles queried in parallel.",
+)
+def overpass(query, bbox, grid, max_depth, concurrency):
     """
     OSM's Overpass API service.
     \f
 
     :param query: An input OSM overpass query. more info canbe found
         `here <http://www.overpass-api.de/>_`.
+    :param bbox: A south,west,north,east bounding box to split the query into tiles.
+    :param grid: Number of tiles per side of the initial grid.
+    :param max_depth: Maximum number of times a tile which timed out is split again.
+    :param concurrency: Maximum number of tiles queried in parallel.
     :return: None.
     """
-    api = overpy.Overpass()
-    result = api.query(query)
-    if result.nodes:
-        click.secho("Nodes:", fg="green")
-        for node in result.nodes:
-            node.tags["latitude"] = node.lat
-            node.tags["longitude"] = node.lon
-            node.tags["id"] = node.id
-            click.secho(json.dumps(node.tags, indent=2, ensure_ascii=False), fg="green")
-    if result.ways:
-        click.secho("Ways:", fg="green")
-        for way in result.ways:
-            way.tags["id"] = way.id
-            click.secho(json.dumps(way.tags, indent=2, ensure_ascii=False), fg="green")
-    if result.relations:
-        click.secho("Relations:", fg="green")
-        for relation in result.relations:
-            relation.tags["id"] = relation.id
-            click.secho(
-                json.dumps(relation.tags, indent=2, ensure_ascii=False), fg="green"
+    from maps.overpass import stream_query, tiled_query
+
+    if bbox:
+        if "{{bbox}}" not in query:
+            raise click.UsageError(
+                "The query must contain {{bbox}} when --bbox is used."
             )
+        try:
+            south, west, north, east = (float(v) for v in bbox.split(","))
+        except ValueError:
+            raise click.BadParameter(
+                "Expected south,west,north,east coordinates.", param_hint="--bbox"
+            )
+        elements = tiled_query(
+            query,
+            (south, west, north, east),
+            grid=grid,
+            concurrency=concurrency,
+            max_depth=max_depth,
+        )
+    else:
+        elements = stream_query(query)
+    with get_writer(many=True) as writer:
+        for element in elements:
+            if element["type"] not in ("node", "way", "relation"):
+                continue
+            record = dict(element.get("tags", {}))
+            if "lat" in element:
+                record["latitude"] = element["lat"]
+                record["longitude"] = element["lon"]
+            record["id"] = element["id"]
+            record["osm_type"] = element["type"]
+            writer.write(record)
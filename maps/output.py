@@ -0,0 +1,214 @@
+"""This module defines the output formats of the commands.
+
+The format is selected with the global ``--format`` option of ``maps``:
+
+* ``json`` prints indented JSON, in green on a terminal. Commands which print many
+  records print them as one JSON array.
+* ``ndjson`` prints one compact JSON document per line.
+* ``csv`` prints a header row and one row per record. Nested values are encoded as
+  JSON.
+* ``geojsonseq`` prints one GeoJSON feature per record as a GeoJSON text sequence
+  (RFC 8142). Records with ``lat``/``lon`` or ``latitude``/``longitude`` become
+  points, feature collections are split into their features.
+
+In the line oriented formats a list is written as one record per item. Output is
+buffered and written in large chunks instead of once per record.
+"""
+import csv
+import io
+import json
+import sys
+import textwrap
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import click
+
+FORMATS = ("json", "ndjson", "csv", "geojsonseq")
+
+BUFFER_SIZE = 64 * 1024
+
+#: Buffered output is written at least this often, in seconds, for slow producers.
+FLUSH_INTERVAL = 1.0
+
+_compact = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+_pretty = json.JSONEncoder(ensure_ascii=False, indent=2)
+
+GEOMETRY_TYPES = frozenset(
+    {
+        "Point",
+        "MultiPoint",
+        "LineString",
+        "MultiLineString",
+        "Polygon",
+        "MultiPolygon",
+        "GeometryCollection",
+    }
+)
+
+
+def output_format(default: str = "json") -> str:
+    """Return the output format selected with ``maps --format``.
+
+    :param default: The format of the command if none was selected.
+    :return: One of :data:`FORMATS`.
+    """
+    ctx = click.get_current_context(silent=True)
+    selected = ctx.meta.get("maps.output_format") if ctx is not None else None
+    return selected or default
+
+
+def to_features(record: Any) -> Iterator[Dict]:
+    """Convert a record to GeoJSON features.
+
+    :param record: A GeoJSON object or any other record.
+    :return: An iterator of GeoJSON features.
+    """
+    if not isinstance(record, dict):
+        yield {"type": "Feature", "geometry": None, "properties": {"value": record}}
+        return
+    kind = record.get("type")
+    if kind == "FeatureCollection":
+        yield from record.get("features", [])
+        return
+    if kind == "Feature":
+        yield record
+        return
+    if kind in GEOMETRY_TYPES:
+        yield {"type": "Feature", "geometry": record, "properties": {}}
+        return
+    properties = dict(record)
+    geometry = None
+    for lat, lon in (("lat", "lon"), ("latitude", "longitude")):
+        if properties.get(lat) is not None and properties.get(lon) is not None:
+            geometry = {
+                "type": "Point",
+                "coordinates": [float(properties.pop(lon)), float(properties.pop(lat))],
+            }
+            break
+    yield {"type": "Feature", "geometry": geometry, "properties": properties}
+
+
+class Writer:
+    """A buffered writer of records in one of the :data:`FORMATS`.
+
+    Use it as a context manager, so that the output is completed and flushed. With
+    ``many`` set, records of the json format are written as one array. The columns of
+    the csv format default to the keys of the first record.
+    """
+
+    def __init__(
+        self,
+        output_format: str = "json",
+        many: bool = False,
+        fields: Optional[Iterable[str]] = None,
+        buffer_size: int = BUFFER_SIZE,
+    ):
+        if output_format not in FORMATS:
+            raise ValueError(f"Unsupported output format: {output_format}")
+        self.output_format = output_format
+        self.many = many
+        self.fields: Optional[List[str]] = list(fields) if fields else None
+        self.buffer_size = buffer_size
+        self.count = 0
+        self.color = output_format == "json" and sys.stdout.isatty()
+        self._chunks: List[str] = []
+        self._size = 0
+        self._flushed = time.monotonic()
+        self._csv_buffer = io.StringIO()
+        self._csv_writer = csv.writer(self._csv_buffer)
+
+    def __enter__(self) -> "Writer":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, record: Any) -> None:
+        """Write a record.
+
+        :param record: A JSON serializable value. Strings are printed as they are in
+            the json format.
+        """
+        if isinstance(record, list) and self.output_format != "json":
+            for item in record:
+                self.write(item)
+            return
+        getattr(self, f"_write_{self.output_format}")(record)
+        self.count += 1
+        if (
+            self._size >= self.buffer_size
+            or time.monotonic() - self._flushed >= FLUSH_INTERVAL
+        ):
+            self.flush()
+
+    def _append(self, text: str) -> None:
+        self._chunks.append(text)
+        self._size += len(text)
+
+    def _write_json(self, record: Any) -> None:
+        if isinstance(record, str):
+            text = record
+        else:
+            text = _pretty.encode(record)
+        if self.many:
+            text = ("[\n" if self.count == 0 else ",\n") + textwrap.indent(text, "  ")
+        else:
+            text += "\n"
+        self._append(click.style(text, fg="green") if self.color else text)
+
+    def _write_ndjson(self, record: Any) -> None:
+        self._append(_compact.encode(record))
+        self._append("\n")
+
+    def _write_csv(self, record: Any) -> None:
+        if not isinstance(record, dict):
+            record = {"value": record}
+        if self.fields is None:
+            self.fields = list(record)
+        if self.count == 0:
+            self._csv_writer.writerow(self.fields)
+        row = []
+        for field in self.fields:
+            value = record.get(field)
+            if isinstance(value, (dict, list, tuple)):
+                value = _compact.encode(value)
+            row.append("" if value is None else value)
+        self._csv_writer.writerow(row)
+        self._append(self._csv_buffer.getvalue())
+        self._csv_buffer.seek(0)
+        self._csv_buffer.truncate()
+
+    def _write_geojsonseq(self, record: Any) -> None:
+        for feature in to_features(record):
+            self._append("\x1e")
+            self._append(_compact.encode(feature))
+            self._append("\n")
+
+    def flush(self) -> None:
+        """Write the buffered output to stdout."""
+        if self._chunks:
+            click.echo("".join(self._chunks), nl=False)
+            self._chunks.clear()
+            self._size = 0
+        self._flushed = time.monotonic()
+
+    def close(self) -> None:
+        """Complete the output, e.g. close the JSON array, and flush it."""
+        if self.output_format == "json" and self.many:
+            text = "\n]\n" if self.count else "[]\n"
+            self._append(click.style(text, fg="green") if self.color else text)
+        self.flush()
+
+
+def get_writer(
+    default: str = "json", many: bool = False, fields: Optional[Iterable[str]] = None
+) -> Writer:
+    """Create a :class:`Writer` for the output format selected with ``maps --format``.
+
+    :param default: The format of the command if none was selected.
+    :param many: A boolean flag to write the records of the json format as an array.
+    :param fields: The columns of the csv format.
+    :return: A :class:`Writer`.
+    """
+    return Writer(output_format(default), many=many, fields=fields)
@@ -0,0 +1,298 @@
+"""This module defines a streaming client for the OSM Overpass API.
+
+Responses are parsed incrementally while they are downloaded, so elements can be
+written out as soon as they arrive and memory use does not grow with the size of
+the result. Both the JSON and the XML output formats of Overpass are supported.
+"""
+import codecs
+import json
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from xml.etree.ElementTree import Element, XMLPullParser
+
+from maps.exceptions import ApiError, OverpassError
+from maps.transport import ensure_pool_size, get_session
+
+OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+CHUNK_SIZE = 64 * 1024
+
+#: A bounding box as ``(south, west, north, east)``, the order used by Overpass QL.
+BBox = Tuple[float, float, float, float]
+
+_ELEMENTS = re.compile(r'"elements"\s*:\s*\[')
+_SEPARATOR = re.compile(r"[\s,]*")
+
+
+class JsonElementParser:
+    """An incremental parser for the ``elements`` array of Overpass JSON output.
+
+    Only the elements which are not complete yet are buffered.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._state = "head"
+        self.remark: Optional[str] = None
+
+    def feed(self, data: bytes) -> List[Dict]:
+        """Parse the next chunk of the response.
+
+        :param data: A chunk of the response body.
+        :return: A list of the elements completed by this chunk.
+        """
+        self._buffer += self._decoder.decode(data)
+        if self._state == "head":
+            match = _ELEMENTS.search(self._buffer)
+            if match is None:
+                return []
+            self._buffer = self._buffer[match.end() :]
+            self._state = "elements"
+        elements = []
+        if self._state == "elements":
+            buffer, pos = self._buffer, 0
+            while True:
+                pos = _SEPARATOR.match(buffer, pos).end()
+                if pos == len(buffer):
+                    break
+                if buffer[pos] == "]":
+                    self._state = "tail"
+                    pos += 1
+                    break
+                try:
+                    element, pos = self._json.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    # The element is incomplete, wait for more data.
+                    break
+                elements.append(element)
+            self._buffer = buffer[pos:]
+        return elements
+
+    def close(self) -> List[Dict]:
+        """Finish parsing and read the remark following the elements, if any.
+
+        :return: An empty list, for symmetry with :meth:`feed`.
+        :raises ValueError: If the response was truncated or is not valid JSON.
+        """
+        self._buffer += self._decoder.decode(b"", final=True)
+        if self._state == "elements":
+            raise ValueError("Truncated Overpass response.")
+        if self._state == "head":
+            tail = json.loads(self._buffer)
+        else:
+            tail = json.loads("{" + self._buffer.strip().lstrip(","))
+        self.remark = tail.get("remark")
+        return []
+
+
+class XmlElementParser:
+    """An incremental parser for Overpass XML output.
+
+    Elements are converted to the dicts of the JSON output format and dropped from
+    the document tree once they are complete.
+    """
+
+    def __init__(self):
+        self._parser = XMLPullParser(events=("start", "end"))
+        self._root: Optional[Element] = None
+        self._depth = 0
+        self.remark: Optional[str] = None
+
+    def feed(self, data: bytes) -> List[Dict]:
+        """Parse the next chunk of the response.
+
+        :param data: A chunk of the response body.
+        :return: A list of the elements completed by this chunk.
+        """
+        self._parser.feed(data)
+        return self._read_events()
+
+    def close(self) -> List[Dict]:
+        """Finish parsing.
+
+        :return: A list of the elements completed by the end of the response.
+        """
+        self._parser.close()
+        return self._read_events()
+
+    def _read_events(self) -> List[Dict]:
+        elements = []
+        for event, elem in self._parser.read_events():
+            if event == "start":
+                if self._root is None:
+                    self._root = elem
+                self._depth += 1
+                continue
+            self._depth -= 1
+            if self._depth != 1:
+                continue
+            if elem.tag in ("node", "way", "relation", "area"):
+                elements.append(_xml_to_dict(elem))
+            elif elem.tag == "remark":
+                self.remark = (elem.text or "").strip()
+            self._root.remove(elem)  # type: ignore
+        return elements
+
+
+def _xml_to_dict(elem: Element) -> Dict:
+    element: Dict = {"type": elem.tag, "id": int(elem.attrib["id"])}
+    if "lat" in elem.attrib:
+        element["lat"] = float(elem.attrib["lat"])
+        element["lon"] = float(elem.attrib["lon"])
+    center = elem.find("center")
+    if center is not None:
+        element["center"] = {
+            "lat": float(center.attrib["lat"]),
+            "lon": float(center.attrib["lon"]),
+        }
+    if elem.tag == "way":
+        element["nodes"] = [int(nd.attrib["ref"]) for nd in elem.iter("nd")]
+    if elem.tag == "relation":
+        element["members"] = [
+            {
+                "type": member.attrib["type"],
+                "ref": int(member.attrib["ref"]),
+                "role": member.attrib.get("role", ""),
+            }
+            for member in elem.iter("member")
+        ]
+    tags = {tag.attrib["k"]: tag.attrib["v"] for tag in elem.iter("tag")}
+    if tags:
+        element["tags"] = tags
+    return element
+
+
+def parse_elements(chunks: Iterable[bytes]) -> Iterator[Dict]:
+    """Parse an Overpass response incrementally.
+
+    The format is detected from the first byte of the response.
+
+    :param chunks: The response body as an iterable of byte chunks.
+    :return: An iterator of elements as dicts in the Overpass JSON format.
+    :raises OverpassError: If the response reports a runtime error, e.g. a timeout.
+    """
+    parser = None
+    for chunk in chunks:
+        if parser is None:
+            if not chunk.strip():
+                continue
+            parser = (
+                JsonElementParser()
+                if chunk.lstrip()[:1] == b"{"
+                else XmlElementParser()
+            )
+        yield from parser.feed(chunk)
+    if parser is None:
+        return
+    yield from parser.close()
+    if parser.remark and parser.remark.startswith("runtime error"):
+        raise OverpassError(parser.remark)
+
+
+def stream_query(
+    query: str, url: str = OVERPASS_URL, chunk_size: int = CHUNK_SIZE
+) -> Iterator[Dict]:
+    """Run an Overpass query and yield the resulting elements as they arrive.
+
+    :param query: An Overpass QL or XML query.
+    :param url: The URL of the Overpass API interpreter.
+    :param chunk_size: Number of bytes read from the network at a time.
+    :return: An iterator of elements as dicts in the Overpass JSON format.
+    :raises ApiError: If the HTTP status code is not in [200...300).
+    :raises OverpassError: If the response reports a runtime error, e.g. a timeout.
+    """
+    resp = get_session().post(url, data=query.encode("utf-8"), stream=True)
+    with resp:
+        if not 200 <= resp.status_code < 300:
+            raise ApiError(resp)
+        yield from parse_elements(resp.iter_content(chunk_size=chunk_size))
+
+
+def split_bbox(bbox: BBox, rows: int = 2, cols: int = 2) -> List[BBox]:
+    """Split a bounding box into a grid of tiles.
+
+    :param bbox: A bounding box as ``(south, west, north, east)``.
+    :param rows: Number of tiles from south to north.
+    :param cols: Number of tiles from west to east.
+    :return: A list of ``rows * cols`` bounding boxes.
+    """
+    south, west, north, east = bbox
+    lats = [south + (north - south) * row / rows for row in range(rows)] + [north]
+    lons = [west + (east - west) * col / cols for col in range(cols)] + [east]
+    return [
+        (lats[row], lons[col], lats[row + 1], lons[col + 1])
+        for row in range(rows)
+        for col in range(cols)
+    ]
+
+
+def _is_timeout(err: Exception) -> bool:
+    if isinstance(err, ApiError):
+        return err.args[0].status_code == 504
+    return "timed out" in str(err) or "out of memory" in str(err)
+
+
+def tiled_query(
+    template: str,
+    bbox: BBox,
+    grid: int = 2,
+    concurrency: int = 2,
+    max_depth: int = 2,
+    url: str = OVERPASS_URL,
+) -> Iterator[Dict]:
+    """Run an Overpass query over a large area as many smaller queries.
+
+    The bounding box is split into a ``grid`` x ``grid`` grid and ``{{bbox}}`` in the
+    query template is replaced with each tile's bounding box. Tiles are fetched in
+    parallel; a tile which times out or runs out of memory on the server is split into
+    four tiles again, up to ``max_depth`` times. Elements found in several tiles, e.g.
+    ways crossing a tile border, are yielded once.
+
+    :param template: An Overpass QL query containing ``{{bbox}}``.
+    :param bbox: A bounding box as ``(south, west, north, east)``.
+    :param grid: Number of tiles per side of the initial grid.
+    :param concurrency: Maximum number of queries in flight.
+    :param max_depth: Maximum number of times a tile is split after a timeout.
+    :param url: The URL of the Overpass API interpreter.
+    :return: An iterator of elements in the order their tiles complete.
+    :raises ApiError: If the HTTP status code of a tile is not in [200...300).
+    :raises OverpassError: If a tile fails and cannot be split further.
+    """
+
+    def fetch(tile: BBox) -> List[Dict]:
+        query = template.replace("{{bbox}}", ",".join(str(round(v, 7)) for v in tile))
+        return list(stream_query(query, url=url))
+
+    seen = set()
+    ensure_pool_size(concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(fetch, tile): (tile, 0)
+            for tile in split_bbox(bbox, grid, grid)
+        }
+        try:
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tile, depth = futures.pop(future)
+                    try:
+                        elements = future.result()
+                    except (ApiError, OverpassError) as err:
+                        if depth >= max_depth or not _is_timeout(err):
+                            raise
+                        for sub_tile in split_bbox(tile):
+                            futures[executor.submit(fetch, sub_tile)] = (
+                                sub_tile,
+                                depth + 1,
+                            )
+                        continue
+                    for element in elements:
+                        key = (element["type"], element["id"])
+                        if key not in seen:
+                            seen.add(key)
+                            yield element
+        finally:
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,262 @@
+"""This module defines a vectorized decoder of HERE flexible polylines and line
+simplification.
+
+:func:`decode` turns an encoded polyline into a NumPy array of ``longitude, latitude``
+and, if present, third dimension (e.g. elevation) columns, without a Python loop over
+characters or coordinates. Lines are simplified with :func:`douglas_peucker` or
+:func:`visvalingam`, which return the indices of the points kept, so that any third
+dimension is kept along.
+"""
+import heapq
+from collections import namedtuple
+from typing import Dict, List, Optional
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+#: Values of the encoding characters, indexed by character code minus 45.
+# fmt: off
+DECODING_TABLE = np.array(
+    [
+        62, -1, -1, 52, 53, 54, 55, 56, 57, 58, 59, 60, 61, -1, -1, -1, -1, -1, -1, -1,
+        0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21,
+        22, 23, 24, 25, -1, -1, -1, -1, 63, -1, 26, 27, 28, 29, 30, 31, 32, 33, 34, 35,
+        36, 37, 38, 39, 40, 41, 42, 43, 44, 45, 46, 47, 48, 49, 50, 51,
+    ],
+    dtype=np.int64,
+)
+# fmt: on
+
+SIMPLIFY_ALGORITHMS = ("dp", "vw")
+
+PolylineHeader = namedtuple("PolylineHeader", "precision,third_dim,third_dim_precision")
+
+
+def _unsigned_values(encoded: str) -> np.ndarray:
+    codes = np.frombuffer(encoded.encode("ascii"), dtype=np.uint8).astype(np.int64)
+    codes -= 45
+    if codes.size == 0 or codes.min() < 0 or codes.max() >= len(DECODING_TABLE):
+        raise ValueError("Invalid encoding")
+    values = DECODING_TABLE[codes]
+    if values.min() < 0:
+        raise ValueError("Invalid encoding")
+    ends = np.flatnonzero((values & 0x20) == 0)
+    if ends.size == 0 or ends[-1] != values.size - 1:
+        raise ValueError("Invalid encoding")
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    group = np.repeat(np.arange(ends.size), ends - starts + 1)
+    shift = (np.arange(values.size) - starts[group]) * 5
+    chunks = (values & 0x1F).astype(np.uint64) << shift.astype(np.uint64)
+    return np.add.reduceat(chunks, starts)
+
+
+def decode_header(encoded: str) -> PolylineHeader:
+    """Decode the header of a flexible polyline.
+
+    :param encoded: An encoded polyline.
+    :return: A :class:`PolylineHeader` with the precisions and the type of the third
+        dimension, ``0`` if absent.
+    :raises ValueError: If the polyline is invalid.
+    """
+    return _decode(encoded)[1]
+
+
+def _decode(encoded: str):
+    values = _unsigned_values(encoded)
+    if values.size < 2 or values[0] != FORMAT_VERSION:
+        raise ValueError("Invalid format version")
+    header = int(values[1])
+    header = PolylineHeader(header & 15, (header >> 4) & 7, (header >> 7) & 15)
+    dims = 3 if header.third_dim else 2
+    deltas = values[2:].astype(np.int64)
+    if deltas.size % dims:
+        raise ValueError("Invalid encoding. Premature ending reached")
+    signed = np.where(deltas & 1, ~(deltas >> 1), deltas >> 1)
+    scaled = np.cumsum(signed.reshape(-1, dims), axis=0)
+    factors = [10.0**header.precision] * 2 + [10.0**header.third_dim_precision]
+    coords = scaled / np.array(factors[:dims])
+    coords[:, [0, 1]] = coords[:, [1, 0]]
+    return coords, header
+
+
+def decode(encoded: str) -> np.ndarray:
+    """Decode a flexible polyline.
+
+    :param encoded: An encoded polyline.
+    :return: An array of shape ``(n, 2)`` with ``longitude, latitude`` columns, or
+        ``(n, 3)`` with a third dimension column, e.g. elevation.
+    :raises ValueError: If the polyline is invalid.
+    """
+    return _decode(encoded)[0]
+
+
+def encode(coords: np.ndarray, header: PolylineHeader) -> str:
+    """Encode coordinates as a flexible polyline.
+
+    :param coords: An array as returned by :func:`decode`.
+    :param header: The precisions and third dimension, see :func:`decode_header`.
+    :return: The encoded polyline.
+    """
+    import flexpolyline
+
+    latlng = coords.copy()
+    latlng[:, [0, 1]] = latlng[:, [1, 0]]
+    return flexpolyline.encode(latlng.tolist(), *header)
+
+
+def _segment_distances(points: np.ndarray, start: np.ndarray, end: np.ndarray):
+    segment = end - start
+    length = float(segment @ segment)
+    if length == 0:
+        return np.hypot(*(points - start).T)
+    t = np.clip((points - start) @ segment / length, 0, 1)
+    return np.hypot(*(points - start - np.outer(t, segment)).T)
+
+
+def douglas_peucker(coords: np.ndarray, tolerance: float) -> np.ndarray:
+    """Simplify a line with the Douglas-Peucker algorithm.
+
+    :param coords: An array with ``x, y`` in its first two columns.
+    :param tolerance: Maximum distance of a removed point to the simplified line, in
+        the units of the coordinates.
+    :return: The sorted indices of the points kept.
+    """
+    n = len(coords)
+    if n < 3:
+        return np.arange(n)
+    xy = coords[:, :2]
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        distances = _segment_distances(xy[first + 1 : last], xy[first], xy[last])
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            index += first + 1
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return np.flatnonzero(keep)
+
+
+def _triangle_areas(a: np.ndarray, b: np.ndarray, c: np.ndarray) -> np.ndarray:
+    return 0.5 * np.abs(
+        (b[..., 0] - a[..., 0]) * (c[..., 1] - a[..., 1])
+        - (c[..., 0] - a[..., 0]) * (b[..., 1] - a[..., 1])
+    )
+
+
+def visvalingam(coords: np.ndarray, tolerance: float) -> np.ndarray:
+    """Simplify a line with the Visvalingam-Whyatt algorithm.
+
+    Points are removed in order of the area of the triangle they form with their
+    neighbours, while that area is below ``tolerance ** 2``, so that the tolerance is
+    comparable to the one of :func:`douglas_peucker`.
+
+    :param coords: An array with ``x, y`` in its first two columns.
+    :param tolerance: The tolerance in the units of the coordinates.
+    :return: The sorted indices of the points kept.
+    """
+    n = len(coords)
+    if n < 3:
+        return np.arange(n)
+    xy = coords[:, :2]
+    threshold = tolerance**2
+    areas = np.full(n, np.inf)
+    areas[1:-1] = _triangle_areas(xy[:-2], xy[1:-1], xy[2:])
+    prev = np.arange(-1, n - 1)
+    nxt = np.arange(1, n + 1)
+    keep = np.ones(n, dtype=bool)
+    heap = [(area, i) for i, area in enumerate(areas[1:-1].tolist(), 1)]
+    heapq.heapify(heap)
+    while heap:
+        area, i = heapq.heappop(heap)
+        if area >= threshold:
+            break
+        if not keep[i] or area != areas[i]:
+            continue
+        keep[i] = False
+        before, after = prev[i], nxt[i]
+        nxt[before], prev[after] = after, before
+        for j in (before, after):
+            if 0 < j < n - 1:
+                new = _triangle_areas(xy[prev[j]], xy[j], xy[nxt[j]])
+                areas[j] = max(float(new), area)
+                heapq.heappush(heap, (areas[j], j))
+    return np.flatnonzero(keep)
+
+
+def simplify(
+    coords: np.ndarray, algorithm: Optional[str] = "dp", tolerance: float = 0.0
+) -> np.ndarray:
+    """Simplify a line.
+
+    :param coords: An array with ``x, y`` in its first two columns.
+    :param algorithm: ``dp`` for Douglas-Peucker or ``vw`` for Visvalingam-Whyatt.
+    :param tolerance: The tolerance in the units of the coordinates, ``0`` to keep
+        all points.
+    :return: The rows of ``coords`` which are kept.
+    :raises ValueError: If the algorithm is unknown.
+    """
+    if not algorithm or tolerance <= 0:
+        return coords
+    if algorithm == "dp":
+        return coords[douglas_peucker(coords, tolerance)]
+    if algorithm == "vw":
+        return coords[visvalingam(coords, tolerance)]
+    raise ValueError(f"Unknown simplification algorithm: {algorithm}")
+
+
+def simplify_routes(
+    routes: List[Dict], algorithm: Optional[str] = "dp", tolerance: float = 0.0
+) -> List[Dict]:
+    """Simplify the section polylines of HERE routes in place.
+
+    :param routes: The ``routes`` of a HERE Routing API response.
+    :param algorithm: ``dp`` or ``vw``, see :func:`simplify`.
+    :param tolerance: The tolerance in degrees.
+    :return: The routes.
+    """
+    if not algorithm or tolerance <= 0:
+        return routes
+    for route in routes:
+        for section in route.get("sections", []):
+            if section.get("polyline"):
+                coords, header = _decode(section["polyline"])
+                section["polyline"] = encode(
+                    simplify(coords, algorithm, tolerance), header
+                )
+    return routes
+
+
+def route_features(
+    routes: List[Dict], algorithm: Optional[str] = "dp", tolerance: float = 0.0
+) -> Dict:
+    """Convert HERE routes to GeoJSON, with one line per route section.
+
+    :param routes: The ``routes`` of a HERE Routing API response.
+    :param algorithm: ``dp`` or ``vw``, see :func:`simplify`.
+    :param tolerance: The tolerance in degrees, ``0`` to keep all points.
+    :return: A feature collection of line strings, with the elevation as third
+        coordinate if it was requested. The sections are the properties.
+    """
+    features = []
+    for route in routes:
+        for section in route.get("sections", []):
+            if not section.get("polyline"):
+                continue
+            coords = simplify(decode(section["polyline"]), algorithm, tolerance)
+            properties = dict(section)
+            properties.pop("polyline")
+            features.append(
+                {
+                    "type": "Feature",
+                    "geometry": {"type": "LineString", "coordinates": coords.tolist()},
+                    "properties": properties,
+                }
+            )
+    return {"type": "FeatureCollection", "features": features}
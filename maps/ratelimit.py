@@ -0,0 +1,271 @@
+"""This module defines a client side rate limiter for the providers.
+
+Requests are throttled with token buckets keyed by provider and API key. The bucket
+state is kept in a small SQLite database in the user cache directory, so the limits
+hold across threads, asyncio tasks and concurrent ``maps`` processes.
+
+Limits are configured with the ``MAPS_RATE_LIMITS`` environment variable, which
+overrides :data:`DEFAULT_RATE_LIMITS` per provider, e.g.
+``MAPS_RATE_LIMITS="here=10/s,250000/d;tomtom=none"``.
+"""
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from maps.cache import default_cache_dir
+from maps.exceptions import RateLimitTimeoutError
+
+#: Limits of the free plans of the providers, or the usage policy for Nominatim.
+DEFAULT_RATE_LIMITS = "osm=1/s;here=5/s;mapbox=600/m;tomtom=5/s;ors=40/m"
+
+PERIODS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+PROVIDER_HOSTS = (
+    ("nominatim.openstreetmap.org", "osm"),
+    ("hereapi.com", "here"),
+    ("api.mapbox.com", "mapbox"),
+    ("api.tomtom.com", "tomtom"),
+    ("api.openrouteservice.org", "ors"),
+)
+
+_KEY_PARAMS = ("apiKey", "apikey", "api_key", "access_token", "key")
+
+Limit = Tuple[float, float]
+
+_lock = threading.Lock()
+_limiter: Optional["RateLimiter"] = None
+
+
+def parse_rate_limits(spec: str) -> Dict[str, List[Limit]]:
+    """Parse a rate limit specification.
+
+    Providers are separated by ``;``, each with a comma-separated list of limits of
+    the form ``<count>/<s|m|h|d>``. ``none`` removes all limits of a provider.
+
+    :param spec: A specification, e.g. ``"osm=1/s;here=5/s,1000/d"``.
+    :return: A dict mapping providers to lists of ``(count, period in seconds)``.
+    :raises ValueError: If the specification is malformed.
+    """
+    limits: Dict[str, List[Limit]] = {}
+    for entry in spec.split(";"):
+        if not entry.strip():
+            continue
+        provider, _, values = entry.partition("=")
+        provider_limits = []
+        for value in values.split(","):
+            value = value.strip()
+            if value.lower() == "none":
+                continue
+            count, _, period = value.partition("/")
+            if period not in PERIODS or float(count) <= 0:
+                raise ValueError(f"Invalid rate limit for {provider.strip()}: {value}")
+            provider_limits.append((float(count), float(PERIODS[period])))
+        limits[provider.strip()] = provider_limits
+    return limits
+
+
+def provider_for_url(url: str) -> Optional[str]:
+    """Return the provider which serves ``url``.
+
+    :param url: A request URL.
+    :return: A provider name, e.g. ``osm``, or ``None`` for unknown hosts.
+    """
+    host = (urlsplit(url).hostname or "").lower()
+    for suffix, provider in PROVIDER_HOSTS:
+        if host == suffix or host.endswith("." + suffix):
+            return provider
+    return None
+
+
+def credentials_for_request(
+    url: str, headers: Optional[Mapping] = None
+) -> Optional[str]:
+    """Return the API key sent with a request, from its query or ``Authorization``.
+
+    :param url: A request URL.
+    :param headers: The request headers.
+    :return: The API key or ``None``.
+    """
+    params = dict(parse_qsl(urlsplit(url).query))
+    for name in _KEY_PARAMS:
+        if params.get(name):
+            return params[name]
+    if headers:
+        return headers.get("Authorization")
+    return None
+
+
+class RateLimiter:
+    """Token buckets shared by all threads and processes using the same database.
+
+    A caller takes a token from every bucket of its provider. When a bucket is empty
+    the token is reserved anyway and the caller waits until it would have been
+    refilled, so waiting callers are served in order without polling.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        limits: Optional[Dict[str, List[Limit]]] = None,
+    ):
+        if path is None:
+            cache_dir = default_cache_dir()
+            os.makedirs(cache_dir, exist_ok=True)
+            path = os.path.join(cache_dir, "ratelimit.sqlite")
+        self.path = path
+        self.limits = (
+            parse_rate_limits(DEFAULT_RATE_LIMITS) if limits is None else limits
+        )
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS bucket (key TEXT, period REAL, "
+                "tokens REAL, updated REAL, PRIMARY KEY (key, period))"
+            )
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        """Create a rate limiter with :data:`DEFAULT_RATE_LIMITS` updated by the
+        ``MAPS_RATE_LIMITS`` environment variable.
+
+        :return: A :class:`RateLimiter` in the user cache directory.
+        """
+        limits = parse_rate_limits(DEFAULT_RATE_LIMITS)
+        limits.update(parse_rate_limits(os.environ.get("MAPS_RATE_LIMITS", "")))
+        return cls(limits=limits)
+
+    def reserve(
+        self, provider: Optional[str], credentials: Optional[str] = None
+    ) -> float:
+        """Take a token for one request.
+
+        :param provider: Name of the provider, e.g. ``osm``.
+        :param credentials: The API key used for the request, if any.
+        :return: The number of seconds to wait before sending the request.
+        """
+        limits = self.limits.get(provider or "")
+        if not limits:
+            return 0.0
+        key = provider
+        if credentials:
+            key += ":" + hashlib.sha256(credentials.encode("utf-8")).hexdigest()[:16]
+        delay = 0.0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                for count, period in limits:
+                    rate = count / period
+                    row = self._conn.execute(
+                        "SELECT tokens, updated FROM bucket WHERE key = ? AND period = ?",
+                        (key, period),
+                    ).fetchone()
+                    tokens = (
+                        count
+                        if row is None
+                        else min(count, row[0] + (now - row[1]) * rate)
+                    )
+                    tokens -= 1
+                    delay = max(delay, -tokens / rate)
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO bucket VALUES (?, ?, ?, ?)",
+                        (key, period, tokens, now),
+                    )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return delay
+
+    def acquire(
+        self, provider: Optional[str], credentials: Optional[str] = None
+    ) -> None:
+        """Block until a request to ``provider`` may be sent.
+
+        :param provider: Name of the provider, e.g. ``osm``.
+        :param credentials: The API key used for the request, if any.
+        """
+        delay = self.reserve(provider, credentials)
+        _check_deadline(provider, delay)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def aacquire(
+        self, provider: Optional[str], credentials: Optional[str] = None
+    ) -> None:
+        """Async counterpart of :meth:`acquire`, which does not block the event loop
+        while waiting."""
+        delay = self.reserve(provider, credentials)
+        _check_deadline(provider, delay)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def _check_deadline(provider: Optional[str], delay: float) -> None:
+    deadline = _deadline.get()
+    if deadline is not None and time.monotonic() + delay > deadline:
+        raise RateLimitTimeoutError(
+            f"Rate limit of {provider} exceeded, the request would wait {delay:.2f}s."
+        )
+
+
+@contextmanager
+def deadline(seconds: float) -> Iterator[None]:
+    """Fail requests of the current context, i.e. thread or asyncio task, which would
+    wait for the rate limit longer than ``seconds`` from now, instead of waiting.
+
+    The token taken for such a request is not returned.
+
+    :param seconds: The maximum time from now.
+    :raises RateLimitTimeoutError: When a request would wait past the deadline.
+    """
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Return the rate limiter shared by the process, creating it on first use.
+
+    :return: A :class:`RateLimiter` configured by :meth:`RateLimiter.from_env`.
+    """
+    global _limiter
+    with _lock:
+        if _limiter is None:
+            _limiter = RateLimiter.from_env()
+        return _limiter
+
+
+def acquire_for_request(url: str, headers: Optional[Mapping] = None) -> None:
+    """Block until a request to ``url`` may be sent, see :meth:`RateLimiter.acquire`.
+
+    :param url: A request URL.
+    :param headers: The request headers.
+    """
+    provider = provider_for_url(url)
+    if provider is not None:
+        get_rate_limiter().acquire(provider, credentials_for_request(url, headers))
+
+
+async def aacquire_for_request(url: str, headers: Optional[Mapping] = None) -> None:
+    """Async counterpart of :func:`acquire_for_request`."""
+    provider = provider_for_url(url)
+    if provider is not None:
+        await get_rate_limiter().aacquire(
+            provider, credentials_for_request(url, headers)
+        )
@@ -0,0 +1,235 @@
+"""This module defines the retry policy for transient provider failures.
+
+Requests which fail with a connection error or a ``429`` or ``5xx`` status are sent
+again after an exponential backoff with full jitter, or after the delay given in a
+``Retry-After`` header, until the number of attempts or the total retry time is
+exhausted. Both are configured with the ``MAPS_RETRY_MAX_ATTEMPTS`` and
+``MAPS_RETRY_MAX_TIME`` (seconds) environment variables.
+
+Every retry is logged to the ``maps.retry`` logger and counted in :data:`stats`.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import TYPE_CHECKING, Awaitable, Callable, Iterator, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+if TYPE_CHECKING:
+    import aiohttp
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_MAX_TIME = 60.0
+
+logger = logging.getLogger(__name__)
+
+#: Number of retries and of requests which ran out of retries, per host.
+stats: Counter = Counter()
+
+_policy: ContextVar[Optional["RetryPolicy"]] = ContextVar("policy", default=None)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a ``Retry-After`` header.
+
+    :param value: A number of seconds or an HTTP date.
+    :return: The number of seconds to wait, or ``None`` if the value is invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, capped by attempts and total time."""
+
+    def __init__(
+        self,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        max_time: float = DEFAULT_MAX_TIME,
+        base: float = 0.5,
+        cap: float = 30.0,
+    ):
+        self.max_attempts = max_attempts
+        self.max_time = max_time
+        self.base = base
+        self.cap = cap
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        """Create a policy configured by the ``MAPS_RETRY_MAX_ATTEMPTS`` and
+        ``MAPS_RETRY_MAX_TIME`` environment variables.
+
+        :return: A :class:`RetryPolicy`.
+        """
+        return cls(
+            max_attempts=int(
+                os.environ.get("MAPS_RETRY_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)
+            ),
+            max_time=float(os.environ.get("MAPS_RETRY_MAX_TIME", DEFAULT_MAX_TIME)),
+        )
+
+    def backoff(self, attempt: int) -> float:
+        """Return a random delay of up to ``base * 2 ** attempt`` seconds.
+
+        :param attempt: Number of attempts made so far.
+        :return: The delay in seconds.
+        """
+        return random.uniform(0, min(self.cap, self.base * 2**attempt))
+
+    def begin(self, method: str, url: str) -> "RetryState":
+        """Start tracking the attempts of one request.
+
+        :param method: The HTTP method.
+        :param url: The request URL.
+        :return: A :class:`RetryState`.
+        """
+        return RetryState(self, method, url)
+
+
+def current_policy() -> RetryPolicy:
+    """Return the policy set with :func:`use_policy`, or the one configured by the
+    environment, see :meth:`RetryPolicy.from_env`."""
+    return _policy.get() or RetryPolicy.from_env()
+
+
+@contextmanager
+def use_policy(policy: RetryPolicy) -> Iterator[None]:
+    """Retry the requests sent in the current context, i.e. thread or asyncio task,
+    according to ``policy``, e.g. ``RetryPolicy(max_attempts=1)`` to not retry.
+
+    :param policy: A :class:`RetryPolicy`.
+    """
+    token = _policy.set(policy)
+    try:
+        yield
+    finally:
+        _policy.reset(token)
+
+
+class RetryState:
+    """The attempts of one request under a :class:`RetryPolicy`."""
+
+    def __init__(self, policy: RetryPolicy, method: str, url: str):
+        self.policy = policy
+        self.method = method
+        self.host = urlsplit(url).hostname or ""
+        self.attempts = 0
+        self.started = time.monotonic()
+
+    def next_delay(
+        self, reason: str, retry_after: Optional[str] = None
+    ) -> Optional[float]:
+        """Record a failed attempt and decide whether to retry.
+
+        :param reason: The status code or error of the failed attempt.
+        :param retry_after: The ``Retry-After`` header of the response, if any.
+        :return: The number of seconds to wait before the next attempt, or ``None``
+            if the request should not be retried.
+        """
+        self.attempts += 1
+        delay = parse_retry_after(retry_after)
+        if delay is None:
+            delay = self.policy.backoff(self.attempts)
+        elapsed = time.monotonic() - self.started
+        if (
+            self.attempts >= self.policy.max_attempts
+            or elapsed + delay > self.policy.max_time
+        ):
+            stats[(self.host, "exhausted")] += 1
+            logger.warning(
+                "Giving up %s %s after %d attempts: %s",
+                self.method,
+                self.host,
+                self.attempts,
+                reason,
+            )
+            return None
+        stats[(self.host, "retry")] += 1
+        logger.info(
+            "Retrying %s %s in %.2fs after attempt %d: %s",
+            self.method,
+            self.host,
+            delay,
+            self.attempts,
+            reason,
+        )
+        return delay
+
+
+def send(
+    send_once: Callable[[], requests.Response], method: str, url: str
+) -> requests.Response:
+    """Send a request with :mod:`requests`, retrying transient failures.
+
+    :param send_once: A callable without arguments which sends the request once.
+    :param method: The HTTP method.
+    :param url: The request URL.
+    :return: The last response.
+    :raises requests.ConnectionError: If the last attempt failed to connect.
+    """
+    state = current_policy().begin(method, url)
+    while True:
+        try:
+            resp = send_once()
+        except requests.ConnectionError as err:
+            delay = state.next_delay(type(err).__name__)
+            if delay is None:
+                raise
+        else:
+            if resp.status_code not in RETRY_STATUSES:
+                return resp
+            delay = state.next_delay(
+                str(resp.status_code), resp.headers.get("Retry-After")
+            )
+            if delay is None:
+                return resp
+            resp.close()
+        time.sleep(delay)
+
+
+async def asend(
+    send_once: Callable[[], Awaitable["aiohttp.ClientResponse"]], method: str, url: str
+) -> "aiohttp.ClientResponse":
+    """Async counterpart of :func:`send` for :mod:`aiohttp`.
+
+    :param send_once: A callable without arguments which sends the request once.
+    :param method: The HTTP method.
+    :param url: The request URL.
+    :return: The last response, which must be released by the caller.
+    :raises aiohttp.ClientConnectionError: If the last attempt failed to connect.
+    """
+    import aiohttp
+
+    state = current_policy().begin(method, url)
+    while True:
+        try:
+            resp = await send_once()
+        except aiohttp.ClientConnectionError as err:
+            delay = state.next_delay(type(err).__name__)
+            if delay is None:
+                raise
+        else:
+            if resp.status not in RETRY_STATUSES:
+                return resp
+            delay = state.next_delay(str(resp.status), resp.headers.get("Retry-After"))
+            if delay is None:
+                return resp
+            resp.release()
+        await asyncio.sleep(delay)
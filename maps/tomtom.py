@@ -2,12 +2,12 @@
 import os
 
 import click
-import simplejson as json
-from geojsonio import display as geo_display
-from geopy.geocoders import TomTom
 
+from maps.batch import batch_fields, geocode_batch, location_to_dict, read_queries
+from maps.cache import cached_geolocator
 from maps.exceptions import ApiKeyNotFoundError
-from maps.utils import get_feature_from_lat_lon, yield_subcommands
+from maps.output import get_writer
+from maps.utils import geo_display, get_feature_from_lat_lon, yield_subcommands
 
 
 @click.group()
@@ -39,10 +39,16 @@ def show():
     show_default=True,
     help="Perform a forward or reverse geocode",
 )
+@click.option(
+    "--no-cache", "no_cache", is_flag=True, help="Do not use the geocoding cache."
+)
+@click.option(
+    "--refresh", is_flag=True, help="Ignore cached results and store fresh ones."
+)
 @click.option("--raw", is_flag=True)
 @click.option("--display", help="Display result in browser", is_flag=True)
 @click.pass_context
-def geocoding(ctx, query, apikey, forward, raw, display):
+def geocoding(ctx, query, apikey, forward, raw, display, no_cache, refresh):
     """
     TomTom's geocoding service.
     \f
@@ -53,6 +59,8 @@ def geocoding(ctx, query, apikey, forward, raw, display):
     :param forward: A boolean flag for forward/reverse geocoding.
     :param raw: A boolean flag to show api response as it is.
     :param display: A boolean flag to show result in web browser.
+    :param no_cache: A boolean flag to bypass the geocoding cache.
+    :param refresh: A boolean flag to ignore cached results and store fresh ones.
     :return: None.
     """
     apikey = apikey or os.environ.get("TOMTOM_APIKEY")
@@ -62,20 +70,150 @@ def geocoding(ctx, query, apikey, forward, raw, display):
             "variable in TOMTOM_APIKEY "
         )
     ctx.obj["apikey"] = apikey
-    geolocator = TomTom(api_key=ctx.obj["apikey"])
+    from geopy.geocoders import TomTom
+
+    from maps.adapters import PooledRequestsAdapter
+
+    geolocator = cached_geolocator(
+        TomTom(api_key=ctx.obj["apikey"], adapter_factory=PooledRequestsAdapter),
+        "tomtom",
+        no_cache=no_cache,
+        refresh=refresh,
+    )
     if forward:
         location = geolocator.geocode(query)
         if raw:
-            click.secho(json.dumps(location.raw, indent=2), fg="green")
+            with get_writer() as writer:
+                writer.write(location.raw)
         elif display:
             feature = get_feature_from_lat_lon(location.latitude, location.longitude)
             geo_display(feature)
         else:
-            result = {"lat": location.latitude, "lon": location.longitude}
-            click.secho(json.dumps(result, indent=2), fg="green")
+            with get_writer() as writer:
+                writer.write({"lat": location.latitude, "lon": location.longitude})
     else:
         location = geolocator.reverse(query)
-        if raw:
-            click.secho(json.dumps(location.raw, indent=2), fg="green")
+        with get_writer() as writer:
+            if raw:
+                writer.write(location.raw)
+            elif writer.output_format == "json":
+                writer.write(location.address)
+            else:
+                writer.write(
+                    {
+                        "address": location.address,
+                        "lat": location.latitude,
+                        "lon": location.longitude,
+                    }
+                )
+
+
+@tomtom.command(
+    short_help="forward or reverse geocode addresses or coordinates from a file."
+)
+@click.argument("input", type=click.File("r"), default="-")
+@click.option("--apikey", help="Your TomTom API key", type=str)
+@click.option(
+    "--forward/--reverse",
+    default=True,
+    show_default=True,
+    help="Perform a forward or reverse geocode",
+)
+@click.option(
+    "--input_format",
+    type=click.Choice(["csv", "ndjson"]),
+    default="csv",
+    show_default=True,
+    help="Format of the input records.",
+)
+@click.option(
+    "--column",
+    default="query",
+    show_default=True,
+    help="Name of the column holding the query.",
+)
+@click.option(
+    "--concurrency",
+    default=8,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of requests in flight.",
+)
+@click.option(
+    "--no-cache", "no_cache", is_flag=True, help="Do not use the geocoding cache."
+)
+@click.option(
+    "--refresh", is_flag=True, help="Ignore cached results and store fresh ones."
+)
+@click.option("--raw", is_flag=True)
+@click.option(
+    "--snap",
+    default=0,
+    type=click.IntRange(min=0, max=10),
+    help="Reverse geocode one point per grid cell of this many decimal places, e.g. "
+    "4 for about 11 meters, and give its result to every point of the cell. "
+    "0 geocodes every point.",
+)
+@click.pass_context
+def batch_geocoding(
+    ctx,
+    input,
+    apikey,
+    forward,
+    input_format,
+    column,
+    concurrency,
+    raw,
+    no_cache,
+    refresh,
+    snap,
+):
+    """
+    TomTom's geocoding service for many queries read from a file or stdin.
+    Results are written in input order, as one JSON object per line by default.
+    \f
+
+    :param ctx: A context dictionary.
+    :param input: A CSV or NDJSON file with one query per record, ``-`` for stdin.
+    :param apikey: An API key for authentication.
+    :param forward: A boolean flag for forward/reverse geocoding.
+    :param input_format: Format of the input records, ``csv`` or ``ndjson``.
+    :param column: Name of the column holding the query.
+    :param concurrency: Maximum number of requests in flight.
+    :param raw: A boolean flag to show api response as it is.
+    :param no_cache: A boolean flag to bypass the geocoding cache.
+    :param refresh: A boolean flag to ignore cached results and store fresh ones.
+    :param snap: Decimal places of the grid reverse geocoded points are snapped to.
+    :return: None.
+    """
+    apikey = apikey or os.environ.get("TOMTOM_APIKEY")
+    if apikey is None:
+        raise ApiKeyNotFoundError(
+            "Please pass TomTom's API KEY as --apikey or set it as environment "
+            "variable in TOMTOM_APIKEY "
+        )
+    ctx.obj["apikey"] = apikey
+    from geopy.geocoders import TomTom
+
+    from maps.adapters import PooledAioHTTPAdapter
+
+    geolocator = cached_geolocator(
+        TomTom(api_key=ctx.obj["apikey"], adapter_factory=PooledAioHTTPAdapter),
+        "tomtom",
+        no_cache=no_cache,
+        refresh=refresh,
+    )
+
+    async def geocode(query):
+        if forward:
+            location = await geolocator.geocode(query)
         else:
-            click.secho(location.address, fg="green")
+            location = await geolocator.reverse(query)
+        return location_to_dict(location, forward, raw)
+
+    queries = read_queries(input, input_format=input_format, column=column)
+    with get_writer("ndjson", many=True, fields=batch_fields(forward, raw)) as writer:
+        for record in geocode_batch(
+            geocode, queries, concurrency=concurrency, snap=0 if forward else snap
+        ):
+            writer.write(record)
@@ -0,0 +1,274 @@
+"""This module defines the HTTP transport shared by all providers.
+
+A single :class:`requests.Session` with a pool of keep-alive connections is used by
+:class:`maps.apis.apis.Api`, the geopy geocoders (see :mod:`maps.adapters`) and the
+provider SDK clients, so repeated calls to a provider reuse TCP and TLS connections.
+Proxies and CA bundle are resolved from the environment once, when the session is
+created.
+
+The asyncio engine uses one :class:`aiohttp.ClientSession` per event loop in the
+same way, see :func:`get_async_session`.
+
+Both sessions wait for the rate limits of :mod:`maps.ratelimit` before sending a
+request to a provider. Requests sent with the :mod:`requests` session are retried on
+transient failures according to :mod:`maps.retry`.
+
+If ``MAPS_REDIRECT_URL`` is set, e.g. to a local stand-in server of the providers
+used for benchmarks, all requests are sent there instead, see :func:`redirect_url`.
+Responses can be recorded and replayed without network access with
+``MAPS_CASSETTE``, see :mod:`maps.cassette`.
+"""
+import asyncio
+import importlib
+import os
+import threading
+import urllib.request
+from typing import TYPE_CHECKING, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+if TYPE_CHECKING:
+    import aiohttp
+
+DEFAULT_POOL_SIZE = 10
+
+_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+_pool_size: Optional[int] = None
+_async_sessions: Dict[asyncio.AbstractEventLoop, "aiohttp.ClientSession"] = {}
+
+
+def redirect_url(url: str) -> str:
+    """Redirect a request to ``MAPS_REDIRECT_URL`` if it is set.
+
+    The host of the original URL becomes the first path segment, e.g.
+    ``https://api.mapbox.com/geocoding/v5`` is sent to
+    ``http://127.0.0.1:8080/api.mapbox.com/geocoding/v5`` for
+    ``MAPS_REDIRECT_URL=http://127.0.0.1:8080``. Redirected requests are not rate
+    limited, as their host is not a provider's.
+
+    :param url: The URL of a request.
+    :return: The redirected URL, or ``url`` if ``MAPS_REDIRECT_URL`` is not set.
+    """
+    base = os.environ.get("MAPS_REDIRECT_URL")
+    if not base:
+        return url
+    parts = urlsplit(url)
+    query = f"?{parts.query}" if parts.query else ""
+    return f"{base.rstrip('/')}/{parts.netloc}{parts.path}{query}"
+
+
+class TransportAdapter(HTTPAdapter):
+    """An HTTP adapter which waits for the provider's rate limit before sending and
+    retries transient failures."""
+
+    def send(self, request, **kwargs):
+        """Send a request, see :meth:`requests.adapters.HTTPAdapter.send`."""
+        from maps import retry
+        from maps.cassette import Cassette, build_response
+        from maps.ratelimit import acquire_for_request
+
+        cassette = Cassette.from_env()
+        if cassette is not None:
+            key = cassette.key(request.method, request.url, body=request.body)
+            recording = cassette.lookup(key)
+            if recording is not None:
+                return build_response(recording, request)
+        request.url = redirect_url(request.url)
+
+        def send_once():
+            acquire_for_request(request.url, request.headers)
+            return super(TransportAdapter, self).send(request, **kwargs)
+
+        resp = retry.send(send_once, request.method, request.url)
+        if cassette is not None:
+            cassette.record(
+                key,
+                resp.status_code,
+                resp.reason,
+                resp.headers.get("Content-Type"),
+                resp.content,
+            )
+        return resp
+
+
+def _mount(session: requests.Session, pool_size: int) -> None:
+    for prefix in ("http://", "https://"):
+        session.mount(
+            prefix,
+            TransportAdapter(pool_connections=pool_size, pool_maxsize=pool_size),
+        )
+
+
+async def _on_request_start(session, context, params) -> None:
+    from maps.ratelimit import aacquire_for_request
+
+    await aacquire_for_request(str(params.url), params.headers)
+
+
+def get_session() -> requests.Session:
+    """Return the shared session, creating it on first use.
+
+    The pool size defaults to ``MAPS_POOL_SIZE`` or :data:`DEFAULT_POOL_SIZE`.
+
+    :return: A :class:`requests.Session`.
+    """
+    global _session, _pool_size
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            # Environment is resolved once here instead of on every request.
+            session.trust_env = False
+            session.proxies = urllib.request.getproxies()
+            ca_bundle = os.environ.get("REQUESTS_CA_BUNDLE") or os.environ.get(
+                "CURL_CA_BUNDLE"
+            )
+            if ca_bundle:
+                session.verify = ca_bundle
+            _pool_size = _pool_size or int(
+                os.environ.get("MAPS_POOL_SIZE", DEFAULT_POOL_SIZE)
+            )
+            _mount(session, _pool_size)
+            _session = session
+        return _session
+
+
+def configure(pool_size: int) -> None:
+    """Set the number of pooled connections kept per host.
+
+    Takes effect on the shared session immediately, so clients which already hold
+    the session use the new pool as well.
+
+    :param pool_size: Maximum number of connections kept alive per host.
+    """
+    global _pool_size
+    with _lock:
+        _pool_size = pool_size
+        if _session is not None:
+            _mount(_session, pool_size)
+
+
+def ensure_pool_size(concurrency: int) -> None:
+    """Grow the connection pool so that ``concurrency`` requests do not wait for a
+    connection.
+
+    :param concurrency: Number of requests expected to be in flight.
+    """
+    get_session()
+    if concurrency > (_pool_size or 0):
+        configure(concurrency)
+
+
+def get_async_session() -> "aiohttp.ClientSession":
+    """Return the shared aiohttp session of the running event loop.
+
+    It keeps up to the configured pool size of connections per host alive and is
+    closed by :func:`close_async_session`.
+
+    :return: A :class:`aiohttp.ClientSession`.
+    """
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
+    if session is None or session.closed:
+        get_session()
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=_pool_size)
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(_on_request_start)
+        session = aiohttp.ClientSession(
+            connector=connector, trust_env=False, trace_configs=[trace_config]
+        )
+        _async_sessions[loop] = session
+    return session
+
+
+async def close_async_session() -> None:
+    """Close the shared aiohttp session of the running event loop, if any."""
+    session = _async_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+def get_proxy(url: str) -> Optional[str]:
+    """Return the proxy of the shared session for ``url``.
+
+    :param url: The URL to be requested.
+    :return: A proxy URL or ``None``.
+    """
+    return get_session().proxies.get(url.split(":", 1)[0].lower())
+
+
+def ors_client(key: str):
+    """Create an :class:`openrouteservice.Client` which uses the shared session.
+
+    :param key: An ORS API key.
+    :return: An :class:`openrouteservice.Client`.
+    """
+    import openrouteservice
+
+    client = openrouteservice.Client(key=key)
+    client._session = get_session()
+    return client
+
+
+def ls_client(api_key: str):
+    """Create a :class:`here_location_services.LS` client which uses the shared session.
+
+    :param api_key: A HERE API key.
+    :return: A :class:`here_location_services.LS` client.
+    """
+    from here_location_services import LS
+
+    ls = LS(api_key=api_key)
+    session = get_session()
+    _bind_ls_modules()
+    for api in (
+        ls.geo_search_api,
+        ls.isoline_routing_api,
+        ls.routing_api,
+        ls.matrix_routing_api,
+    ):
+        _bind_ls_api(api, session)
+    return ls
+
+
+class _SessionRequests:
+    """Stands in for the :mod:`requests` module in the modules of
+    here_location_services, which call ``requests.get`` directly for routing, search
+    and isolines, so that these calls use the shared session as well."""
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+    @staticmethod
+    def get(url, **kwargs):
+        return get_session().get(url, **kwargs)
+
+    @staticmethod
+    def post(url, **kwargs):
+        return get_session().post(url, **kwargs)
+
+
+def _bind_ls_modules() -> None:
+    for name in ("geocoding_search_api", "isoline_routing_api", "routing_api"):
+        module = importlib.import_module(f"here_location_services.{name}")
+        if getattr(module, "requests", None) is requests:
+            module.requests = _SessionRequests()
+
+
+def _bind_ls_api(api, session: requests.Session) -> None:
+    # here_location_services calls the module level requests.get/post,
+    # the instance methods are replaced to send the same requests via the session.
+    def get(url, params=None, **kwargs):
+        params = dict(params or {}, **api.credential_params)
+        return session.get(url, params=params, **kwargs)
+
+    def post(url, data, params=None):
+        api.headers.update({"Content-Type": "application/json"})
+        return session.post(url, params=params, json=data, headers=api.headers)
+
+    api.get = get
+    api.post = post
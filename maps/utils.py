@@ -1,19 +1,101 @@
 """Common utilities across project."""
+import importlib
+from typing import Dict, List, Optional
 
+import click
 from geojson import Feature, Point
 
 
+def _entry_points(group: str) -> List:
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:  # Python < 3.8
+        from importlib_metadata import entry_points
+
+    eps = entry_points()
+    if hasattr(eps, "select"):
+        return list(eps.select(group=group))
+    return list(eps.get(group, []))
+
+
+class LazyGroup(click.Group):
+    """A ``Click`` group which imports its subcommands only when they are invoked.
+
+    Subcommands are given as ``{name: "module:attribute"}`` in ``lazy_subcommands``.
+    More subcommands are discovered from the ``entry_point_group`` entry points, so
+    that other packages can register providers, e.g. in ``pyproject.toml``::
+
+        [tool.poetry.plugins."maps.providers"]
+        myprovider = "maps_myprovider:myprovider"
+    """
+
+    def __init__(
+        self,
+        *args,
+        lazy_subcommands: Optional[Dict[str, str]] = None,
+        entry_point_group: Optional[str] = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = dict(lazy_subcommands or {})
+        self.entry_point_group = entry_point_group
+        self._entry_points: Optional[Dict] = None
+
+    def _plugins(self) -> Dict:
+        if self._entry_points is None:
+            self._entry_points = {}
+            if self.entry_point_group:
+                for entry_point in _entry_points(self.entry_point_group):
+                    if entry_point.name not in self.lazy_subcommands:
+                        self._entry_points[entry_point.name] = entry_point
+        return self._entry_points
+
+    def list_commands(self, ctx) -> List[str]:
+        """Return names of all subcommands in registration order, without importing
+        them."""
+        names = list(self.lazy_subcommands) + list(self._plugins())
+        return names + [name for name in self.commands if name not in names]
+
+    def get_command(self, ctx, cmd_name: str) -> Optional[click.Command]:
+        """Return the subcommand ``cmd_name``, importing it on first use."""
+        if cmd_name not in self.commands:
+            if cmd_name in self.lazy_subcommands:
+                module_name, attr = self.lazy_subcommands[cmd_name].split(":")
+                command = getattr(importlib.import_module(module_name), attr)
+            elif cmd_name in self._plugins():
+                command = self._plugins()[cmd_name].load()
+            else:
+                return None
+            self.add_command(command, cmd_name)
+        return self.commands[cmd_name]
+
+
 def yield_subcommands(obj):
     """
     Show list of all available sub commands.
 
     :param obj: ``Click`` command object.
     """
-    for name, value in obj.commands.items():
+    names = obj.list_commands(None) if isinstance(obj, LazyGroup) else obj.commands
+    for name in names:
         if name != "show":
             yield name
 
 
+def geo_display(contents, **kwargs):
+    """Display GeoJSON contents in a web browser using :mod:`geojsonio`.
+
+    :mod:`geojsonio` is imported on first use as it is slow to import.
+
+    :param contents: A GeoJSON string or object.
+    :param kwargs: Keyword arguments passed to :func:`geojsonio.display`.
+    :return: The URL of the displayed contents.
+    """
+    from geojsonio import display
+
+    return display(contents, **kwargs)
+
+
 def get_feature_from_lat_lon(lat: float, lon: float):
     """Returns GeoJSON Point Feature for a given latitude and longitude.
 
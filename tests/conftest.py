@@ -0,0 +1,15 @@
+"""Shared fixtures for tests."""
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Keep the geocoding cache of each test in a temporary directory."""
+    monkeypatch.setenv("MAPS_CACHE_DIR", str(tmp_path / "cache"))
+    return tmp_path / "cache"
+
+
+@pytest.fixture(autouse=True)
+def rate_limiter(cache_dir, monkeypatch):
+    """Keep the rate limit buckets of each test in its cache directory."""
+    monkeypatch.setattr("maps.ratelimit._limiter", None)
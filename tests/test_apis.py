@@ -18,3 +18,111 @@ def test_apis():
             == '401, Unauthorized, {"message": "Not Authorized - Invalid Token",  '
             '"error_detail": "No valid token prefix found in access_token parameter"}'
         )
+
+
+def test_async_mapbox_api():
+    from aiohttp import web
+
+    from maps.apis.mapbox import AsyncMapBoxApi
+    from maps.engine import run
+
+    async def handler(request):
+        if request.query["access_token"] != "token":
+            return web.json_response({"message": "Not Authorized"}, status=401)
+        return web.json_response({"code": "Ok", "path": request.path})
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/{tail:.*}", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            client = AsyncMapBoxApi(f"http://127.0.0.1:{port}", credentials="token")
+            resp = await client.matrix(profile="driving", coordinates="0,0;1,1")
+            denied = AsyncMapBoxApi(f"http://127.0.0.1:{port}", credentials="bad")
+            try:
+                await denied.isochrone("driving", [0, 0], [5])
+            except ApiError as err:
+                error = str(err)
+        finally:
+            await runner.cleanup()
+        return resp, error
+
+    resp, error = run(main())
+    assert resp.status_code == 200
+    assert resp.json() == {
+        "code": "Ok",
+        "path": "/directions-matrix/v1/mapbox/driving/0,0;1,1",
+    }
+    assert error == '401, Unauthorized, {"message": "Not Authorized"}'
+
+
+def test_plan_matrix_tiles():
+    from maps.apis.mapbox import plan_matrix_tiles
+
+    assert plan_matrix_tiles(list(range(25)), list(range(25)), 25) == [
+        (range(25), range(25))
+    ]
+    tiles = plan_matrix_tiles(list(range(30)), list(range(30)), 25)
+    assert len(tiles) == 6
+    assert all(len(rows) + len(cols) <= 25 for rows, cols in tiles)
+    cells = {(row, col) for rows, cols in tiles for row in rows for col in cols}
+    assert cells == {(row, col) for row in range(30) for col in range(30)}
+    # A single source needs one request per 9 destinations with driving-traffic.
+    assert len(plan_matrix_tiles([0], list(range(1, 19)), 10)) == 2
+
+
+def test_tiled_matrix():
+    from aiohttp import web
+
+    from maps.apis.mapbox import AsyncMapBoxApi
+    from maps.engine import run
+
+    requests = []
+
+    async def handler(request):
+        points = [int(p.split(",")[0]) for p in request.match_info["coords"].split(";")]
+        assert len(points) <= 25
+        requests.append(points)
+        sources = [points[int(i)] for i in request.query["sources"].split(";")]
+        destinations = [
+            points[int(i)] for i in request.query["destinations"].split(";")
+        ]
+        return web.json_response(
+            {
+                "code": "Ok",
+                "sources": [{"location": [p, 0]} for p in sources],
+                "destinations": [{"location": [p, 0]} for p in destinations],
+                "durations": [[s * 100 + d for d in destinations] for s in sources],
+            }
+        )
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/directions-matrix/v1/mapbox/driving/{coords}", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            client = AsyncMapBoxApi(f"http://127.0.0.1:{port}", credentials="token")
+            return await client.tiled_matrix(
+                "driving",
+                ";".join(f"{i},0" for i in range(40)),
+                sources="0;1;2;3;4;5;6;7;8;9;10;11;12;13;14;15;16;17;18;19;20;21",
+                destinations="all",
+                concurrency=4,
+            )
+        finally:
+            await runner.cleanup()
+
+    resp = run(main())
+    assert len(requests) == 6
+    assert resp["code"] == "Ok"
+    assert [s["location"][0] for s in resp["sources"]] == list(range(22))
+    assert [d["location"][0] for d in resp["destinations"]] == list(range(40))
+    assert resp["durations"] == [[s * 100 + d for d in range(40)] for s in range(22)]
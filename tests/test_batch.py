@@ -0,0 +1,79 @@
+"""Module to test batch helpers."""
+import io
+
+import numpy as np
+import pytest
+
+from maps.batch import geocode_batch, read_queries, snap_points
+
+
+def test_read_queries_csv():
+    fh = io.StringIO("id,query,lat,lon\n7,springfield,,\n8,,19.1,72.8\n")
+    assert list(read_queries(fh)) == [("7", "springfield"), ("8", (19.1, 72.8))]
+
+
+def test_read_queries_ndjson():
+    fh = io.StringIO('"springfield"\n\n{"address": "bonn"}\n')
+    assert list(read_queries(fh, input_format="ndjson", column="address")) == [
+        (0, "springfield"),
+        (1, "bonn"),
+    ]
+    with pytest.raises(ValueError):
+        list(read_queries(io.StringIO('{"foo": 1}\n'), input_format="ndjson"))
+
+
+def test_geocode_batch_reports_errors():
+    def geocode(query):
+        if query == "bad":
+            raise ValueError("boom")
+        return {"lat": 1.0, "lon": 2.0}
+
+    records = list(geocode_batch(geocode, [(0, "good"), (1, "bad")]))
+    assert records == [
+        {"id": 0, "query": "good", "lat": 1.0, "lon": 2.0},
+        {"id": 1, "query": "bad", "error": "boom"},
+    ]
+
+
+def test_geocode_batch_async():
+    async def geocode(query):
+        if query == "bad":
+            raise ValueError("boom")
+        return {"address": query.upper()}
+
+    records = list(geocode_batch(geocode, [(0, "bad"), (1, "good")], concurrency=2))
+    assert records == [
+        {"id": 0, "query": "bad", "error": "boom"},
+        {"id": 1, "query": "good", "address": "GOOD"},
+    ]
+
+
+def test_snap_points():
+    points = np.array(
+        [[50.70001, 7.1], [np.nan, np.nan], [50.8, 7.2], [50.69998, 7.10002]]
+        + [[np.nan, np.nan]]
+    )
+    first, cells = snap_points(points, 4)
+    assert first.tolist() == [0, 1, 2, 4]
+    assert cells.tolist() == [0, 1, 2, 0, 3]
+
+
+def test_geocode_batch_snap():
+    calls = []
+
+    def geocode(query):
+        calls.append(query)
+        return {"address": f"near {query}"}
+
+    queries = [(0, "50.70001,7.1"), (1, (50.69998, 7.10002)), (2, "bonn")]
+    queries += [(3, "50.8,7.2"), (4, "50.7,7.1")]
+    records = list(geocode_batch(geocode, queries, snap=4))
+    assert calls == [(50.7, 7.1), "bonn", (50.8, 7.2)]
+    assert [r["id"] for r in records] == [0, 1, 2, 3, 4]
+    assert records[1] == {
+        "id": 1,
+        "query": (50.69998, 7.10002),
+        "address": "near (50.7, 7.1)",
+    }
+    assert records[4]["address"] == "near (50.7, 7.1)"
+    assert records[2]["address"] == "near bonn"
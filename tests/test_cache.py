@@ -0,0 +1,144 @@
+"""Module to test the geocoding cache."""
+from click.testing import CliRunner
+from geopy.location import Location
+
+from maps.cache import (
+    MISS,
+    CachedGeocoder,
+    GeocodeCache,
+    NormalizingGeocoder,
+    cached_geolocator,
+    distance,
+    normalize_query,
+    reverse_distance,
+    reverse_point,
+)
+from maps.commands import maps
+from maps.normalize import AddressNormalizer
+
+
+def test_normalize_query():
+    assert normalize_query("  12 Main   St ") == "12 main st"
+    assert normalize_query("19.1, 72.8") == "19.1,72.8"
+    assert normalize_query((19.1, 72.8)) == normalize_query(["19.1", "72.8"])
+
+
+def test_get_set(tmp_path):
+    cache = GeocodeCache(str(tmp_path / "cache.sqlite"))
+    assert cache.get("osm", "forward", "bonn") is MISS
+    cache.set("osm", "forward", "Bonn", {"lat": 50.7})
+    assert cache.get("osm", "forward", " bonn") == {"lat": 50.7}
+    assert cache.get("here", "forward", "bonn") is MISS
+    assert cache.get("osm", "reverse", "bonn") is MISS
+    cache.set("osm", "forward", "nowhere", None)
+    assert cache.get("osm", "forward", "nowhere") is None
+
+
+def test_ttl(tmp_path):
+    cache = GeocodeCache(str(tmp_path / "cache.sqlite"), ttl=-1)
+    cache.set("osm", "forward", "bonn", {"lat": 50.7})
+    assert cache.get("osm", "forward", "bonn") is MISS
+
+
+def test_lru_eviction(tmp_path):
+    cache = GeocodeCache(str(tmp_path / "cache.sqlite"), max_size=20)
+    cache.set("osm", "forward", "a", "x" * 6)
+    cache.set("osm", "forward", "b", "x" * 6)
+    cache.get("osm", "forward", "a")
+    cache.set("osm", "forward", "c", "x" * 6)
+    assert cache.get("osm", "forward", "b") is MISS
+    assert cache.get("osm", "forward", "a") == "x" * 6
+    assert cache.get("osm", "forward", "c") == "x" * 6
+
+
+def test_replace_keeps_size(tmp_path):
+    cache = GeocodeCache(str(tmp_path / "cache.sqlite"), max_size=20)
+    cache.set("osm", "forward", "a", "x" * 6)
+    cache.set("osm", "forward", "a", "x" * 2)
+    assert cache._size == cache._total_size() == 4
+    for _ in range(5):
+        cache.set("osm", "forward", "b", "x" * 6)
+    assert cache._size == cache._total_size() == 12
+
+
+def test_cached_geocoder(tmp_path, mocker):
+    geolocator = mocker.Mock()
+    geolocator.geocode.return_value = Location("Bonn", (50.7, 7.1), {"id": 1})
+    cached = CachedGeocoder(geolocator, "osm", GeocodeCache(str(tmp_path / "c.sqlite")))
+    first = cached.geocode("Bonn")
+    second = cached.geocode("bonn")
+    assert geolocator.geocode.call_count == 1
+    assert (second.latitude, second.longitude, second.raw) == (50.7, 7.1, {"id": 1})
+    assert second.address == first.address
+
+
+def test_reverse_point():
+    assert reverse_point("50.7, 7.1") == (50.7, 7.1)
+    assert reverse_point(("50.7", 7.1)) == (50.7, 7.1)
+    assert reverse_point("Bonn") is None
+    assert round(distance((50.7, 7.1), (50.7001, 7.1))) == 11
+
+
+def test_reverse_distance(monkeypatch):
+    assert reverse_distance("osm") == 0
+    monkeypatch.setenv("MAPS_CACHE_REVERSE_DISTANCE", "25")
+    monkeypatch.setenv("MAPS_CACHE_REVERSE_DISTANCE_HERE", "5")
+    assert reverse_distance("osm") == 25
+    assert reverse_distance("here") == 5
+
+
+def test_nearest(tmp_path):
+    cache = GeocodeCache(str(tmp_path / "cache.sqlite"))
+    cache.set("osm", "reverse", "50.7,7.1", "a", point=(50.7, 7.1))
+    cache.set("osm", "reverse", "50.7002,7.1", "b", point=(50.7002, 7.1))
+    cache.set("here", "reverse", "50.70005,7.1", "c", point=(50.70005, 7.1))
+    assert cache.nearest("osm", (50.70004, 7.1), 50) == "a"
+    assert cache.nearest("osm", (50.70016, 7.1), 50) == "b"
+    assert cache.nearest("osm", (50.70004, 7.1), 1) is MISS
+    assert cache.nearest("osm", (50.8, 7.1), 50) is MISS
+    assert cache.nearest("here", (50.7, 7.1), 50) == "c"
+    cache.clear()
+    assert cache.nearest("osm", (50.7, 7.1), 50) is MISS
+
+
+def test_cached_geocoder_nearest_reverse(tmp_path, mocker):
+    geolocator = mocker.Mock()
+    geolocator.reverse.return_value = Location("Bonn", (50.7, 7.1), {})
+    cache = GeocodeCache(str(tmp_path / "c.sqlite"))
+    cached = CachedGeocoder(geolocator, "osm", cache, max_distance=20)
+    cached.reverse("50.70001,7.10001")
+    assert cached.reverse("50.70005,7.10002").address == "Bonn"
+    assert cached.reverse((50.70002, 7.1)).address == "Bonn"
+    assert geolocator.reverse.call_count == 1
+    cached.reverse("50.701,7.1")
+    assert geolocator.reverse.call_count == 2
+    CachedGeocoder(geolocator, "osm", cache).reverse("50.70003,7.1")
+    assert geolocator.reverse.call_count == 3
+
+
+def test_cached_geocoder_normalize(tmp_path, mocker):
+    geolocator = mocker.Mock()
+    geolocator.geocode.return_value = Location("Main", (1, 2), {})
+    cache = GeocodeCache(str(tmp_path / "c.sqlite"))
+    cached = NormalizingGeocoder(
+        CachedGeocoder(geolocator, "osm", cache), AddressNormalizer()
+    )
+    cached.geocode("12 Main St.")
+    cached.geocode("12 main street")
+    geolocator.geocode.assert_called_once_with("12 main street")
+
+
+def test_normalize_without_cache(mocker, monkeypatch):
+    monkeypatch.setenv("MAPS_ADDRESS_LOCALE", "en")
+    nominatim = mocker.patch("geopy.geocoders.Nominatim").return_value
+    nominatim.geocode.return_value = Location("Main", (1, 2), {})
+    runner = CliRunner()
+    result = runner.invoke(
+        maps, ["osm", "geocoding", "12 Main St.", "--no-cache"], catch_exceptions=False
+    )
+    assert result.exit_code == 0
+    nominatim.geocode.assert_called_once_with("12 main street")
+
+    client = mocker.Mock()
+    cached_geolocator(client, "ors", no_cache=True).pelias_search(text="1 Elm Ave")
+    client.pelias_search.assert_called_once_with(text="1 elm avenue")
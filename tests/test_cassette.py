@@ -0,0 +1,132 @@
+"""Module to test the recording and replay of responses."""
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from maps.cassette import Cassette, Recording
+from maps.exceptions import ApiError, CassetteMissError
+from maps.transport import get_session
+
+
+@pytest.fixture
+def cassette_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "cassette.sqlite")
+    monkeypatch.setenv("MAPS_CASSETTE", path)
+    return path
+
+
+def _response(request, status=200, body=b'{"ok": true}'):
+    resp = requests.Response()
+    resp.status_code = status
+    resp.reason = "OK"
+    resp.headers["Content-Type"] = "application/json"
+    resp._content = body
+    resp.url = request.url
+    resp.request = request
+    return resp
+
+
+def test_key(tmp_path):
+    cassette = Cassette(str(tmp_path / "cassette.sqlite"))
+    key = cassette.key(
+        "get", "https://API.mapbox.com/geocoding/v5/a%20b.json?b=2&access_token=x"
+    )
+    assert key == "GET api.mapbox.com /geocoding/v5/a b.json b=2 -"
+    assert key == cassette.key(
+        "GET",
+        "https://api.mapbox.com/geocoding/v5/a b.json",
+        params={"access_token": "y", "b": 2, "apiKey": "z"},
+    )
+    assert cassette.key("POST", "https://overpass-api.de/api/interpreter", body="a")
+    assert cassette.key("POST", "https://a.b/", body="a") != cassette.key(
+        "POST", "https://a.b/", body="b"
+    )
+    path_only = Cassette(str(tmp_path / "cassette.sqlite"), match=("method", "path"))
+    assert path_only.key("GET", "https://a.b/c?d=1") == "GET /c"
+    with pytest.raises(ValueError):
+        Cassette(str(tmp_path / "cassette.sqlite"), match=("url",))
+    with pytest.raises(ValueError):
+        Cassette(str(tmp_path / "cassette.sqlite"), mode="rewind")
+
+
+def test_record_replay(cassette_path, monkeypatch, mocker):
+    send = mocker.patch.object(
+        HTTPAdapter, "send", side_effect=lambda request, **kwargs: _response(request)
+    )
+    url = "https://api.tomtom.com/search/2/geocode/bonn.json"
+    monkeypatch.setenv("MAPS_CASSETTE_MODE", "record")
+    assert get_session().get(url, params={"key": "a"}).json() == {"ok": True}
+    assert send.call_count == 1
+    assert len(Cassette.from_env()) == 1
+
+    monkeypatch.setenv("MAPS_CASSETTE_MODE", "replay")
+    resp = get_session().get(url, params={"key": "b"})
+    assert send.call_count == 1
+    assert (resp.status_code, resp.json()) == (200, {"ok": True})
+    assert resp.headers["Content-Type"] == "application/json"
+    with pytest.raises(CassetteMissError):
+        get_session().get(url, params={"limit": 1})
+
+    monkeypatch.setenv("MAPS_CASSETTE_MODE", "update")
+    get_session().get(url, params={"limit": 1})
+    get_session().get(url, params={"key": "c"})
+    assert send.call_count == 2
+
+
+def test_retried_status_not_recorded(cassette_path, monkeypatch, mocker):
+    monkeypatch.setenv("MAPS_CASSETTE_MODE", "record")
+    monkeypatch.setenv("MAPS_RETRY_MAX_ATTEMPTS", "1")
+    mocker.patch.object(
+        HTTPAdapter,
+        "send",
+        side_effect=lambda request, **kwargs: _response(request, status=503),
+    )
+    assert get_session().get("https://api.tomtom.com/").status_code == 503
+    assert len(Cassette.from_env()) == 0
+
+
+def test_async_replay(cassette_path):
+    from geopy.geocoders import Nominatim
+
+    from maps.adapters import PooledAioHTTPAdapter
+    from maps.apis.apis import AsyncApi
+    from maps.engine import run
+
+    cassette = Cassette(cassette_path, mode="record")
+    key = cassette.key(
+        "GET", "https://api.mapbox.com/directions-matrix/v1/mapbox/driving/0,0;1,1"
+    )
+    cassette.record(key, 200, "OK", "application/json", b'{"code": "Ok"}')
+    denied = cassette.key("GET", "https://api.mapbox.com/isochrone/v1/mapbox/x/0,0")
+    cassette.record(denied, 401, "Unauthorized", "application/json", b"{}")
+    search = cassette.key("GET", "https://nominatim.openstreetmap.org/search")
+    assert search == "GET nominatim.openstreetmap.org /search - -"
+    body = b'[{"lat": "50.7", "lon": "7.1", "display_name": "Bonn"}]'
+    cassette.record(
+        "GET nominatim.openstreetmap.org /search format=json&limit=1&q=bonn -",
+        200,
+        "OK",
+        "application/json; charset=utf-8",
+        body,
+    )
+    cassette.close()
+    replayed = Cassette.from_env().lookup(denied)
+    assert replayed == Recording(401, "Unauthorized", "application/json", b"{}")
+
+    async def main():
+        client = AsyncApi("https://api.mapbox.com", credentials="token")
+        resp = await client.get(
+            path="/directions-matrix/v1/mapbox/driving/0,0;1,1",
+            params={"access_token": "token"},
+        )
+        with pytest.raises(ApiError):
+            await client.get(path="/isochrone/v1/mapbox/x/0,0")
+        geolocator = Nominatim(
+            user_agent="maps-cli-test", adapter_factory=PooledAioHTTPAdapter
+        )
+        location = await geolocator.geocode("bonn")
+        return resp, location
+
+    resp, location = run(main())
+    assert resp.json() == {"code": "Ok"}
+    assert location.address == "Bonn"
@@ -0,0 +1,74 @@
+"""Module to test the asyncio engine."""
+import asyncio
+import time
+
+from maps.engine import imap_ordered, imap_unordered, run
+
+
+def test_imap_ordered_keeps_input_order():
+    def slow_first(item):
+        time.sleep(0.05 if item == 0 else 0)
+        return item * 2
+
+    assert list(imap_ordered(slow_first, range(10), concurrency=3, window=3)) == [
+        i * 2 for i in range(10)
+    ]
+
+
+def test_imap_ordered_yields_when_ready():
+    def slow_input():
+        for item in range(10):
+            yield item
+            time.sleep(0.05)
+
+    started = time.monotonic()
+    results = imap_ordered(lambda item: item, slow_input(), concurrency=2)
+    assert next(results) == 0
+    assert time.monotonic() - started < 0.2
+    assert list(results) == list(range(1, 10))
+
+
+def test_imap_ordered_bounds_concurrency():
+    in_flight, peak = 0, 0
+
+    async def work(item):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01 * (5 - item % 5))
+        in_flight -= 1
+        return item
+
+    assert list(imap_ordered(work, range(50), concurrency=5)) == list(range(50))
+    assert peak == 5
+
+
+def test_imap_unordered_yields_on_completion():
+    in_flight, peak = 0, 0
+
+    async def work(item):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.2 if item == 0 else 0.01)
+        in_flight -= 1
+        return item
+
+    results = list(imap_unordered(work, range(10), concurrency=3))
+    assert sorted(results) == list(range(10))
+    assert results[-1] == 0
+    assert peak == 3
+
+    def blocking(item):
+        time.sleep(0.1 if item == 0 else 0)
+        return item
+
+    assert list(imap_unordered(blocking, range(4), concurrency=2))[-1] == 0
+
+
+def test_run():
+    async def add(a, b):
+        await asyncio.sleep(0)
+        return a + b
+
+    assert run(add(1, 2)) == 3
@@ -0,0 +1,149 @@
+"""Module to test geocoding over a fallback chain of providers."""
+import json
+import time
+
+import openrouteservice
+import pytest
+import requests
+from click.testing import CliRunner
+from geopy.exc import GeocoderServiceError
+from geopy.location import Location
+
+from maps import fallback
+from maps.cache import cached_geolocator
+from maps.commands import maps
+from maps.exceptions import ProvidersUnavailableError
+from maps.fallback import CircuitBreaker, FallbackGeocoder, OrsGeocoder
+from maps.transport import get_session, ors_client
+
+
+def test_circuit_breaker(mocker):
+    now = mocker.patch("maps.fallback.time.monotonic", return_value=0)
+    breaker = CircuitBreaker(failure_threshold=2, latency_threshold=1, reset_timeout=10)
+    breaker.record(None)
+    assert breaker.state == "closed"
+    breaker.record(0.5)
+    breaker.record(None)
+    assert breaker.allow()
+    # A slow call counts as a failure.
+    breaker.record(2)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    now.return_value = 11
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record(None)
+    assert breaker.state == "open"
+    now.return_value = 22
+    assert breaker.allow()
+    breaker.record(0.1)
+    assert breaker.state == "closed"
+
+
+def test_fallback_geocoder(mocker):
+    failing, healthy = mocker.Mock(), mocker.Mock()
+    failing.geocode.side_effect = GeocoderServiceError("503")
+    healthy.geocode.return_value = Location("Bonn", (50.7, 7.1), {})
+    geolocator = FallbackGeocoder(
+        [("here", failing), ("osm", healthy)], failure_threshold=2
+    )
+    for _ in range(4):
+        provider, location = geolocator.geocode("bonn")
+        assert provider == "osm"
+        assert location.address == "Bonn"
+    assert failing.geocode.call_count == 2
+    healthy.geocode.assert_called_with("bonn", timeout=5.0)
+
+    healthy.geocode.side_effect = GeocoderServiceError("502")
+    with pytest.raises(ProvidersUnavailableError, match="here: circuit open; osm: 502"):
+        geolocator.geocode("bonn")
+
+
+def test_failing_leg_is_not_retried(mocker, monkeypatch):
+    monkeypatch.setenv("HERE_APIKEY", "dummy")
+    monkeypatch.setenv("MAPS_RATE_LIMITS", "here=1/m")
+    hits = []
+
+    def unavailable(request, **kwargs):
+        hits.append(request.url)
+        response = requests.Response()
+        response.status_code = 503
+        response.url = request.url
+        response.request = request
+        response._content = b"{}"
+        return response
+
+    mocker.patch("requests.adapters.HTTPAdapter.send", side_effect=unavailable)
+    healthy = mocker.Mock()
+    healthy.geocode.return_value = Location("Bonn", (50.7, 7.1), {})
+    geolocator = FallbackGeocoder(
+        [
+            ("here", fallback.provider_geolocator("here", no_cache=True)),
+            ("osm", healthy),
+        ],
+        latency_threshold=2.0,
+    )
+    started = time.monotonic()
+    assert geolocator.geocode("bonn")[0] == "osm"
+    assert time.monotonic() - started < 1
+    assert len(hits) == 1
+    assert geolocator.breakers["here"].failures == 1
+    # The next request would wait a minute for the rate limit, so the leg fails at once.
+    started = time.monotonic()
+    assert geolocator.geocode("bonn")[0] == "osm"
+    assert time.monotonic() - started < 1
+    assert len(hits) == 1
+    assert geolocator.breakers["here"].failures == 2
+
+
+def test_geocoding_command(mocker, monkeypatch):
+    monkeypatch.setenv("HERE_APIKEY", "dummy")
+    monkeypatch.delenv("MAPBOX_APIKEY", raising=False)
+    monkeypatch.delenv("TOMTOM_APIKEY", raising=False)
+    monkeypatch.delenv("ORS_APIKEY", raising=False)
+    here = mocker.patch("geopy.geocoders.Here").return_value
+    here.geocode.side_effect = GeocoderServiceError("503")
+    nominatim = mocker.patch("geopy.geocoders.Nominatim").return_value
+    nominatim.geocode.return_value = Location("Bonn", (50.7, 7.1), {})
+    runner = CliRunner()
+    result = runner.invoke(
+        maps, ["geocoding", "bonn", "--no-cache"], catch_exceptions=False
+    )
+    assert result.exit_code == 0
+    assert json.loads(result.output) == {"provider": "osm", "lat": 50.7, "lon": 7.1}
+
+    result = runner.invoke(
+        maps,
+        ["batch-geocoding", "--providers", "here", "--no-cache", "-"],
+        input="query\nbonn\n",
+        catch_exceptions=False,
+    )
+    assert json.loads(result.output) == {"id": 0, "query": "bonn", "error": "here: 503"}
+
+    result = runner.invoke(maps, ["geocoding", "bonn", "--providers", "tomtom"])
+    assert result.exit_code == 2
+    assert "TOMTOM_APIKEY" in result.output
+
+
+def test_ors_geocoder_timeout(mocker):
+    get = mocker.patch.object(get_session(), "get")
+    get.return_value.status_code = 200
+    get.return_value.json.return_value = {"features": []}
+    client = ors_client("dummy")
+    geolocator = OrsGeocoder(cached_geolocator(client, "ors"))
+    assert geolocator.geocode("bonn", timeout=2.5) is None
+    assert get.call_args[1]["timeout"] == 2.5
+    assert geolocator.reverse("50.7,7.1", timeout=1.5) is None
+    assert get.call_args[1]["timeout"] == 1.5
+    # The shared client keeps its own timeout.
+    assert client._requests_kwargs["timeout"] == 60
+    assert ors_client("dummy").pelias_search(text="bonn") == {"features": []}
+    assert get.call_args[1]["timeout"] == 60
+
+    # A failing server is not retried past the timeout.
+    get.reset_mock()
+    get.return_value.status_code = 503
+    with pytest.warns(UserWarning), pytest.raises(openrouteservice.exceptions.Timeout):
+        OrsGeocoder(client).geocode("bonn", timeout=0.5)
+    assert get.call_count <= 3
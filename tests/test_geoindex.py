@@ -0,0 +1,115 @@
+"""Module to test the offline address index."""
+import json
+import os
+
+from click.testing import CliRunner
+from geopy.adapters import BaseAsyncAdapter
+from geopy.location import Location
+
+from maps.commands import maps
+from maps.engine import run
+from maps.geoindex import (
+    AddressIndex,
+    LocalGeocoder,
+    format_address,
+    is_specific,
+    match_expression,
+    read_places,
+)
+
+OPENADDRESSES = (
+    "LON,LAT,NUMBER,STREET,UNIT,CITY,DISTRICT,REGION,POSTCODE,ID,HASH\n"
+    "7.1,50.7,1,Kaiserplatz,,Bonn,,,53113,,a1\n"
+    "7.2,50.8,10,Kaiserplatz,,Bonn,,,53113,,a2\n"
+    "6.9,50.9,1,Domkloster,,Köln,,,50667,,a3\n"
+    ",,2,Nowhere,,Bonn,,,,,a4\n"
+)
+
+
+def write_extract(tmp_path, content=OPENADDRESSES, name="bonn.csv"):
+    path = tmp_path / name
+    path.write_text(content, encoding="utf-8")
+    return str(path)
+
+
+def test_format_address():
+    assert format_address("1", "Kaiserplatz", city="Bonn", postcode="53113") == (
+        "1 Kaiserplatz, Bonn 53113"
+    )
+    assert format_address(city="Bonn") == "Bonn"
+    assert match_expression("1, Kaiserplatz") == '"1" "kaiserplatz"'
+    assert match_expression(" , ") is None
+
+
+def test_read_openaddresses(tmp_path):
+    places = list(read_places(write_extract(tmp_path)))
+    assert len(places) == 3
+    assert places[0] == ("a1", "1 Kaiserplatz, Bonn 53113", 50.7, 7.1)
+
+
+def test_lookup(tmp_path):
+    with AddressIndex(str(tmp_path / "index.sqlite")) as index:
+        index.add(write_extract(tmp_path))
+        assert index.lookup("10 kaiserplatz bonn")["ref"] == "a2"
+        assert index.lookup("1 Kaiserplatz")["ref"] == "a1"
+        assert index.lookup("1 Domkloster, Köln")["lat"] == 50.9
+        assert index.lookup("1 unknown street") is None
+        assert index.lookup("bonn") is None
+        assert index.lookup("kaiserplatz bonn") is None
+    assert is_specific("Kölner Dom", "Kolner Dom, Köln")
+    assert not is_specific("Main Street", "12 Main Street, Springfield")
+
+
+def test_incremental_build(tmp_path):
+    path = write_extract(tmp_path)
+    with AddressIndex(str(tmp_path / "index.sqlite")) as index:
+        assert [s["places"] for s in index.build([path])] == [3]
+        assert [s["updated"] for s in index.build([path])] == [False]
+
+        write_extract(tmp_path, OPENADDRESSES.splitlines()[0] + "\n")
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 1))
+        assert [s["places"] for s in index.build([path])] == [0]
+        assert index.lookup("kaiserplatz") is None
+
+
+def test_local_geocoder(mocker, tmp_path):
+    geolocator = mocker.Mock()
+    geolocator.geocode.return_value = Location("Remote", (1, 2), {})
+    with AddressIndex(str(tmp_path / "index.sqlite")) as index:
+        index.add(write_extract(tmp_path))
+        local = LocalGeocoder(index, geolocator)
+        assert local.geocode("1 kaiserplatz").point[:2] == (50.7, 7.1)
+        assert local.geocode("remote place").address == "Remote"
+        assert local.geocode("Bonn").address == "Remote"
+        assert geolocator.geocode.call_count == 2
+
+        geolocator.adapter = mocker.Mock(spec=BaseAsyncAdapter)
+        local = LocalGeocoder(index, geolocator)
+        location = run(local.geocode("1 kaiserplatz"))
+        assert location.raw["display_name"] == "1 Kaiserplatz, Bonn 53113"
+
+
+def test_build_index_command(mocker, tmp_path):
+    geolocator = mocker.patch("geopy.geocoders.Nominatim").return_value
+    geolocator.geocode.return_value = Location("Remote", (1, 2), {})
+    index = str(tmp_path / "index.sqlite")
+    path = write_extract(tmp_path)
+    runner = CliRunner()
+    result = runner.invoke(
+        maps, ["osm", "build-index", f"--index={index}", path], catch_exceptions=False
+    )
+    assert json.loads(result.output) == {"file": path, "places": 3, "updated": True}
+
+    for query, expected in [("1 Kaiserplatz", 50.7), ("Elsewhere", 1)]:
+        result = runner.invoke(
+            maps,
+            ["osm", "geocoding", f"--index={index}", "--no-cache", query],
+            catch_exceptions=False,
+        )
+        assert json.loads(result.output)["lat"] == expected
+    assert geolocator.geocode.call_count == 1
+
+    result = runner.invoke(maps, ["osm", "build-index", f"--index={index}", index])
+    assert result.exit_code == 2
+    assert "Unsupported extract" in result.output
@@ -0,0 +1,149 @@
+"""Module to test hedged requests."""
+import asyncio
+import threading
+import time
+
+import requests
+from aiohttp import web
+
+from maps.apis.apis import Api, AsyncApi
+from maps.engine import run
+from maps.hedging import HedgePolicy
+
+
+def make_policy(budget=1.0):
+    policy = HedgePolicy(percentile=50, budget=budget, min_samples=3)
+    for latency in (0.01, 0.02, 0.03):
+        policy.record(latency)
+    return policy
+
+
+def test_delay():
+    policy = HedgePolicy(percentile=90, min_samples=3)
+    assert policy.delay() is None
+    for latency in (0.3, 0.1, 0.2, 0.4):
+        policy.record(latency)
+    assert policy.delay() == 0.4
+    policy.percentile = 50
+    assert policy.delay() == 0.3
+
+
+def test_budget():
+    policy = HedgePolicy(budget=0.1, min_hedges=0)
+    for _ in range(9):
+        policy.start()
+    assert not policy.acquire()
+    policy.start()
+    assert policy.acquire()
+    assert not policy.acquire()
+
+
+def test_min_hedges():
+    policy = HedgePolicy(budget=0.05)
+    policy.start()
+    assert policy.acquire()
+    assert not policy.acquire()
+    assert not HedgePolicy(budget=0).acquire()
+
+
+def test_send_hedges_few_requests():
+    policy = make_policy(budget=0.05)
+    release = threading.Event()
+
+    def send_once():
+        if not release.is_set():
+            release.set()
+            time.sleep(0.5)
+            return "slow"
+        return "fast"
+
+    assert policy.send(send_once) == "fast"
+    assert (policy.requests, policy.hedges) == (1, 1)
+
+
+def test_send_hedges_slow_request():
+    policy = make_policy()
+    release = threading.Event()
+    calls = []
+
+    def send_once():
+        calls.append(len(calls))
+        if len(calls) == 1:
+            release.wait(5)
+            return "slow"
+        return "fast"
+
+    started = time.monotonic()
+    assert policy.send(send_once) == "fast"
+    release.set()
+    assert time.monotonic() - started < 1
+    assert policy.hedges == 1
+
+
+def test_send_without_budget():
+    policy = make_policy(budget=0)
+    calls = []
+
+    def send_once():
+        calls.append(1)
+        time.sleep(0.1)
+        return "only"
+
+    assert policy.send(send_once) == "only"
+    assert len(calls) == 1
+
+
+def test_send_failed_hedge():
+    policy = make_policy()
+    calls = []
+
+    def send_once():
+        calls.append(1)
+        if len(calls) == 1:
+            time.sleep(0.1)
+            return "first"
+        raise requests.ConnectionError("reset")
+
+    assert policy.send(send_once) == "first"
+
+
+def test_api_hedges_get_only(mocker):
+    policy = make_policy()
+    resp = requests.Response()
+    resp.status_code = 200
+    session = mocker.Mock()
+    session.request.return_value = resp
+    send = mocker.spy(policy, "send")
+    api = Api("https://example.com", None, session=session, hedge=policy)
+    assert api.get(path="/a") is resp
+    api("POST", path="/b")
+    assert send.call_count == 1
+
+
+def test_async_api_hedges():
+    async def main():
+        calls = []
+
+        async def handler(request):
+            calls.append(1)
+            if len(calls) == 1:
+                await asyncio.sleep(2)
+            return web.json_response({"call": len(calls)})
+
+        app = web.Application()
+        app.router.add_get("/", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            api = AsyncApi(f"http://127.0.0.1:{port}", None, hedge=make_policy())
+            started = time.monotonic()
+            resp = await api.get(path="/")
+            assert time.monotonic() - started < 1
+            return resp.json()
+        finally:
+            await runner.cleanup()
+
+    assert run(main()) == {"call": 2}
@@ -11,7 +11,13 @@ def test_show():
     """Test here show command."""
     runner = CliRunner()
     result = runner.invoke(maps, ["here", "show"], catch_exceptions=False)
-    assert result.output.split() == ["geocoding", "discover", "route"]
+    assert result.output.split() == [
+        "geocoding",
+        "batch-geocoding",
+        "discover",
+        "route",
+        "batch-route",
+    ]
 
 
 def test_geocoding_fwd():
@@ -265,3 +271,67 @@ def test_mock_display(mocker):
         ],
     )
     assert result.exit_code == 0
+
+
+def test_batch_route(mocker, monkeypatch):
+    monkeypatch.setenv("HERE_APIKEY", "key")
+    ls_client = mocker.patch("maps.here.ls_client")
+    ls = ls_client.return_value
+    ls.car_route.side_effect = lambda origin, destination, **kwargs: mocker.Mock(
+        routes=[{"origin": origin, "destination": destination, "via": kwargs["via"]}]
+    )
+    ls.truck_route.side_effect = RuntimeError("Truck not allowed")
+    runner = CliRunner()
+    result = runner.invoke(
+        maps,
+        ["here", "batch-route", "--concurrency=2", "-"],
+        input="id,origin,destination,transport_mode,via\n"
+        'a,"52.5,13.4","52.6,13.5",,"52.55,13.45;52.58,13.48"\n'
+        'b,"52.5,13.4","52.6,13.5",truck,\n'
+        'c,"52.5,13.4",,,\n'
+        'd,"52.5,13.4","52.6,13.5",plane,\n',
+        catch_exceptions=False,
+    )
+    assert result.exit_code == 0
+    records = {r["id"]: r for r in map(json.loads, result.output.splitlines())}
+    assert records["a"]["routes"] == [
+        {
+            "origin": [52.5, 13.4],
+            "destination": [52.6, 13.5],
+            "via": [[52.55, 13.45], [52.58, 13.48]],
+        }
+    ]
+    assert records["b"] == {"id": "b", "error": "Truck not allowed"}
+    assert records["c"]["error"] == "Record has no origin or destination."
+    assert records["d"]["error"] == "Unknown transport mode: plane"
+    assert ls_client.call_count == 1
+
+
+def test_route_return(mocker, monkeypatch):
+    monkeypatch.setenv("HERE_APIKEY", "key")
+    ls = mocker.patch("maps.here.ls_client").return_value
+    summary = {"duration": 60, "length": 1000}
+    ls.truck_route.return_value.routes = [{"sections": [{"summary": summary}]}]
+    runner = CliRunner()
+    args = [
+        "here",
+        "route",
+        "--transport_mode=truck",
+        "--origin=52.5,13.4",
+        "--destination=52.6,13.5",
+        "--via=52.55,13.45",
+    ]
+    result = runner.invoke(maps, args + ["--return=summary"], catch_exceptions=False)
+    assert result.exit_code == 0
+    assert json.loads(result.output) == [{"sections": [{"summary": summary}]}]
+    kwargs = ls.truck_route.call_args[1]
+    assert kwargs["return_results"] == ["summary"]
+    assert kwargs["origin"] == [52.5, 13.4]
+    assert kwargs["via"] == [(52.55, 13.45)]
+
+    result = runner.invoke(maps, args + ["--return=summary,speed"])
+    assert result.exit_code == 2
+    assert "Unknown attributes speed" in result.output
+    result = runner.invoke(maps, args + ["--return=polyline,instructions"])
+    assert result.exit_code == 2
+    assert "instructions requires actions" in result.output
@@ -0,0 +1,208 @@
+"""Module to test cached and batch isochrones."""
+import io
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from maps.cache import GeocodeCache
+from maps.commands import maps
+from maps.isochrone import (
+    ContourUnion,
+    cached_isochrone,
+    isochrone_batch,
+    read_centers,
+    snap_center,
+)
+
+
+def make_client(mocker):
+    def isochrone(profile, coordinates, contours_minutes, **kwargs):
+        features = [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": coordinates},
+                "properties": {
+                    "contour": minute,
+                    "color": "#000000",
+                    "fill": "#000000",
+                },
+            }
+            for minute in reversed(contours_minutes)
+        ]
+        resp = mocker.Mock()
+        resp.json.return_value = {"features": features, "type": "FeatureCollection"}
+        return resp
+
+    client = mocker.Mock()
+    client.isochrone.side_effect = isochrone
+    return client
+
+
+def contours(feature_collection):
+    return [f["properties"]["contour"] for f in feature_collection["features"]]
+
+
+def test_snap_center():
+    assert snap_center(["-118.222581", "33.990379"]) == (-118.2226, 33.9904)
+    assert snap_center((7.123, 50.789), precision=1) == (7.1, 50.8)
+
+
+def test_split_and_merge(mocker):
+    client = make_client(mocker)
+    result = cached_isochrone(client, "driving", (7.1, 50.7), [5, 10, 15, 20, 25, 30])
+    assert contours(result) == [30, 25, 20, 15, 10, 5]
+    requested = [c[1]["contours_minutes"] for c in client.isochrone.call_args_list]
+    assert requested == [[5, 10, 15, 20], [25, 30]]
+
+
+def test_no_cache_keeps_center(mocker, tmp_path):
+    client = make_client(mocker)
+    cached_isochrone(client, "driving", ("7.100012", "50.700049"), [5])
+    assert client.isochrone.call_args[1]["coordinates"] == [7.100012, 50.700049]
+    cache = GeocodeCache(str(tmp_path / "isochrone.sqlite"))
+    cached_isochrone(client, "driving", (7.100012, 50.700049), [5], cache=cache)
+    assert client.isochrone.call_args[1]["coordinates"] == [7.1, 50.7]
+
+
+def test_contour_reuse(mocker, tmp_path):
+    client = make_client(mocker)
+    cache = GeocodeCache(str(tmp_path / "isochrone.sqlite"))
+    cached_isochrone(client, "driving", (7.10001, 50.7), [10, 20, 30], cache=cache)
+    result = cached_isochrone(client, "driving", (7.1, 50.70002), [20, 10], cache=cache)
+    assert contours(result) == [20, 10]
+    assert client.isochrone.call_count == 1
+
+    cached_isochrone(client, "driving", (7.1, 50.7), [5, 10], cache=cache)
+    assert client.isochrone.call_args[1]["contours_minutes"] == [5]
+    cached_isochrone(client, "walking", (7.1, 50.7), [10], cache=cache)
+    cached_isochrone(client, "driving", (7.1, 50.7), [10], cache=cache, polygons=True)
+    cached_isochrone(client, "driving", (7.1, 50.7), [10], cache=cache, refresh=True)
+    assert client.isochrone.call_count == 5
+
+
+def test_colors(mocker):
+    client = make_client(mocker)
+    result = cached_isochrone(
+        client, "driving", (7.1, 50.7), [10, 5], contours_colors=["ff0000", "00ff00"]
+    )
+    colors = {
+        f["properties"]["contour"]: f["properties"]["fill"] for f in result["features"]
+    }
+    assert colors == {10: "#ff0000", 5: "#00ff00"}
+    with pytest.raises(ValueError):
+        cached_isochrone(
+            client, "driving", (7.1, 50.7), [5], contours_colors=["a", "b"]
+        )
+
+
+def test_read_centers():
+    fh = io.StringIO('id,coordinates,lat,lon\na,"7.1,50.7",,\nb,,50.8,7.2\n')
+    assert list(read_centers(fh)) == [("a", (7.1, 50.7)), ("b", (7.2, 50.8))]
+
+
+def test_isochrone_batch(mocker):
+    client = make_client(mocker)
+    centers = [("a", (7.1, 50.7)), ("b", ("x", 50.8)), ("c", (7.3, 50.9))]
+    results = list(isochrone_batch(client, centers, "driving", [10, 5]))
+    assert [f["properties"]["id"] for f in results[0]["features"]] == ["a", "a"]
+    assert results[1]["geometry"] is None
+    assert results[1]["properties"]["id"] == "b"
+    assert "error" in results[1]["properties"]
+    assert contours(results[2]) == [10, 5]
+
+
+def test_batch_isochrone_command(mocker, monkeypatch):
+    monkeypatch.setenv("MAPBOX_APIKEY", "key")
+    client = make_client(mocker)
+    mocker.patch(
+        "maps.apis.mapbox.MapBoxApi.isochrone",
+        lambda self, **kwargs: client.isochrone(**kwargs),
+    )
+    runner = CliRunner()
+    result = runner.invoke(
+        maps,
+        [
+            "mapbox",
+            "batch-isochrone",
+            "--profile=driving",
+            "--contours_minutes=5,10",
+            "--input_format=ndjson",
+            "-",
+        ],
+        input='"7.1,50.7"\n{"id": "b", "lat": 50.8, "lon": 7.2}\n',
+        catch_exceptions=False,
+    )
+    assert result.exit_code == 0
+    lines = result.output.split("\n")[:-1]
+    assert len(lines) == 4
+    assert all(line.startswith("\x1e") for line in lines)
+    assert json.loads(lines[3][1:])["properties"] == {
+        "contour": 5,
+        "color": "#000000",
+        "fill": "#000000",
+        "id": "b",
+    }
+
+    result = runner.invoke(
+        maps,
+        ["mapbox", "batch-isochrone", "--profile=driving", "--contours_minutes=5"]
+        + ["--union", "-"],
+        input="",
+    )
+    assert result.exit_code == 2
+    assert "--union requires --polygons" in result.output
+
+
+@pytest.mark.parametrize(
+    "command,args,input",
+    [
+        ("isochrone", ["--coordinates=7.1,50.7"], ""),
+        ("batch-isochrone", ["-"], 'coordinates\n"7.1,50.7"\n'),
+    ],
+)
+def test_isochrone_hedge(mocker, monkeypatch, command, args, input):
+    monkeypatch.setenv("MAPBOX_APIKEY", "key")
+    api = mocker.patch("maps.mapbox.MapBoxApi")
+    api.return_value = make_client(mocker)
+    runner = CliRunner()
+    args = ["mapbox", command, "--profile=driving", "--contours_minutes=5"] + args
+    result = runner.invoke(
+        maps, args + ["--hedge", "95"], input=input, catch_exceptions=False
+    )
+    assert result.exit_code == 0
+    assert api.call_args[1]["hedge"].percentile == 95
+    assert api.return_value.isochrone.call_count == 1
+
+    result = runner.invoke(maps, args, input=input, catch_exceptions=False)
+    assert result.exit_code == 0
+    assert api.call_args[1]["hedge"] is None
+
+
+def test_contour_union():
+    pytest.importorskip("shapely")
+    square = {
+        "type": "Polygon",
+        "coordinates": [[[0, 0], [2, 0], [2, 2], [0, 2], [0, 0]]],
+    }
+    shifted = {
+        "type": "Polygon",
+        "coordinates": [[[1, 0], [3, 0], [3, 2], [1, 2], [1, 0]]],
+    }
+    union = ContourUnion()
+    for geometry in (square, shifted):
+        union.add(
+            {
+                "type": "FeatureCollection",
+                "features": [
+                    {"geometry": geometry, "properties": {"contour": 5}},
+                    {"geometry": geometry, "properties": {"contour": 10}},
+                ],
+            }
+        )
+    features = union.features()
+    assert [f["properties"] for f in features] == [
+        {"contour": 10, "count": 2},
+        {"contour": 5, "count": 2},
+    ]
+    assert features[0]["geometry"]["type"] == "Polygon"
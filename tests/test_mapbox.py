@@ -10,7 +10,9 @@ def test_show():
     """Test mapbox show command."""
     runner = CliRunner()
     result = runner.invoke(maps, ["mapbox", "show"], catch_exceptions=False)
-    assert result.output == "geocoding\nisochrone\nmatrix\n"
+    assert result.output == (
+        "geocoding\nbatch-geocoding\nisochrone\nbatch-isochrone\nmatrix\n"
+    )
 
 
 def test_geocoding_fwd():
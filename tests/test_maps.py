@@ -1,9 +1,43 @@
 """Test maps main command group."""
+import subprocess
+import sys
+
+import click
 from click.testing import CliRunner
 
 from maps import __version__
 from maps.commands import maps
 
+HEAVY_MODULES = {
+    "geopy",
+    "overpy",
+    "geojsonio",
+    "here_location_services",
+    "openrouteservice",
+    "aiohttp",
+    "numpy",
+}
+
+
+def _imported_modules(args):
+    """Run the CLI with ``-X importtime``, return imported modules and the cumulative
+    import time of ``maps.commands`` in microseconds."""
+    code = f"from maps.commands import maps; maps({args!r}, standalone_mode=False)"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if line.startswith("import time:") and "[us]" not in line:
+            _, total, name = line.split("|")
+            modules[name.strip()] = int(total)
+    cumulative = modules["maps.commands"]
+    return set(modules), cumulative
+
 
 def test_version():
     assert __version__ == "0.0.4"
@@ -14,3 +48,32 @@ def test_show():
     runner = CliRunner()
     result = runner.invoke(maps, ["show"], catch_exceptions=False)
     assert result.output.split() == ["osm", "here", "mapbox", "tomtom", "ors"]
+
+
+def test_startup_imports():
+    """Provider SDKs must not be imported at startup or for unrelated commands."""
+    modules, cumulative = _imported_modules(["show"])
+    assert not modules & (HEAVY_MODULES | {"maps.osm", "maps.here", "requests"})
+    assert cumulative < 300000
+
+    modules, _ = _imported_modules(["osm", "show"])
+    assert "maps.batch" in modules
+    assert not modules & (HEAVY_MODULES | {"maps.here", "maps.mapbox"})
+
+
+def test_entry_point_providers(mocker):
+    @click.group()
+    def plugin():
+        """A provider from another package."""
+
+    entry_point = mocker.Mock()
+    entry_point.name = "plugin"
+    entry_point.load.return_value = plugin
+    mocker.patch("maps.utils._entry_points", return_value=[entry_point])
+    mocker.patch.object(maps, "_entry_points", None)
+    runner = CliRunner()
+    result = runner.invoke(maps, ["show"], catch_exceptions=False)
+    assert result.output.split() == ["osm", "here", "mapbox", "tomtom", "ors", "plugin"]
+    result = runner.invoke(maps, ["plugin", "--help"], catch_exceptions=False)
+    assert "A provider from another package." in result.output
+    maps.commands.pop("plugin")
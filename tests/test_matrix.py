@@ -0,0 +1,83 @@
+"""Module to test binary and columnar matrix output."""
+import csv
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+
+from maps.commands import maps
+from maps.matrix import long_format, matrix_arrays, write_matrix
+
+RESULT = {
+    "code": "Ok",
+    "durations": [[0.0, 10.5, None], [12.0, 0.0, 7.25]],
+    "distances": [[0.0, 100.0, None], [120.0, 0.0, 70.0]],
+    "sources": [{"location": [7.1, 50.7]}, {"location": [7.2, 50.8]}],
+    "destinations": [{"location": [7.1, 50.7]}, {"location": [7.2, 50.8]}, None],
+}
+
+
+def test_matrix_arrays():
+    arrays = matrix_arrays(RESULT)
+    assert list(arrays) == ["durations", "distances"]
+    assert arrays["durations"].shape == (2, 3)
+    assert np.isnan(arrays["durations"][0, 2])
+    columns = long_format(arrays)
+    assert columns["origin"].tolist() == [0, 0, 0, 1, 1, 1]
+    assert columns["destination"].tolist() == [0, 1, 2, 0, 1, 2]
+    assert columns["distance"][3] == 120
+
+
+def test_write_npy_npz(tmp_path):
+    path = str(tmp_path / "m.npy")
+    write_matrix({"durations": RESULT["durations"]}, path)
+    durations = np.load(path)
+    assert durations[1, 2] == 7.25 and np.isnan(durations[0, 2])
+    with pytest.raises(ValueError):
+        write_matrix(RESULT, path)
+
+    path = str(tmp_path / "m.npz")
+    write_matrix(RESULT, path)
+    with np.load(path) as data:
+        assert sorted(data) == ["destinations", "distances", "durations", "sources"]
+        assert data["distances"][1, 0] == 120
+        assert np.isnan(data["destinations"][2]).all()
+
+
+def test_write_csv(tmp_path):
+    path = str(tmp_path / "m.csv")
+    write_matrix(RESULT, path)
+    with open(path) as fh:
+        rows = list(csv.reader(fh))
+    assert rows[0] == ["origin", "destination", "duration", "distance"]
+    assert rows[2] == ["0", "1", "10.5", "100.0"]
+    assert rows[3] == ["0", "2", "", ""]
+    assert len(rows) == 7
+    with pytest.raises(ValueError):
+        write_matrix(RESULT, str(tmp_path / "m.json"))
+
+
+def test_write_arrow(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    path = str(tmp_path / "m.arrow")
+    write_matrix(RESULT, path)
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+    assert table.column_names == ["origin", "destination", "duration", "distance"]
+    assert table.column("duration").null_count == 1
+
+
+def test_matrix_output(mocker, monkeypatch, tmp_path):
+    monkeypatch.setenv("MAPBOX_APIKEY", "key")
+    mocker.patch("maps.apis.mapbox.MapBoxApi.tiled_matrix", return_value=RESULT)
+    path = str(tmp_path / "m.npz")
+    runner = CliRunner()
+    args = ["mapbox", "matrix", "--profile=driving", "--coordinates=7.1,50.7;7.2,50.8"]
+    result = runner.invoke(maps, args + ["--output", path], catch_exceptions=False)
+    assert result.exit_code == 0
+    assert result.output == ""
+    with np.load(path) as data:
+        assert data["durations"].shape == (2, 3)
+    result = runner.invoke(maps, args + ["--output", str(tmp_path / "m.npy")])
+    assert result.exit_code == 2
+    assert ".npy holds a single matrix" in result.output
@@ -0,0 +1,48 @@
+"""Module to test address normalization."""
+import pytest
+
+from maps.normalize import AddressNormalizer, address_normalizer, fold
+
+
+def test_fold():
+    assert fold("Köln, Champs-Élysées") == "Koln, Champs-Elysees"
+    assert fold("Bonn") == "Bonn"
+
+
+@pytest.mark.parametrize(
+    "query,expected",
+    [
+        ("12 Main St.", "12 main street"),
+        ("  12 main   STREET ", "12 main street"),
+        (
+            "1600 Pennsylvania Ave. N.W.,Washington",
+            "1600 pennsylvania avenue nw, washington",
+        ),
+        ("St. Louis, MO", "st louis, mo"),
+        ("12 St Marks Pl", "12 st marks place"),
+        ("Hartford, CT", "hartford, ct"),
+    ],
+)
+def test_normalize_en(query, expected):
+    assert AddressNormalizer()(query) == expected
+
+
+def test_normalize_locales():
+    de = AddressNormalizer("de")
+    assert (
+        de("Hauptstr. 5, Köln") == de("Hauptstraße 5, Koln") == "hauptstrasse 5, koln"
+    )
+    fr = AddressNormalizer("fr")
+    assert fr("12 av. des Champs-Élysées") == "12 avenue des champs elysees"
+    assert fr("R. de Rivoli") == "rue de rivoli"
+    assert AddressNormalizer(fold_accents=False)("Köln") == "köln"
+    assert AddressNormalizer()((50.7, 7.1)) == (50.7, 7.1)
+    with pytest.raises(ValueError):
+        AddressNormalizer("xx")
+
+
+def test_address_normalizer(monkeypatch):
+    assert address_normalizer() is None
+    monkeypatch.setenv("MAPS_ADDRESS_LOCALE", "fr")
+    assert address_normalizer().locale == "fr"
+    assert address_normalizer("off") is None
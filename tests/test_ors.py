@@ -11,7 +11,7 @@ def test_show():
     """Test ors show command."""
     runner = CliRunner()
     result = runner.invoke(maps, ["ors", "show"], catch_exceptions=False)
-    assert result.output.split() == ["geocoding"]
+    assert result.output.split() == ["geocoding", "batch-geocoding"]
 
 
 def test_geocoding_fwd():
@@ -72,3 +72,24 @@ def test_ors_reverse_geocoding():
     assert result2.exit_code == 0
     res = json.loads(result2.output)
     assert res["properties"]["label"] == "Navi Mumbai, MH, India"
+
+
+def test_batch_geocoding_snap(mocker):
+    client = mocker.patch("maps.ors.ors_client").return_value
+    client.pelias_reverse.return_value = {
+        "features": [{"properties": {"label": "Mumbai"}}]
+    }
+    runner = CliRunner()
+    result = runner.invoke(
+        maps,
+        ["ors", "batch-geocoding", "--reverse", "--snap=3", "--no-cache", "-"],
+        input='query\n"72.85618,19.16153"\n"72.85621,19.16171"\n',
+        env={"ORS_APIKEY": "dummy"},
+        catch_exceptions=False,
+    )
+    assert result.exit_code == 0
+    assert [json.loads(line)["address"] for line in result.output.splitlines()] == [
+        "Mumbai"
+    ] * 2
+    assert client.pelias_reverse.call_count == 1
+    assert list(client.pelias_reverse.call_args[1]["point"]) == [72.856, 19.162]
@@ -2,6 +2,8 @@
 import json
 
 from click.testing import CliRunner
+from geopy.adapters import BaseAsyncAdapter
+from geopy.location import Location
 from pytest import approx
 
 from maps.commands import maps
@@ -11,7 +13,7 @@ def test_show():
     """Test osm show command."""
     runner = CliRunner()
     result = runner.invoke(maps, ["osm", "show"], catch_exceptions=False)
-    assert result.output == "geocoding\noverpass\n"
+    assert result.output == "geocoding\nbatch-geocoding\nbuild-index\noverpass\n"
 
 
 def test_geocoding_fwd():
@@ -96,3 +98,68 @@ def test_mock_display(mocker):
         catch_exceptions=False,
     )
     assert result.exit_code == 0
+
+
+def test_batch_geocoding(mocker):
+    geolocator = mocker.patch("geopy.geocoders.Nominatim").return_value
+    geolocator.adapter = mocker.Mock(spec=BaseAsyncAdapter)
+    geolocator.geocode = mocker.AsyncMock(
+        side_effect=lambda query: Location(query, (len(query), 0.5), {})
+    )
+    runner = CliRunner()
+    result = runner.invoke(
+        maps,
+        ["osm", "batch-geocoding", "--concurrency=2", "-"],
+        input="id,query\na,springfield\nb,bonn\n",
+        catch_exceptions=False,
+    )
+    assert result.exit_code == 0
+    assert [json.loads(line) for line in result.output.splitlines()] == [
+        {"id": "a", "query": "springfield", "lat": 11, "lon": 0.5},
+        {"id": "b", "query": "bonn", "lat": 4, "lon": 0.5},
+    ]
+
+    result = runner.invoke(
+        maps,
+        ["--format", "csv", "osm", "batch-geocoding", "-"],
+        input="id,query\na,springfield\n",
+        catch_exceptions=False,
+    )
+    assert result.output.splitlines() == [
+        "id,query,lat,lon,error",
+        "a,springfield,11.0,0.5,",
+    ]
+
+
+def test_geocoding_cache(mocker):
+    geolocator = mocker.patch("geopy.geocoders.Nominatim").return_value
+    geolocator.reverse.return_value = Location("Bonn", (50.7, 7.1), {})
+    runner = CliRunner()
+    for args in [[], [], ["--no-cache"], ["--refresh"]]:
+        result = runner.invoke(
+            maps,
+            ["osm", "geocoding", "--reverse", "50.7,7.1"] + args,
+            catch_exceptions=False,
+        )
+        assert result.output == "Bonn\n"
+    assert geolocator.reverse.call_count == 3
+
+
+def test_batch_geocoding_snap(mocker):
+    geolocator = mocker.patch("geopy.geocoders.Nominatim").return_value
+    geolocator.adapter = mocker.Mock(spec=BaseAsyncAdapter)
+    geolocator.reverse = mocker.AsyncMock(
+        side_effect=lambda query: Location("Bonn", query, {})
+    )
+    runner = CliRunner()
+    result = runner.invoke(
+        maps,
+        ["osm", "batch-geocoding", "--reverse", "--snap=3", "--no-cache", "-"],
+        input="lat,lon\n50.7001,7.1\n50.6999,7.1002\n50.8,7.2\n",
+        catch_exceptions=False,
+    )
+    assert result.exit_code == 0
+    assert [json.loads(line)["address"] for line in result.output.splitlines()] == [
+        "Bonn"
+    ] * 3
+    assert geolocator.reverse.call_count == 2
@@ -0,0 +1,78 @@
+"""Module to test the output formats."""
+import json
+
+import pytest
+
+from maps.output import Writer
+
+RECORDS = [
+    {"id": 1, "lat": 50.7, "lon": 7.1, "tags": {"name": "Köln"}},
+    {"id": 2, "lat": None, "lon": None, "tags": {}},
+]
+
+
+def write(output_format, records, **kwargs):
+    with Writer(output_format, **kwargs) as writer:
+        for record in records:
+            writer.write(record)
+
+
+def test_json(capsys):
+    write("json", [{"lat": 1.5, "lon": 2}])
+    assert capsys.readouterr().out == '{\n  "lat": 1.5,\n  "lon": 2\n}\n'
+    write("json", ["Köln"])
+    assert capsys.readouterr().out == "Köln\n"
+    write("json", RECORDS, many=True)
+    assert json.loads(capsys.readouterr().out) == RECORDS
+    write("json", [], many=True)
+    assert capsys.readouterr().out == "[]\n"
+
+
+def test_ndjson(capsys):
+    write("ndjson", [RECORDS])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == '{"id":1,"lat":50.7,"lon":7.1,"tags":{"name":"Köln"}}'
+    assert [json.loads(line) for line in lines] == RECORDS
+
+
+def test_csv(capsys):
+    write("csv", RECORDS)
+    assert capsys.readouterr().out.splitlines() == [
+        "id,lat,lon,tags",
+        '1,50.7,7.1,"{""name"":""Köln""}"',
+        "2,,,{}",
+    ]
+    write("csv", [{"id": "a", "error": "No result found"}], fields=["id", "lat"])
+    assert capsys.readouterr().out.splitlines() == ["id,lat", "a,"]
+
+
+def test_geojsonseq(capsys):
+    collection = {
+        "type": "FeatureCollection",
+        "features": [{"type": "Feature", "geometry": None, "properties": {}}] * 2,
+    }
+    write("geojsonseq", RECORDS + [collection])
+    out = capsys.readouterr().out
+    assert out.startswith("\x1e")
+    features = [json.loads(text) for text in out.split("\x1e")[1:]]
+    assert features[0] == {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [7.1, 50.7]},
+        "properties": {"id": 1, "tags": {"name": "Köln"}},
+    }
+    assert features[1]["geometry"] is None
+    assert len(features) == 4
+
+
+def test_buffering(mocker):
+    echo = mocker.patch("maps.output.click.echo")
+    with Writer("ndjson", buffer_size=100) as writer:
+        for record in RECORDS * 10:
+            writer.write(record)
+        assert 0 < echo.call_count < 10
+    assert "".join(call.args[0] for call in echo.call_args_list).count("\n") == 20
+
+
+def test_invalid_format():
+    with pytest.raises(ValueError):
+        Writer("xml")
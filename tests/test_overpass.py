@@ -0,0 +1,169 @@
+"""Test module for the streaming Overpass client."""
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from maps.commands import maps
+from maps.exceptions import OverpassError
+from maps.overpass import parse_elements, split_bbox, tiled_query
+
+JSON_RESPONSE = json.dumps(
+    {
+        "version": 0.6,
+        "osm3s": {"timestamp_osm_base": "2021-03-01T00:00:00Z"},
+        "elements": [
+            {
+                "type": "node",
+                "id": 1,
+                "lat": 50.7,
+                "lon": 7.1,
+                "tags": {"name": "Köln"},
+            },
+            {"type": "node", "id": 2, "lat": 50.8, "lon": 7.2},
+            {"type": "way", "id": 3, "nodes": [1, 2], "tags": {"highway": "path"}},
+            {
+                "type": "relation",
+                "id": 4,
+                "members": [{"type": "way", "ref": 3, "role": ""}],
+                "tags": {"landuse": "forest"},
+            },
+        ],
+    },
+    ensure_ascii=False,
+).encode("utf-8")
+
+XML_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="Overpass API">
+<note>The data included in this document is from www.openstreetmap.org.</note>
+<node id="1" lat="50.7" lon="7.1"><tag k="name" v="Köln"/></node>
+<node id="2" lat="50.8" lon="7.2"/>
+<way id="3"><nd ref="1"/><nd ref="2"/><tag k="highway" v="path"/></way>
+<relation id="4"><member type="way" ref="3" role=""/><tag k="landuse" v="forest"/></relation>
+</osm>
+""".encode(
+    "utf-8"
+)
+
+EXPECTED = [
+    {"type": "node", "id": 1, "lat": 50.7, "lon": 7.1, "tags": {"name": "Köln"}},
+    {"type": "node", "id": 2, "lat": 50.8, "lon": 7.2},
+    {"type": "way", "id": 3, "nodes": [1, 2], "tags": {"highway": "path"}},
+    {
+        "type": "relation",
+        "id": 4,
+        "members": [{"type": "way", "ref": 3, "role": ""}],
+        "tags": {"landuse": "forest"},
+    },
+]
+
+
+def chunked(data, size=7):
+    return (data[i : i + size] for i in range(0, len(data), size))
+
+
+@pytest.mark.parametrize("response", [JSON_RESPONSE, XML_RESPONSE])
+def test_parse_elements(response):
+    assert list(parse_elements(chunked(response))) == EXPECTED
+
+
+@pytest.mark.parametrize("response", [JSON_RESPONSE, XML_RESPONSE])
+def test_parse_elements_incremental(response):
+    """The first element is available before the rest of the response is read."""
+    chunks = chunked(response, 1)
+    elements = parse_elements(chunks)
+    assert next(elements) == EXPECTED[0]
+    assert len(list(chunks)) > 0
+
+
+def test_parse_elements_runtime_error():
+    response = (
+        b'{"elements": [{"type": "node", "id": 1, "lat": 0, "lon": 0}],'
+        b'"remark": "runtime error: Query timed out in \\"query\\" at line 1."}'
+    )
+    elements = parse_elements(chunked(response))
+    assert next(elements)["id"] == 1
+    with pytest.raises(OverpassError, match="timed out"):
+        next(elements)
+
+
+def test_overpass_command(mocker):
+    resp = mocker.patch("maps.overpass.get_session").return_value.post.return_value
+    resp.__enter__ = lambda self: self
+    resp.__exit__ = lambda self, *args: None
+    resp.status_code = 200
+    resp.iter_content.side_effect = lambda chunk_size: chunked(JSON_RESPONSE, 64)
+    runner = CliRunner()
+    result = runner.invoke(
+        maps, ["osm", "overpass", "node;out;"], catch_exceptions=False
+    )
+    assert result.exit_code == 0
+    records = json.loads(result.output)
+    assert [(r["osm_type"], r["id"]) for r in records] == [
+        ("node", 1),
+        ("node", 2),
+        ("way", 3),
+        ("relation", 4),
+    ]
+    assert records[0] == {
+        "name": "Köln",
+        "latitude": 50.7,
+        "longitude": 7.1,
+        "id": 1,
+        "osm_type": "node",
+    }
+
+    result = runner.invoke(
+        maps,
+        ["--format", "geojsonseq", "osm", "overpass", "node;out;"],
+        catch_exceptions=False,
+    )
+    features = [json.loads(text) for text in result.output.split("\x1e") if text]
+    assert len(features) == 4
+    assert features[0]["geometry"] == {"type": "Point", "coordinates": [7.1, 50.7]}
+    assert features[2]["geometry"] is None
+
+
+def test_split_bbox():
+    assert split_bbox((0, 0, 2, 4), 2, 2) == [
+        (0, 0, 1, 2),
+        (0, 2, 1, 4),
+        (1, 0, 2, 2),
+        (1, 2, 2, 4),
+    ]
+
+
+def test_tiled_query(mocker):
+    queries = []
+
+    def fake_stream_query(query, url):
+        queries.append(query)
+        south, west, north, east = map(float, query[5:-6].split(","))
+        if north - south > 1:
+            raise OverpassError("runtime error: Query timed out in query at line 1.")
+        # Node 0 is on every tile, node 1 only on the south-west one.
+        elements = [{"type": "node", "id": 0}, {"type": "way", "id": 0}]
+        if south == west == 0:
+            elements.append({"type": "node", "id": 1})
+        return iter(elements)
+
+    mocker.patch("maps.overpass.stream_query", side_effect=fake_stream_query)
+    elements = list(
+        tiled_query("node({{bbox}});out;", (0, 0, 4, 4), grid=2, max_depth=1)
+    )
+    assert sorted((e["type"], e["id"]) for e in elements) == [
+        ("node", 0),
+        ("node", 1),
+        ("way", 0),
+    ]
+    assert len(queries) == 4 + 16
+
+    with pytest.raises(OverpassError):
+        list(tiled_query("node({{bbox}});out;", (0, 0, 4, 4), grid=2, max_depth=0))
+
+
+def test_overpass_command_bbox():
+    runner = CliRunner()
+    result = runner.invoke(maps, ["osm", "overpass", "node;out;", "--bbox", "0,0,1,1"])
+    assert result.exit_code == 2
+    assert "{{bbox}}" in result.output
@@ -0,0 +1,84 @@
+"""Module to test flexible polyline decoding and simplification."""
+import flexpolyline
+import numpy as np
+import pytest
+
+from maps.polyline import (
+    decode,
+    decode_header,
+    douglas_peucker,
+    encode,
+    route_features,
+    simplify,
+    simplify_routes,
+    visvalingam,
+)
+
+POINTS = [
+    (50.1022829, 8.6982122, 10),
+    (50.1020076, 8.6956695, 20),
+    (50.1006313, 8.6914960, 5),
+]
+
+
+@pytest.mark.parametrize(
+    "coordinates, precision, third_dim, third_dim_precision",
+    [
+        (POINTS, 5, flexpolyline.ELEVATION, 0),
+        ([p[:2] for p in POINTS], 7, flexpolyline.ABSENT, 0),
+        ([(-89.9, -179.9, -3.5), (89.9, 179.9, 8848.86)], 6, flexpolyline.ALTITUDE, 2),
+    ],
+)
+def test_decode(coordinates, precision, third_dim, third_dim_precision):
+    encoded = flexpolyline.encode(
+        coordinates, precision, third_dim, third_dim_precision
+    )
+    expected = np.array(flexpolyline.decode(encoded))
+    coords = decode(encoded)
+    assert coords.shape == expected.shape
+    assert np.allclose(coords[:, 0], expected[:, 1])
+    assert np.allclose(coords[:, 1], expected[:, 0])
+    assert np.allclose(coords[:, 2:], expected[:, 2:])
+    header = decode_header(encoded)
+    assert tuple(header) == (precision, third_dim, third_dim_precision)
+    assert encode(coords, header) == encoded
+
+
+@pytest.mark.parametrize("encoded", ["", "!", "B", "CFoz5x", "BFoz5xJ67i1B1B7PzIhaxL7"])
+def test_decode_invalid(encoded):
+    with pytest.raises(ValueError):
+        decode(encoded)
+
+
+def test_douglas_peucker():
+    line = np.array([[0, 0], [1, 0.1], [2, -0.1], [3, 5], [4, 6.2], [5, 7], [6, 8.1]])
+    assert douglas_peucker(line, 0.5).tolist() == [0, 2, 3, 6]
+    assert douglas_peucker(line, 0).tolist() == list(range(7))
+    assert douglas_peucker(line[:2], 1).tolist() == [0, 1]
+
+
+def test_visvalingam():
+    line = np.array([[0, 0], [1, 0.1], [2, -0.1], [3, 5], [4, 6.2], [5, 7], [6, 8.1]])
+    assert visvalingam(line, 0.5).tolist() == [0, 2, 3, 4, 6]
+    assert visvalingam(line, 100).tolist() == [0, 6]
+    with pytest.raises(ValueError):
+        simplify(line, "zz", 1)
+
+
+def test_routes():
+    encoded = flexpolyline.encode(
+        [(50 + i / 1000, 8 + i / 1000, i) for i in range(100)], 5, 3, 0
+    )
+    routes = [{"id": "r", "sections": [{"id": "s", "polyline": encoded}]}]
+    features = route_features(routes)["features"]
+    assert len(features) == 1
+    assert features[0]["properties"] == {"id": "s"}
+    assert features[0]["geometry"]["coordinates"][1] == [8.001, 50.001, 1.0]
+
+    features = route_features(routes, "dp", 0.0001)["features"]
+    assert features[0]["geometry"]["coordinates"] == [
+        [8.0, 50.0, 0.0],
+        [8.099, 50.099, 99.0],
+    ]
+    simplify_routes(routes, "vw", 0.0001)
+    assert len(decode(routes[0]["sections"][0]["polyline"])) == 2
@@ -0,0 +1,76 @@
+"""Module to test the client side rate limiter."""
+import pytest
+import requests
+
+from maps import ratelimit, transport
+from maps.exceptions import RateLimitTimeoutError
+from maps.ratelimit import RateLimiter, parse_rate_limits
+
+
+def test_parse_rate_limits():
+    assert parse_rate_limits("osm=1/s; here=5/s,1000/d;tomtom=none") == {
+        "osm": [(1.0, 1.0)],
+        "here": [(5.0, 1.0), (1000.0, 86400.0)],
+        "tomtom": [],
+    }
+    with pytest.raises(ValueError):
+        parse_rate_limits("osm=1/w")
+
+
+def test_provider_and_credentials():
+    url = "https://geocode.search.hereapi.com/v1/geocode?q=bonn&apiKey=secret"
+    assert ratelimit.provider_for_url(url) == "here"
+    assert ratelimit.credentials_for_request(url) == "secret"
+    assert ratelimit.provider_for_url("https://example.com/?apiKey=secret") is None
+    assert (
+        ratelimit.credentials_for_request(
+            "https://api.openrouteservice.org/geocode/search",
+            {"Authorization": "ors-key"},
+        )
+        == "ors-key"
+    )
+
+
+def test_reserve(tmp_path, mocker):
+    now = mocker.patch("maps.ratelimit.time.time", return_value=1000.0)
+    path = str(tmp_path / "ratelimit.sqlite")
+    limiter = RateLimiter(path, limits={"osm": [(2, 1)], "here": [(1, 1), (2, 60)]})
+    assert [limiter.reserve("osm") for _ in range(4)] == [0, 0, 0.5, 1.0]
+    # Buckets are shared with other processes using the same database.
+    other = RateLimiter(path, limits=limiter.limits)
+    assert other.reserve("osm") == 1.5
+    # Each API key has its own buckets, unknown providers are not limited.
+    assert limiter.reserve("osm", "another-key") == 0
+    assert limiter.reserve("tomtom") == 0
+    # The strictest limit wins.
+    now.return_value = 1010.0
+    assert limiter.reserve("here") == 0
+    now.return_value = 1011.0
+    assert limiter.reserve("here") == 0
+    now.return_value = 1012.0
+    assert limiter.reserve("here") == pytest.approx(28)
+
+
+def test_deadline(tmp_path, mocker):
+    sleep = mocker.patch("maps.ratelimit.time.sleep")
+    limiter = RateLimiter(str(tmp_path / "ratelimit.sqlite"), limits={"osm": [(1, 1)]})
+    with ratelimit.deadline(2):
+        limiter.acquire("osm")
+        limiter.acquire("osm")
+        with pytest.raises(RateLimitTimeoutError):
+            limiter.acquire("osm")
+    assert sleep.call_count == 1
+    limiter.acquire("osm")
+    assert sleep.call_count == 2
+
+
+def test_session_is_rate_limited(mocker):
+    acquire = mocker.patch("maps.ratelimit.RateLimiter.acquire")
+    response = requests.Response()
+    response.status_code = 200
+    send = mocker.patch("requests.adapters.HTTPAdapter.send", return_value=response)
+    transport.get_session().get(
+        "https://api.mapbox.com/geocoding/v5/x.json", params={"access_token": "t"}
+    )
+    acquire.assert_called_once_with("mapbox", "t")
+    assert send.call_count == 1
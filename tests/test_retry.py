@@ -0,0 +1,117 @@
+"""Module to test retries of transient failures."""
+import pytest
+import requests
+from aiohttp import web
+from geopy.geocoders import Nominatim
+
+from maps import retry, transport
+from maps.adapters import PooledAioHTTPAdapter
+from maps.apis.apis import AsyncApi
+from maps.engine import run
+
+
+@pytest.fixture(autouse=True)
+def retry_policy(monkeypatch):
+    """Use the default retry policy."""
+    monkeypatch.delenv("MAPS_RETRY_MAX_ATTEMPTS", raising=False)
+    monkeypatch.delenv("MAPS_RETRY_MAX_TIME", raising=False)
+
+
+def make_response(status_code, headers=None):
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp.headers.update(headers or {})
+    resp._content = b""
+    resp._content_consumed = True
+    return resp
+
+
+def test_parse_retry_after():
+    assert retry.parse_retry_after("3") == 3
+    assert retry.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert retry.parse_retry_after("soon") is None
+    assert retry.parse_retry_after(None) is None
+
+
+def test_send_retries(mocker):
+    sleep = mocker.patch("maps.retry.time.sleep")
+    send = mocker.patch(
+        "requests.adapters.HTTPAdapter.send",
+        side_effect=[
+            make_response(503),
+            requests.ConnectionError("Connection reset by peer"),
+            make_response(429, {"Retry-After": "7"}),
+            make_response(200),
+        ],
+    )
+    resp = transport.get_session().get("https://retry.example.com/")
+    assert resp.status_code == 200
+    assert send.call_count == 4
+    assert sleep.call_count == 3
+    assert sleep.call_args_list[2] == mocker.call(7.0)
+    assert retry.stats[("retry.example.com", "retry")] == 3
+
+
+def test_send_gives_up(mocker, monkeypatch):
+    monkeypatch.setenv("MAPS_RETRY_MAX_ATTEMPTS", "2")
+    mocker.patch("maps.retry.time.sleep")
+    mocker.patch("requests.adapters.HTTPAdapter.send", return_value=make_response(503))
+    assert transport.get_session().get("https://example.com/").status_code == 503
+
+    # A Retry-After beyond the total retry time is not waited for.
+    monkeypatch.setenv("MAPS_RETRY_MAX_ATTEMPTS", "5")
+    monkeypatch.setenv("MAPS_RETRY_MAX_TIME", "10")
+    send = mocker.patch(
+        "requests.adapters.HTTPAdapter.send",
+        return_value=make_response(429, {"Retry-After": "60"}),
+    )
+    assert transport.get_session().get("https://example.com/").status_code == 429
+    assert send.call_count == 1
+
+    mocker.patch(
+        "requests.adapters.HTTPAdapter.send",
+        side_effect=requests.ConnectionError("Connection reset by peer"),
+    )
+    with pytest.raises(requests.ConnectionError):
+        transport.get_session().get("https://example.com/")
+
+
+def test_async_retries(mocker):
+    mocker.patch("maps.retry.RetryPolicy.backoff", return_value=0)
+    calls = []
+
+    async def handler(request):
+        calls.append(request.path)
+        if len(calls) % 3:
+            return web.Response(status=503)
+        if request.path == "/search":
+            return web.json_response(
+                [{"lat": "1.5", "lon": "2.5", "display_name": "Bonn"}]
+            )
+        return web.json_response({"code": "Ok"})
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/{tail:.*}", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            resp = await AsyncApi(f"http://127.0.0.1:{port}", None).get(path="/api")
+            geolocator = Nominatim(
+                user_agent="maps-cli-test",
+                domain=f"127.0.0.1:{port}",
+                scheme="http",
+                adapter_factory=PooledAioHTTPAdapter,
+            )
+            location = await geolocator.geocode("bonn")
+        finally:
+            await runner.cleanup()
+        return resp, location
+
+    resp, location = run(main())
+    assert resp.json() == {"code": "Ok"}
+    assert location.address == "Bonn"
+    assert calls == ["/api"] * 3 + ["/search"] * 3
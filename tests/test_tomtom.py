@@ -10,7 +10,7 @@ def test_show():
     """Test tomtom show command."""
     runner = CliRunner()
     result = runner.invoke(maps, ["tomtom", "show"], catch_exceptions=False)
-    assert result.output == "geocoding\n"
+    assert result.output == "geocoding\nbatch-geocoding\n"
 
 
 def test_geocoding_fwd():
@@ -0,0 +1,62 @@
+"""Module to test the shared HTTP transport."""
+from geopy.geocoders import Nominatim
+
+from maps import transport
+from maps.adapters import PooledRequestsAdapter
+from maps.apis.apis import Api
+
+
+def test_shared_session():
+    session = transport.get_session()
+    assert transport.get_session() is session
+    assert session.trust_env is False
+    assert Api(base_url="https://example.com", credentials=None).session is session
+    geolocator = Nominatim(
+        user_agent="maps-cli-test", adapter_factory=PooledRequestsAdapter
+    )
+    assert geolocator.adapter.session is session
+    assert transport.ors_client("dummy")._session is session
+
+
+def test_configure_pool_size():
+    session = transport.get_session()
+    transport.ensure_pool_size(64)
+    assert transport.get_session() is session
+    assert session.get_adapter("https://example.com")._pool_maxsize == 64
+    transport.configure(transport.DEFAULT_POOL_SIZE)
+    assert session.get_adapter("https://example.com")._pool_maxsize == 10
+
+
+def test_ls_client(mocker):
+    ls = transport.ls_client("dummy")
+    get = mocker.patch.object(transport.get_session(), "get")
+    ls.routing_api.get("https://router.hereapi.com/v8/routes", params={"a": 1})
+    get.assert_called_once_with(
+        "https://router.hereapi.com/v8/routes", params={"a": 1, "apiKey": "dummy"}
+    )
+
+
+def test_api_uses_session(mocker):
+    session = mocker.Mock()
+    session.request.return_value.status_code = 200
+    client = Api(base_url="https://example.com", credentials=None, session=session)
+    client.get(path="/foo", params={"a": 1})
+    assert session.request.call_args[0] == ("GET", "https://example.com/foo")
+
+
+def test_ls_module_requests(mocker):
+    from here_location_services import routing_api
+
+    transport.ls_client("dummy")
+    get = mocker.patch.object(transport.get_session(), "get")
+    routing_api.requests.get("https://router.hereapi.com/v8/routes", params={"a": 1})
+    get.assert_called_once_with("https://router.hereapi.com/v8/routes", params={"a": 1})
+
+
+def test_redirect_url(monkeypatch):
+    url = "https://api.mapbox.com/geocoding/v5/bonn.json?access_token=x"
+    assert transport.redirect_url(url) == url
+    monkeypatch.setenv("MAPS_REDIRECT_URL", "http://127.0.0.1:8080/")
+    assert transport.redirect_url(url) == (
+        "http://127.0.0.1:8080/api.mapbox.com/geocoding/v5/bonn.json?access_token=x"
+    )